@@ -6,6 +6,10 @@ import tkinter as tk
 import seaborn as sns
 
 class AnalyticsManager:
+    """Charts over read-only snapshots of the data (data_manager.snapshot),
+    so a chart never sees a collection change halfway through and no
+    collection is copied to draw it"""
+    
     def __init__(self, data_manager):
         self.data_manager = data_manager
         # Set style for all plots
@@ -22,14 +26,12 @@ class AnalyticsManager:
     
     def get_appointment_stats(self, doctor_id=None, days=30):
         """Get appointment statistics"""
-        appointments = self.data_manager.get_appointments()
-        if doctor_id:
-            appointments = [a for a in appointments if a['doctor_id'] == doctor_id]
-        
-        # Filter for last n days
+        # Last n days, answered from the doctor or date index (only the months in range are read)
         cutoff_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
-        recent_appointments = [a for a in appointments 
-                             if a['date'] >= cutoff_date]
+        query = {'date': {'$gte': cutoff_date}}
+        if doctor_id:
+            query['doctor_id'] = doctor_id
+        recent_appointments = self.data_manager.search_records('appointments', query)
         
         # Group by date and status
         daily_stats = {}
@@ -69,15 +71,18 @@ class AnalyticsManager:
     
     def plot_department_workload(self, frame):
         """Plot workload distribution across departments"""
-        users = self.data_manager.get_users()
-        doctors = [u for u in users if u['role'] == 'doctor']
+        # Users and appointments from the same moment
+        snapshot = self.data_manager.snapshot('users', 'appointments')
+        doctors = [u for u in snapshot['users'] if u['role'] == 'doctor']
+        
+        per_doctor = {}
+        for appointment in snapshot['appointments']:
+            per_doctor[appointment['doctor_id']] = per_doctor.get(appointment['doctor_id'], 0) + 1
         
         dept_appointments = {}
         for doctor in doctors:
             dept = doctor.get('department', 'Other')
-            appointments = [a for a in self.data_manager.get_appointments()
-                          if a['doctor_id'] == doctor['id']]
-            dept_appointments[dept] = dept_appointments.get(dept, 0) + len(appointments)
+            dept_appointments[dept] = dept_appointments.get(dept, 0) + per_doctor.get(doctor['id'], 0)
         
         fig, widget = self.create_chart_frame(frame)
         ax = fig.add_subplot(111)
@@ -104,7 +109,7 @@ class AnalyticsManager:
     
     def plot_medicine_stock(self, frame):
         """Plot current medicine stock levels"""
-        medicines = self.data_manager.get_medicines()
+        medicines = self.data_manager.snapshot('medicines')['medicines']
         
         # Sort by quantity
         medicines = sorted(medicines, key=lambda x: x['quantity'])[:10]
@@ -140,7 +145,7 @@ class AnalyticsManager:
     
     def plot_lab_test_distribution(self, frame):
         """Plot distribution of lab tests"""
-        reports = self.data_manager.get_lab_reports()
+        reports = self.data_manager.snapshot('lab_reports')['lab_reports']
         
         test_counts = {}
         for report in reports:
@@ -168,7 +173,7 @@ class AnalyticsManager:
     
     def plot_revenue_trends(self, frame):
         """Plot revenue trends"""
-        bills = self.data_manager.get_bills()
+        bills = self.data_manager.snapshot('bills')['bills']
         
         # Group by date
         daily_revenue = {}
@@ -202,7 +207,7 @@ class AnalyticsManager:
     
     def plot_patient_demographics(self, frame):
         """Plot patient age and gender distribution"""
-        patients = self.data_manager.get_patients()
+        patients = self.data_manager.snapshot('patients')['patients']
         
         # Calculate age from DOB
         ages = []
@@ -243,7 +248,7 @@ class AnalyticsManager:
     
     def plot_prescription_analysis(self, frame):
         """Plot prescription patterns"""
-        prescriptions = self.data_manager.get_prescriptions()
+        prescriptions = self.data_manager.snapshot('prescriptions')['prescriptions']
         
         # Analyze medicine frequency
         medicine_freq = {}
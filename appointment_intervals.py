@@ -0,0 +1,185 @@
+"""Per-doctor interval index over appointment times.
+
+Every appointment is parsed once into a [start, end) interval of epoch
+minutes and kept in its doctor's IntervalIndex: entries sorted by start,
+plus the longest duration the doctor has booked. An interval overlapping
+[start, end) must begin after start - longest and before end, so a
+conflict check is two bisects and a walk over the k entries in that
+span, O(log n + k), instead of parsing the doctor's appointments with
+strptime on every booking attempt.
+
+AppointmentIntervals keeps the indexes in step with an EventBus, the
+same way text_search and autocomplete do, so add_appointment,
+update_appointment and delete_appointment patch them as they write.
+Writes by other processes raise no events; the backend's
+external_version() notices them and the indexes are rebuilt.
+"""
+import bisect
+import threading
+from collections import Counter, defaultdict
+from datetime import date, datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_DURATION = 30  # minutes, for appointments without a readable duration
+
+_EPOCH = date(1970, 1, 1).toordinal()
+
+
+def duration_minutes(duration: Any) -> int:
+    """Minutes of a duration such as '30 min', '1 hour' or '1.5 hours'"""
+    text = str(duration or '')
+    try:
+        if 'min' in text:
+            return int(text.split()[0])
+        if 'hour' in text:
+            return int(float(text.split()[0]) * 60)
+    except ValueError:
+        pass
+    return DEFAULT_DURATION
+
+
+def epoch_minutes(moment: datetime) -> int:
+    return (moment.toordinal() - _EPOCH) * 1440 + moment.hour * 60 + moment.minute
+
+
+def appointment_interval(appointment: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+    """[start, end) of an appointment in epoch minutes, None if its date or time is unreadable"""
+    try:
+        day = date.fromisoformat(appointment['date']).toordinal() - _EPOCH
+        hour, minute = str(appointment['time']).split(':')
+        start = day * 1440 + int(hour) * 60 + int(minute)
+    except (KeyError, TypeError, ValueError):
+        return None
+    return start, start + duration_minutes(appointment.get('duration'))
+
+
+class IntervalIndex:
+    """[start, end) intervals of one doctor, sorted by start"""
+
+    def __init__(self):
+        self._entries: List[Tuple[int, int, Any]] = []  # (start, end, key)
+        self._intervals: Dict[Any, Tuple[int, int]] = {}
+        self._lengths: Counter = Counter()
+        self._longest = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def build(self, entries: List[Tuple[int, int, Any]]) -> None:
+        """Index many (start, end, key) entries with a single sort"""
+        for start, end, key in entries:
+            self._intervals[key] = (start, end)
+            self._lengths[end - start] += 1
+        self._entries = sorted((start, end, key) for key, (start, end) in self._intervals.items())
+        self._longest = max(self._lengths, default=0)
+
+    def add(self, key: Any, start: int, end: int) -> None:
+        self.remove(key)
+        bisect.insort(self._entries, (start, end, key))
+        self._intervals[key] = (start, end)
+        self._lengths[end - start] += 1
+        self._longest = max(self._longest, end - start)
+
+    def remove(self, key: Any) -> None:
+        interval = self._intervals.pop(key, None)
+        if interval is None:
+            return
+        start, end = interval
+        i = bisect.bisect_left(self._entries, (start, end, key))
+        del self._entries[i]
+        length = end - start
+        self._lengths[length] -= 1
+        if not self._lengths[length]:
+            del self._lengths[length]
+            if length == self._longest:
+                self._longest = max(self._lengths, default=0)
+
+    def overlapping(self, start: int, end: int) -> Iterator[Tuple[int, int, Any]]:
+        """(start, end, key) of the intervals overlapping [start, end), by start"""
+        entries = self._entries
+        # Nothing starting at or before start - longest can still be running
+        i = bisect.bisect_right(entries, (start - self._longest, float('inf')))
+        stop = bisect.bisect_left(entries, (end,))
+        for j in range(i, stop):
+            entry = entries[j]
+            if entry[1] > start:
+                yield entry
+
+
+class AppointmentIntervals:
+    """An IntervalIndex per doctor over the appointments collection, kept current from an EventBus"""
+
+    def __init__(self, backend: Any, bus: Any, collection: str = 'appointments'):
+        self.backend = backend
+        self.collection = collection
+        self._doctors: Optional[Dict[Any, IntervalIndex]] = None
+        self._owners: Dict[Any, Any] = {}  # appointment key -> doctor_id
+        self._version: Any = None  # backend.external_version() the indexes were built at
+        self._lock = threading.RLock()
+        bus.subscribe(self._on_change, collection)
+
+    def _key(self, appointment: Dict[str, Any]) -> Any:
+        return appointment.get(self.backend.collections[self.collection]['key'])
+
+    def _build(self) -> Dict[Any, IntervalIndex]:
+        version = self.backend.external_version(self.collection)
+        if self._doctors is None or version != self._version:
+            self._owners.clear()
+            self._version = version
+            doctors: Dict[Any, List[Tuple[int, int, Any]]] = defaultdict(list)
+            for appointment in self.backend.iter_records(self.collection):
+                interval = appointment_interval(appointment)
+                if interval is not None:
+                    key = self._key(appointment)
+                    doctors[appointment.get('doctor_id')].append((*interval, key))
+                    self._owners[key] = appointment.get('doctor_id')
+            self._doctors = {}
+            for doctor_id, entries in doctors.items():
+                self._doctors[doctor_id] = IntervalIndex()
+                self._doctors[doctor_id].build(entries)
+        return self._doctors
+
+    def build(self) -> None:
+        """Read the collection now (warm-up) rather than on the first check"""
+        with self._lock:
+            self._build()
+
+    def index(self, doctor_id: Any) -> IntervalIndex:
+        """The doctor's index (empty if they have no appointments), built now if needed"""
+        with self._lock:
+            return self._build().get(doctor_id) or IntervalIndex()
+
+    def conflicts(self, doctor_id: Any, start: datetime, end: datetime,
+                  exclude: Any = None) -> List[Dict[str, Any]]:
+        """The doctor's appointments overlapping [start, end), other than exclude"""
+        with self._lock:
+            keys = [key for *_, key in self.index(doctor_id).overlapping(epoch_minutes(start), epoch_minutes(end))
+                    if key != exclude]
+        return [r for r in (self.backend.get(self.collection, key) for key in keys) if r is not None]
+
+    def overlapping(self, start: datetime, end: datetime, doctor_id: Any = None) -> List[Dict[str, Any]]:
+        """Appointments overlapping [start, end), of one doctor or of all, by start time"""
+        low, high = epoch_minutes(start), epoch_minutes(end)
+        with self._lock:
+            doctors = self._build()
+            indexes = [doctors.get(doctor_id)] if doctor_id is not None else list(doctors.values())
+            entries = sorted(entry for index in indexes if index for entry in index.overlapping(low, high))
+        return [r for r in (self.backend.get(self.collection, key) for *_, key in entries) if r is not None]
+
+    def _on_change(self, event: Any) -> None:
+        with self._lock:
+            if self._doctors is None:
+                return  # built from the backend when first needed
+            if event.op == 'reload':
+                self._doctors = None
+                self._owners.clear()
+                return
+            if event.key in self._owners:
+                self._doctors[self._owners.pop(event.key)].remove(event.key)
+            if event.op == 'delete':
+                return
+            interval = appointment_interval(event.new)
+            if interval is not None:
+                doctor_id = event.new.get('doctor_id')
+                self._doctors.setdefault(doctor_id, IntervalIndex()).add(event.key, *interval)
+                self._owners[event.key] = doctor_id
@@ -0,0 +1,146 @@
+import gzip
+import json
+import os
+import shutil
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+TimeBound = Optional[Union[datetime, str]]
+
+
+class AuditLog:
+    """Append-only audit trail stored as JSON Lines.
+
+    Each entry is one line appended to the active segment, so logging costs
+    the same no matter how long the trail is. The active segment is rotated
+    once it grows past max_bytes or when the day changes; rotated segments
+    are named after the rotation time and optionally gzip-compressed.
+    """
+
+    def __init__(self, path: Union[str, Path], max_bytes: int = 5 * 1024 * 1024,
+                 rotate_daily: bool = True, compress: bool = True,
+                 legacy_path: Optional[Union[str, Path]] = None):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.compress = compress
+        self._lock = threading.RLock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if legacy_path is not None and Path(legacy_path).exists():
+            self._import_legacy(Path(legacy_path))
+
+    @staticmethod
+    def _bound(value: TimeBound) -> Optional[str]:
+        """Normalise a datetime/ISO string bound to an ISO string"""
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return value
+
+    def _segment_path(self, when: datetime) -> Path:
+        stamp = when.strftime('%Y%m%dT%H%M%S%f')
+        suffix = '.jsonl.gz' if self.compress else '.jsonl'
+        return self.path.with_name(f"{self.path.stem}-{stamp}{suffix}")
+
+    def _import_legacy(self, legacy_path: Path) -> None:
+        """Convert an old whole-file JSON audit log into a rotated segment"""
+        try:
+            with open(legacy_path, 'r') as f:
+                entries = json.load(f)
+        except (json.JSONDecodeError, FileNotFoundError):
+            entries = []
+
+        if entries:
+            last = entries[-1].get('timestamp')
+            when = datetime.fromisoformat(last) if last else datetime.now()
+            segment = self._segment_path(when)
+            opener = gzip.open if self.compress else open
+            with opener(segment, 'wt') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        legacy_path.unlink()
+
+    def _needs_rotation(self) -> bool:
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return False
+        if st.st_size == 0:
+            return False
+        if st.st_size >= self.max_bytes:
+            return True
+        if self.rotate_daily:
+            return datetime.fromtimestamp(st.st_mtime).date() != datetime.now().date()
+        return False
+
+    def rotate(self) -> Optional[Path]:
+        """Close the active segment and start a new one; returns the rotated file"""
+        with self._lock:
+            if not self.path.exists() or self.path.stat().st_size == 0:
+                return None
+            segment = self._segment_path(datetime.now())
+            if self.compress:
+                with open(self.path, 'rb') as src, gzip.open(segment, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                self.path.unlink()
+            else:
+                os.replace(self.path, segment)
+            return segment
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        """Append one entry, rotating the active segment first if needed"""
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._needs_rotation():
+                self.rotate()
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+    def segments(self) -> List[Path]:
+        """Rotated segments oldest first, followed by the active one"""
+        rotated = sorted(
+            p for p in self.path.parent.glob(f"{self.path.stem}-*")
+            if p.name.endswith(('.jsonl', '.jsonl.gz'))
+        )
+        if self.path.exists():
+            rotated.append(self.path)
+        return rotated
+
+    def _segment_end(self, segment: Path) -> Optional[str]:
+        """ISO time a rotated segment was closed (None for the active one)"""
+        if segment == self.path:
+            return None
+        stamp = segment.name[len(self.path.stem) + 1:].split('.')[0]
+        return datetime.strptime(stamp, '%Y%m%dT%H%M%S%f').isoformat()
+
+    def read(self, start: TimeBound = None, end: TimeBound = None,
+             user_id: Optional[str] = None, action: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Stream entries oldest first, filtered by time range, user and action.
+
+        Segments closed before start are skipped without being opened, and
+        reading stops at the first entry past end.
+        """
+        start, end = self._bound(start), self._bound(end)
+        for segment in self.segments():
+            segment_end = self._segment_end(segment)
+            if start and segment_end and segment_end < start:
+                continue
+
+            opener = gzip.open if segment.suffix == '.gz' else open
+            with opener(segment, 'rt') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    timestamp = entry.get('timestamp', '')
+                    if start and timestamp < start:
+                        continue
+                    if end and timestamp > end:
+                        return
+                    if user_id is not None and entry.get('user_id') != user_id:
+                        continue
+                    if action is not None and entry.get('action') != action:
+                        continue
+                    yield entry
@@ -0,0 +1,138 @@
+"""Prefix autocomplete for the patient and doctor pickers.
+
+Each record is listed under its key, its name, every word of its name
+and its label, lowercased, in one sorted array of (token, key) pairs. Completing a
+prefix is a bisect to the first token at or after it, then a walk
+forward until k distinct records are found, so the cost does not grow
+with the number of records. Pickers show "ID - Name" labels, the format
+the forms already parse.
+
+Autocomplete keeps an index per collection in step with an EventBus, the
+same way text_search does, and builds it again when the backend's
+external_version() shows another process changed the collection.
+"""
+import bisect
+import itertools
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Collections offered in pickers -> field shown and searched next to the key
+AUTOCOMPLETE_FIELDS = {
+    'patients': 'name',
+    'doctors': 'name',
+}
+
+# Suggestions shown in a drop-down
+AUTOCOMPLETE_LIMIT = 20
+
+
+def label(key: Any, name: Any) -> str:
+    return f"{key} - {name}"
+
+
+class PrefixIndex:
+    """Sorted (token, key) array with a label per key"""
+
+    def __init__(self):
+        self._entries: List[Tuple[str, Any]] = []
+        self._tokens: Dict[Any, List[str]] = {}
+        self._labels: Dict[Any, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._labels)
+
+    @staticmethod
+    def tokens(key: Any, name: Any) -> List[str]:
+        name = str(name or '')
+        words = name.lower().split()
+        return sorted({str(key).lower(), name.lower(), label(key, name).lower(), *words} - {''})
+
+    def build(self, items: Iterable[Tuple[Any, Any]]) -> None:
+        """Index many (key, name) pairs with a single sort"""
+        for key, name in items:
+            self._tokens[key] = self.tokens(key, name)
+            self._labels[key] = label(key, name)
+        self._entries = sorted((token, key) for key, tokens in self._tokens.items() for token in tokens)
+
+    def add(self, key: Any, name: Any) -> None:
+        self.remove(key)
+        self._tokens[key] = self.tokens(key, name)
+        self._labels[key] = label(key, name)
+        for token in self._tokens[key]:
+            bisect.insort(self._entries, (token, key))
+
+    def remove(self, key: Any) -> None:
+        for token in self._tokens.pop(key, ()):
+            i = bisect.bisect_left(self._entries, (token, key))
+            if i < len(self._entries) and self._entries[i] == (token, key):
+                del self._entries[i]
+        self._labels.pop(key, None)
+
+    def complete(self, prefix: str, limit: int = AUTOCOMPLETE_LIMIT) -> List[Any]:
+        """Keys of up to limit records with a token (key, name, a word of the
+        name or the label) starting with prefix, in alphabetical order of that token"""
+        prefix = prefix.lower().strip()
+        if not prefix:
+            return list(itertools.islice(self._labels, limit))
+        keys: Dict[Any, None] = {}
+        entries = self._entries
+        i = bisect.bisect_left(entries, (prefix,))
+        while i < len(entries) and len(keys) < limit and entries[i][0].startswith(prefix):
+            keys.setdefault(entries[i][1])
+            i += 1
+        return list(keys)
+
+    def label(self, key: Any) -> Optional[str]:
+        return self._labels.get(key)
+
+
+class Autocomplete:
+    """A PrefixIndex per picker collection, kept current from an EventBus"""
+
+    def __init__(self, backend: Any, bus: Any, fields: Dict[str, str] = AUTOCOMPLETE_FIELDS):
+        self.backend = backend
+        self.fields = dict(fields)
+        self._indexes: Dict[str, PrefixIndex] = {}
+        self._versions: Dict[str, Any] = {}  # backend.external_version() each index was built at
+        self._lock = threading.RLock()
+        bus.subscribe(self._on_change, *self.fields)
+
+    def index(self, collection: str) -> PrefixIndex:
+        """The collection's index, built now if needed"""
+        if collection not in self.fields:
+            raise ValueError(f"No autocomplete on {collection}")
+        with self._lock:
+            version = self.backend.external_version(collection)
+            index = self._indexes.get(collection)
+            if index is None or version != self._versions.get(collection):
+                self._versions[collection] = version
+                key_field = self.backend.collections[collection]['key']
+                field = self.fields[collection]
+                index = PrefixIndex()
+                index.build((r.get(key_field), r.get(field)) for r in self.backend.iter_records(collection))
+                self._indexes[collection] = index
+            return index
+
+    def complete(self, collection: str, prefix: str, limit: int = AUTOCOMPLETE_LIMIT) -> List[str]:
+        """"ID - Name" labels of up to limit records matching prefix"""
+        with self._lock:
+            index = self.index(collection)
+            return [index.label(key) for key in index.complete(prefix, limit)]
+
+    def records(self, collection: str, prefix: str, limit: int = AUTOCOMPLETE_LIMIT) -> List[Dict[str, Any]]:
+        """The records behind complete()"""
+        with self._lock:
+            keys = self.index(collection).complete(prefix, limit)
+        return [r for r in (self.backend.get(collection, key) for key in keys) if r is not None]
+
+    def _on_change(self, event: Any) -> None:
+        with self._lock:
+            index = self._indexes.get(event.collection)
+            if index is None:
+                return
+            if event.op == 'reload':
+                del self._indexes[event.collection]
+            elif event.op == 'delete':
+                index.remove(event.key)
+            else:
+                index.add(event.key, event.new.get(self.fields[event.collection]))
@@ -0,0 +1,25 @@
+import tkinter as tk
+from tkinter import ttk
+
+class AutocompleteCombobox(ttk.Combobox):
+    """Combobox whose drop-down holds only the best matches for the typed text
+    (refreshed on every key and when the list is opened).
+
+    complete(text) returns the values to offer, e.g.
+    lambda text: data_manager.autocomplete('patients', text)
+    """
+    
+    NAVIGATION_KEYS = {'Up', 'Down', 'Left', 'Right', 'Return', 'Escape', 'Tab', 'Home', 'End'}
+    
+    def __init__(self, parent, complete, **kwargs):
+        super().__init__(parent, postcommand=self.refresh, **kwargs)
+        self.complete = complete
+        self.bind('<KeyRelease>', self.on_key_release)
+        
+    def refresh(self):
+        self['values'] = self.complete(self.get())
+        
+    def on_key_release(self, event):
+        if event.keysym in self.NAVIGATION_KEYS:
+            return
+        self.refresh()
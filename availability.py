@@ -0,0 +1,336 @@
+"""Doctor working hours, parsed once.
+
+Working hours come from three sources, most specific first:
+
+- the schedules collection: recurring rules saved by DoctorModule.set_schedule
+  (weekday mask, start and end time, breaks, slot length, effective date
+  range) and schedules saved for a single date. Every record carries the
+  doctor's next revision when saved, and the newest record covering a
+  date wins, so a dated schedule is an exception to the rules before it.
+- the doctor record's own 'availability' ('Mon-Fri 9AM-5PM')
+- the bundled data/doctors.json ({'days': [...], 'timing': '09:00 AM - 05:00 PM'}),
+  read again whenever the file changes
+
+Each is parsed the first time it is needed into a Workday: sorted
+(start, end) minute ranges after midnight, breaks already cut out, and
+the minutes between slot starts. A doctor's week is seven of them, so
+checking a booking is a lookup and a comparison instead of re-reading
+the file and calling strptime. Change events on doctors and schedules
+drop just the entries they touch; changes made by another process raise
+no events, so the backend's external_version() of both collections is
+checked as well and drops everything parsed from a changed one.
+"""
+import json
+import os
+import re
+import threading
+import time
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple, Union
+
+SLOT_STEP = 15  # minutes between slot starts when no schedule gives a slot length
+RECHECK_SECONDS = 1.0  # how often the bundled file's modification time is looked at
+
+_DAY_NAMES = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+_TIME = re.compile(r'^\s*(\d{1,2})(?::(\d{2}))?\s*([ap]\.?m\.?)?\s*$', re.IGNORECASE)
+_WEEKLY = re.compile(r'^\s*(.*?)\s+(\d{1,2}(?::\d{2})?\s*[ap]m)\s*-\s*(\d{1,2}(?::\d{2})?\s*[ap]m)\s*$',
+                     re.IGNORECASE)
+
+
+def schedule_id(doctor_id: Any, day: str) -> str:
+    """Key of the schedule record of a doctor on a day ('YYYY-MM-DD')"""
+    return f"{doctor_id}:{day}"
+
+
+def rule_id(doctor_id: Any, revision: int) -> str:
+    """Key of a doctor's recurring schedule rule"""
+    return f"{doctor_id}:rule:{revision}"
+
+
+def weekday_mask(weekdays: Iterable[int]) -> int:
+    """A rule's 'weekdays': bit d set for weekday d (0 = Monday)"""
+    mask = 0
+    for weekday in weekdays:
+        mask |= 1 << weekday
+    return mask
+
+
+def is_rule(schedule: Dict[str, Any]) -> bool:
+    return 'weekdays' in schedule
+
+
+def next_revision(schedules: Iterable[Dict[str, Any]]) -> int:
+    """Revision for the next schedule record of a doctor with these records"""
+    return max((s.get('revision') or 0 for s in schedules), default=0) + 1
+
+
+def rule_applies(rule: Dict[str, Any], day: str) -> bool:
+    """Whether a rule covers a day ('YYYY-MM-DD')"""
+    return (bool(int(rule.get('weekdays') or 0) >> date.fromisoformat(day).weekday() & 1)
+            and (rule.get('start_date') or '') <= day
+            and (not rule.get('end_date') or day <= rule['end_date']))
+
+
+def day_schedule(schedules: Iterable[Dict[str, Any]], day: str) -> Optional[Dict[str, Any]]:
+    """The schedule in force on a day among a doctor's records, as a record
+    for that date (a rule is expanded into one), or None"""
+    best = None
+    for schedule in schedules:
+        if rule_applies(schedule, day) if is_rule(schedule) else schedule.get('date') == day:
+            if best is None or (schedule.get('revision') or 0) > (best.get('revision') or 0):
+                best = schedule
+    if best is None or not is_rule(best):
+        return best
+    return {'doctor_id': best.get('doctor_id'), 'date': day, 'rule_id': best.get('id'),
+            **{field: best.get(field) for field in
+               ('start_time', 'end_time', 'slot_duration', 'breaks', 'available', 'revision')}}
+
+
+def parse_time(text: Any) -> Optional[int]:
+    """Minutes after midnight of '09:30', '9:30 AM' or '5PM'; None if unreadable"""
+    match = _TIME.match(str(text or ''))
+    if not match:
+        return None
+    hour, minute, meridiem = int(match.group(1)), int(match.group(2) or 0), match.group(3)
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem[0].lower() == 'p' else 0)
+    if hour > 24 or minute > 59:
+        return None
+    return min(hour * 60 + minute, 24 * 60)
+
+
+def _weekdays(text: str) -> Set[int]:
+    text = text.strip().lower()
+    if text in ('daily', 'everyday', 'every day', 'all days'):
+        return set(range(7))
+    days: Set[int] = set()
+    for part in re.split(r'[,/&]|\band\b', text):
+        ends = [p.strip()[:3] for p in part.split('-')]
+        if not all(e in _DAY_NAMES for e in ends):
+            continue
+        first, last = _DAY_NAMES.index(ends[0]), _DAY_NAMES.index(ends[-1])
+        days.update(d % 7 for d in range(first, first + (last - first) % 7 + 1))
+    return days
+
+
+def weekly_hours(availability: Any) -> Optional[Tuple[Set[int], int, int]]:
+    """(weekdays, start, end minutes) of a weekly availability, None if unknown"""
+    if isinstance(availability, dict):
+        timing = str(availability.get('timing', ''))
+        start, _, end = timing.partition('-')
+        days = {_DAY_NAMES.index(d.strip().lower()[:3]) for d in availability.get('days', [])
+                if d.strip().lower()[:3] in _DAY_NAMES} or set(range(7))
+    elif isinstance(availability, str):
+        match = _WEEKLY.match(availability)
+        if not match:
+            return None
+        days, start, end = _weekdays(match.group(1)), match.group(2), match.group(3)
+    else:
+        return None
+    start, end = parse_time(start), parse_time(end)
+    if start is None or end is None or end <= start or not days:
+        return None
+    return days, start, end
+
+
+def format_minutes(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+class Workday(NamedTuple):
+    """A doctor's hours on one day"""
+    windows: Tuple[Tuple[int, int], ...]  # sorted (start, end) minutes after midnight
+    step: int = SLOT_STEP  # minutes between slot starts, counted from the first window
+
+    def contains(self, start: int, end: int) -> bool:
+        return any(low <= start and end <= high for low, high in self.windows)
+
+    def __str__(self) -> str:
+        return ', '.join(f"{format_minutes(low)}-{format_minutes(high)}" for low, high in self.windows) or 'off'
+
+
+OFF = Workday(())
+# What unknown hours count as: available at any time (is_available, SlotFinder)
+ALL_DAY = Workday(((0, 24 * 60),))
+
+
+def schedule_workday(schedule: Dict[str, Any]) -> Workday:
+    """Workday of a saved schedule record: its hours with the breaks cut out"""
+    start, end = parse_time(schedule.get('start_time')), parse_time(schedule.get('end_time'))
+    if not schedule.get('available', True) or start is None or end is None or end <= start:
+        return OFF
+    windows = [(start, end)]
+    for break_start, break_end in schedule.get('breaks') or []:
+        break_start, break_end = parse_time(break_start), parse_time(break_end)
+        if break_start is None or break_end is None:
+            continue
+        windows = [piece for low, high in windows
+                   for piece in ((low, min(high, break_start)), (max(low, break_end), high))
+                   if piece[0] < piece[1]]
+    try:
+        step = int(schedule.get('slot_duration') or SLOT_STEP)
+    except (TypeError, ValueError):
+        step = SLOT_STEP
+    return Workday(tuple(windows), max(step, 1))
+
+
+class _Schedules:
+    """One doctor's schedule records, parsed"""
+
+    def __init__(self, schedules: Iterable[Dict[str, Any]]):
+        self.dated: Dict[str, Tuple[int, Workday]] = {}
+        self.rules: List[Tuple[int, str, str, int, Workday]] = []  # newest first
+        for schedule in schedules:
+            revision = schedule.get('revision') or 0
+            if is_rule(schedule):
+                self.rules.append((revision, schedule.get('start_date') or '', schedule.get('end_date') or '',
+                                   int(schedule.get('weekdays') or 0), schedule_workday(schedule)))
+            else:
+                self.dated[schedule.get('date')] = (revision, schedule_workday(schedule))
+        self.rules.sort(key=lambda rule: rule[0], reverse=True)
+
+    def workday(self, day: date) -> Optional[Workday]:
+        text, bit = day.isoformat(), 1 << day.weekday()
+        revision, workday = self.dated.get(text, (-1, None))
+        for rule_revision, first, last, weekdays, rule_workday in self.rules:
+            if rule_revision <= revision:
+                break
+            if weekdays & bit and first <= text and (not last or text <= last):
+                return rule_workday
+        return workday
+
+
+class DoctorAvailability:
+    """Parsed working hours per doctor, kept current from an EventBus and the bundled file"""
+
+    def __init__(self, backend: Any, bus: Any = None, reference_path: Optional[str] = None):
+        self.backend = backend
+        self.reference_path = reference_path
+        self.generation = 0  # bumped whenever hours are dropped without a change event
+        self._weeks: Dict[Any, Optional[Tuple[Workday, ...]]] = {}  # None: hours unknown
+        self._schedules: Dict[Any, _Schedules] = {}
+        self._reference: Optional[Dict[Any, Any]] = None
+        self._reference_mtime: Optional[float] = None
+        self._checked = 0.0
+        self._versions: Dict[str, Any] = {}  # collection -> backend.external_version() last seen
+        self._lock = threading.RLock()
+        if bus is not None:
+            bus.subscribe(self._on_change, *(c for c in ('doctors', 'schedules') if c in backend.collections))
+
+    def _check_reference(self) -> None:
+        now = time.monotonic()
+        if self._reference is not None and now - self._checked < RECHECK_SECONDS:
+            return
+        self._checked = now
+        try:
+            mtime = os.path.getmtime(self.reference_path) if self.reference_path else None
+        except OSError:
+            mtime = None
+        if self._reference is not None and mtime == self._reference_mtime:
+            return
+        reference: Dict[Any, Any] = {}
+        if mtime is not None:
+            try:
+                with open(self.reference_path) as f:
+                    data = json.load(f)
+                doctors = data.get('doctors', []) if isinstance(data, dict) else data
+                reference = {d.get('id'): d.get('availability') for d in doctors}
+            except (OSError, ValueError, AttributeError):
+                pass
+        if self._reference is not None:
+            self._weeks.clear()
+            self.generation += 1
+        self._reference, self._reference_mtime = reference, mtime
+
+    def _check_collections(self) -> None:
+        """Drop what was parsed from doctors or schedules once someone else changed them"""
+        for collection, parsed in (('doctors', self._weeks), ('schedules', self._schedules)):
+            if collection not in self.backend.collections:
+                continue
+            version = self.backend.external_version(collection)
+            if self._versions.setdefault(collection, version) != version:
+                self._versions[collection] = version
+                parsed.clear()
+                self.generation += 1
+
+    def refresh(self) -> int:
+        """Read the bundled file, doctors and schedules again if they changed;
+        returns the generation"""
+        with self._lock:
+            self._check_reference()
+            self._check_collections()
+            return self.generation
+
+    def reference(self, doctor_id: Any) -> Any:
+        """The doctor's availability as written in the bundled file, or None"""
+        with self._lock:
+            self._check_reference()
+            return self._reference.get(str(doctor_id).split(' - ')[0])
+
+    def _week(self, doctor_id: Any) -> Optional[Tuple[Workday, ...]]:
+        if doctor_id not in self._weeks:
+            hours = None
+            if 'doctors' in self.backend.collections:
+                doctor = self.backend.get('doctors', doctor_id)
+                if doctor is not None:
+                    hours = weekly_hours(doctor.get('availability'))
+            if hours is None:
+                hours = weekly_hours(self._reference.get(doctor_id))
+            if hours is None:
+                self._weeks[doctor_id] = None
+            else:
+                days, start, end = hours
+                day = Workday(((start, end),))
+                self._weeks[doctor_id] = tuple(day if weekday in days else OFF for weekday in range(7))
+        return self._weeks[doctor_id]
+
+    def _schedule(self, doctor_id: Any, day: date) -> Optional[Workday]:
+        schedules = self._schedules.get(doctor_id)
+        if schedules is None:
+            schedules = self._schedules[doctor_id] = _Schedules(self.backend.find('schedules', doctor_id=doctor_id))
+        return schedules.workday(day)
+
+    def workday(self, doctor_id: Any, day: Union[date, str]) -> Optional[Workday]:
+        """The doctor's hours on a day, None when nothing says when they work"""
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        with self._lock:
+            self._check_reference()
+            self._check_collections()
+            if 'schedules' in self.backend.collections:
+                scheduled = self._schedule(doctor_id, day)
+                if scheduled is not None:
+                    return scheduled
+            week = self._week(doctor_id)
+            return None if week is None else week[day.weekday()]
+
+    def working_windows(self, doctor_id: Any, day: Union[date, str]) -> Optional[List[Tuple[int, int]]]:
+        """(start, end) minutes after midnight the doctor works on a day; [] on a
+        day off, None when their hours are unknown"""
+        workday = self.workday(doctor_id, day)
+        return None if workday is None else list(workday.windows)
+
+    def is_available(self, doctor_id: Any, start: datetime, duration: int) -> bool:
+        """Whether [start, start + duration minutes) lies within the doctor's hours.
+        Doctors whose hours are unknown count as available."""
+        workday = self.workday(doctor_id, start.date())
+        if workday is None:
+            return True
+        minute = start.hour * 60 + start.minute
+        return workday.contains(minute, minute + duration)
+
+    def _on_change(self, event: Any) -> None:
+        with self._lock:
+            if event.collection == 'doctors':
+                if event.op == 'reload':
+                    self._weeks.clear()
+                else:
+                    self._weeks.pop(event.key, None)
+            elif event.op == 'reload':
+                self._schedules.clear()
+            else:
+                for record in (event.old, event.new):
+                    if record:
+                        self._schedules.pop(record.get('doctor_id'), None)
@@ -0,0 +1,338 @@
+"""Book a waiting list of appointment requests in one run.
+
+When a clinic day is cancelled or a new doctor joins, many patients need
+new appointments at once. plan() places them all without writing:
+
+1. Greedy: requests are taken by priority (highest first) and, within a
+   priority, most constrained first (a named doctor before a
+   specialization, fixed windows before flexible ones). Each gets the
+   earliest free slot in the first of its preferred windows that has
+   one, else, if it is flexible, the earliest free slot at all.
+2. Repair: a request left over may take the place of an earlier
+   booking, provided that booking can move to another slot that suits
+   it as well (inside its preferred windows, if it was).
+
+Free slots come from SlotFinder, so working hours, schedules, breaks and
+existing appointments are respected; cells promised to earlier requests
+are handed to it as taken. book() then inserts every appointment in one
+transaction, checking each slot once more against the appointments
+stored by then (by anyone, this process or another).
+
+    python batch_scheduler.py waiting_list.csv --dry-run
+    python batch_scheduler.py rebook.jsonl --after "2025-06-02 08:00"
+
+Columns: patient_id, doctor_id or specialization or department,
+duration (minutes, default 30), priority (default 0), window_start and
+window_end ('YYYY-MM-DD HH:MM', one preferred window), flexible (default
+yes), purpose, emergency. A JSON Lines row may give 'windows' instead,
+a list of [start, end] pairs.
+"""
+import argparse
+import sys
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from appointment_intervals import appointment_interval, epoch_minutes
+from bulk_import import read_rows
+from slot_finder import HORIZON_DAYS, Slot, SlotFinder, slot_cells
+
+REPAIR_ATTEMPTS = 25  # bookings tried per request left over
+
+
+class BookingRequest(NamedTuple):
+    patient_id: Any
+    doctor_id: Any = None
+    specialization: Optional[str] = None
+    department: Optional[str] = None
+    duration: int = 30  # minutes
+    priority: int = 0  # higher is placed first
+    windows: Tuple[Tuple[datetime, datetime], ...] = ()  # preferred [start, end) ranges, best first
+    flexible: bool = True  # take any free slot when no window has one
+    purpose: str = ''
+    emergency: bool = False
+    ref: Any = None  # the caller's reference (line number, waiting-list ID), echoed in the report
+
+
+class Booking(NamedTuple):
+    request: BookingRequest
+    slot: Slot
+    preferred: bool  # inside one of the request's windows (always, when it has none)
+
+
+class BatchReport:
+    """Placements of one run and the requests that could not be placed"""
+
+    def __init__(self):
+        self.requests = 0
+        self.bookings: List[Booking] = []  # in request order
+        self.unplaced: List[Tuple[BookingRequest, str]] = []  # (request, reason)
+        self.moved = 0  # bookings moved by repair to make room
+        self.appointments: List[Dict[str, Any]] = []  # written by book()
+
+    def __repr__(self) -> str:
+        return (f"BatchReport(requests={self.requests}, booked={len(self.bookings)}, "
+                f"unplaced={len(self.unplaced)}, moved={self.moved})")
+
+
+def duration_text(minutes: int) -> str:
+    """'30 min', '1 hour' or '1.5 hours', as the appointment dialog writes durations"""
+    if minutes < 60 or minutes % 30:
+        return f"{minutes} min"
+    hours = minutes / 60
+    return f"{hours:g} hour" + ('s' if hours > 1 else '')
+
+
+class _Planner:
+    """Slot search with the cells promised so far held back"""
+
+    def __init__(self, finder: SlotFinder, after: datetime, horizon_days: int):
+        self.finder = finder
+        self.after = after
+        self.horizon_days = horizon_days
+        self.taken: Dict[Tuple[Any, int], int] = {}
+
+    def hold(self, request: BookingRequest, slot: Slot) -> None:
+        ordinal, cells = slot_cells(slot.start, request.duration)
+        key = (slot.doctor_id, ordinal)
+        self.taken[key] = self.taken.get(key, 0) | cells
+
+    def release(self, request: BookingRequest, slot: Slot) -> None:
+        ordinal, cells = slot_cells(slot.start, request.duration)
+        self.taken[(slot.doctor_id, ordinal)] &= ~cells
+
+    def _next(self, request: BookingRequest, after: datetime, horizon_days: int) -> Optional[Slot]:
+        slots = self.finder.next_slots(request.doctor_id, request.specialization, request.department,
+                                       request.duration, 1, after, horizon_days, self.taken)
+        return slots[0] if slots else None
+
+    def find(self, request: BookingRequest) -> Optional[Tuple[Slot, bool]]:
+        """(slot, inside a preferred window) of the best free slot, or None"""
+        length = timedelta(minutes=request.duration)
+        for start, end in request.windows:
+            start = max(start, self.after)
+            if start + length > end:
+                continue
+            # Slots come earliest first, so if the first one ends too late none fits
+            slot = self._next(request, start, (end.date() - start.date()).days + 1)
+            if slot is not None and slot.start + length <= end:
+                return slot, True
+        if request.flexible or not request.windows:
+            slot = self._next(request, self.after, self.horizon_days)
+            if slot is not None:
+                return slot, not request.windows
+        return None
+
+
+def plan(finder: SlotFinder, requests: List[BookingRequest], after: Optional[datetime] = None,
+         horizon_days: int = HORIZON_DAYS) -> BatchReport:
+    """Place requests in free slots from after (default now) within
+    horizon_days. Nothing is written; see book()."""
+    report = BatchReport()
+    report.requests = len(requests)
+    planner = _Planner(finder, after or datetime.now(), horizon_days)
+    doctors = finder.doctors()
+    check_patients = 'patients' in finder.backend.collections
+
+    placed: Dict[int, Booking] = {}
+    by_doctor: Dict[Any, Set[int]] = defaultdict(set)
+    left: List[int] = []
+    reasons: Dict[int, str] = {}
+    order = sorted(range(len(requests)), key=lambda i: (-requests[i].priority, requests[i].doctor_id is None,
+                                                         requests[i].flexible, i))
+    for i in order:
+        request = requests[i]
+        if check_patients and finder.backend.get('patients', request.patient_id) is None:
+            reasons[i] = f"unknown patient {request.patient_id}"
+        elif request.doctor_id is not None and request.doctor_id not in doctors:
+            reasons[i] = f"unknown doctor {request.doctor_id}"
+        elif not finder.candidates(request.doctor_id, request.specialization, request.department):
+            reasons[i] = "no doctor of that specialization or department"
+        elif request.duration < 1:
+            reasons[i] = "duration must be at least one minute"
+        else:
+            found = planner.find(request)
+            if found is None:
+                left.append(i)
+                continue
+            placed[i] = Booking(request, *found)
+            by_doctor[found[0].doctor_id].add(i)
+            planner.hold(request, found[0])
+
+    for i in left:
+        request = requests[i]
+        if _repair(planner, i, request, placed, by_doctor):
+            report.moved += 1
+            continue
+        reasons[i] = ("no free slot in the preferred windows" if request.windows and not request.flexible
+                      else f"no free slot within {horizon_days} days")
+
+    report.bookings = [placed[i] for i in sorted(placed)]
+    report.unplaced = [(requests[i], reasons[i]) for i in sorted(reasons)]
+    return report
+
+
+def _repair(planner: _Planner, i: int, request: BookingRequest,
+            placed: Dict[int, Booking], by_doctor: Dict[Any, Set[int]]) -> bool:
+    """Give request the place of a booking that can move elsewhere just as well"""
+    victims = []
+    for doctor_id in planner.finder.candidates(request.doctor_id, request.specialization, request.department):
+        for j in by_doctor.get(doctor_id, ()):
+            booking = placed[j]
+            if (request.flexible or not request.windows
+                    or any(start <= booking.slot.start < end for start, end in request.windows)):
+                # Cheapest to move first: low priority, then the ones with no windows to keep
+                victims.append((booking.request.priority, bool(booking.request.windows), j))
+    for *_, j in sorted(victims)[:REPAIR_ATTEMPTS]:
+        victim = placed[j]
+        planner.release(victim.request, victim.slot)
+        found = planner.find(request)
+        if found is not None:
+            planner.hold(request, found[0])
+            moved = planner.find(victim.request)
+            if moved is not None and moved[1] >= victim.preferred:
+                planner.hold(victim.request, moved[0])
+                by_doctor[victim.slot.doctor_id].discard(j)
+                by_doctor[moved[0].doctor_id].add(j)
+                by_doctor[found[0].doctor_id].add(i)
+                placed[j] = Booking(victim.request, *moved)
+                placed[i] = Booking(request, *found)
+                return True
+            planner.release(request, found[0])
+        planner.hold(victim.request, victim.slot)
+    return False
+
+
+def _booked(backend: Any, doctor_id: Any, start: datetime, end: datetime) -> bool:
+    """Whether a stored appointment of the doctor overlaps [start, end). Reads
+    the backend itself (by doctor and date, from the day before, which may
+    run past midnight) rather than an index that may not have caught up."""
+    low, high = epoch_minutes(start), epoch_minutes(end)
+    day = start.date() - timedelta(days=1)
+    while day <= end.date():
+        for appointment in backend.find('appointments', doctor_id=doctor_id, date=day.isoformat()):
+            interval = appointment_interval(appointment)
+            if interval is not None and interval[0] < high and low < interval[1]:
+                return True
+        day += timedelta(days=1)
+    return False
+
+
+def book(backend: Any, finder: SlotFinder, report: BatchReport, ids: List[str]) -> BatchReport:
+    """Insert the planned bookings as appointments (with ids) in one transaction.
+    A slot booked or closed since planning is reported as unplaced instead."""
+    bookings = []
+    with backend.transaction():
+        for booking, appointment_id in zip(report.bookings, ids):
+            request, slot = booking.request, booking.slot
+            end = slot.start + timedelta(minutes=request.duration)
+            if not finder.availability.is_available(slot.doctor_id, slot.start, request.duration):
+                report.unplaced.append((request, f"{slot.doctor_name} no longer works at {slot.start:%Y-%m-%d %H:%M}"))
+                continue
+            if _booked(backend, slot.doctor_id, slot.start, end):
+                report.unplaced.append((request, f"{slot} was booked meanwhile"))
+                continue
+            patient = backend.get('patients', request.patient_id) or {}
+            appointment = {
+                'id': appointment_id,
+                'patient_id': request.patient_id,
+                'patient_name': patient.get('name', ''),
+                'doctor_id': slot.doctor_id,
+                'doctor': slot.doctor_name,
+                'date': slot.start.strftime('%Y-%m-%d'),
+                'time': slot.start.strftime('%H:%M'),
+                'duration': duration_text(request.duration),
+                'purpose': request.purpose,
+                'status': 'Scheduled',
+                'emergency': request.emergency,
+            }
+            backend.insert('appointments', appointment)
+            report.appointments.append(appointment)
+            bookings.append(booking)
+    report.bookings = bookings
+    return report
+
+
+def _moment(text: Any) -> datetime:
+    try:
+        return datetime.strptime(str(text).strip(), '%Y-%m-%d %H:%M')
+    except ValueError:
+        raise ValueError(f"expected 'YYYY-MM-DD HH:MM', got {text!r}")
+
+
+def _flag(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y')
+    return bool(value)
+
+
+def request_from_row(row: Dict[str, Any], ref: Any = None) -> BookingRequest:
+    """A BookingRequest from a CSV or JSON Lines row; ValueError if it is invalid"""
+    record = {key.strip(): value.strip() if isinstance(value, str) else value
+              for key, value in row.items() if key is not None and value not in ('', None)}
+    if 'patient_id' not in record:
+        raise ValueError("missing patient_id")
+    if not any(field in record for field in ('doctor_id', 'specialization', 'department')):
+        raise ValueError("missing doctor_id, specialization or department")
+    numbers = {}
+    for field, default in (('duration', 30), ('priority', 0)):
+        try:
+            numbers[field] = int(record.get(field, default))
+        except (TypeError, ValueError):
+            raise ValueError(f"{field} must be a whole number, got {record[field]!r}")
+    if not 1 <= numbers['duration'] <= 24 * 60:
+        raise ValueError(f"duration out of range: {numbers['duration']}")
+    windows = record.get('windows') or []
+    if 'window_start' in record or 'window_end' in record:
+        if 'window_start' not in record or 'window_end' not in record:
+            raise ValueError("window_start and window_end go together")
+        windows = [[record['window_start'], record['window_end']]]
+    try:
+        windows = tuple((_moment(start), _moment(end)) for start, end in windows)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"bad windows: {e}")
+    return BookingRequest(record['patient_id'], record.get('doctor_id'), record.get('specialization'),
+                          record.get('department'), numbers['duration'], numbers['priority'], windows,
+                          _flag(record.get('flexible', True)), record.get('purpose', ''),
+                          _flag(record.get('emergency', False)), ref)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Book a waiting list of appointment requests in free slots")
+    parser.add_argument('path', help="Requests (.csv, .jsonl, optionally .gz; '-' for stdin)")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help="Input format (default: from the file name)")
+    parser.add_argument('--after', type=_moment, help="Earliest slot, 'YYYY-MM-DD HH:MM' (default: now)")
+    parser.add_argument('--horizon-days', type=int, default=HORIZON_DAYS, help="How far ahead to look")
+    parser.add_argument('--dry-run', action='store_true', help="Show the placements without booking them")
+    parser.add_argument('--storage', choices=['json', 'journal', 'sqlite'], default='json',
+                        help="Storage backend of the data directory")
+    args = parser.parse_args()
+    if args.path == '-' and not args.format:
+        parser.error("--format is required when reading from stdin")
+
+    requests, rejected = [], 0
+    for line_no, row, error in read_rows(args.path, args.format):
+        if error is None:
+            try:
+                requests.append(request_from_row(row, line_no))
+                continue
+            except ValueError as e:
+                error = str(e)
+        print(f"line {line_no}: {error}", file=sys.stderr)
+        rejected += 1
+
+    from main import DataManager
+    data_manager = DataManager(storage=args.storage)
+    report = data_manager.schedule_requests(requests, args.after, args.horizon_days, args.dry_run)
+    for booking in report.bookings:
+        print(f"line {booking.request.ref}: {booking.request.patient_id} -> {booking.slot}"
+              + ('' if booking.preferred else ' (outside preferred windows)'))
+    for request, reason in report.unplaced:
+        print(f"line {request.ref}: {request.patient_id} not placed: {reason}", file=sys.stderr)
+    print(f"{'Planned' if args.dry_run else 'Booked'} {len(report.bookings)} of {len(requests)} requests "
+          f"({len(report.unplaced)} not placed, {report.moved} moved to make room, {rejected} rejected)")
+    return 1 if report.unplaced or rejected else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""Compare the snapshot codecs on a synthetic patient collection.
+
+    python benchmark_serialization.py            # 100k records
+    python benchmark_serialization.py --records 20000 --repeat 5
+
+For every codec it reports the best save time (encode + atomic write),
+the best load time (read + decode) and the resulting file size.
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from serialization import CODECS, decode
+from storage_backends import atomic_write_bytes
+
+FIRST_NAMES = ['Robert', 'Maria', 'James', 'Aisha', 'Wei', 'Priya', 'Carlos', 'Fatima', 'John', 'Emily']
+LAST_NAMES = ['Anderson', 'Garcia', 'Wilson', 'Khan', 'Chen', 'Sharma', 'Lopez', 'Ali', 'Smith', 'Brown']
+DISEASES = ['Hypertension', 'Migraine', 'Fever', 'Diabetes', 'Asthma', 'Fracture', 'Flu']
+DOCTORS = ['Dr. Sarah Smith', 'Dr. John Davis', 'Dr. Emily Johnson', 'Dr. Michael Brown', 'Dr. Lisa Wilson']
+BLOOD_GROUPS = ['O+', 'O-', 'A+', 'A-', 'B+', 'B-', 'AB+', 'AB-']
+
+
+def make_patients(count, seed=42):
+    """Patient records shaped like the ones the application stores"""
+    rng = random.Random(seed)
+    return [{
+        'id': f"P{i + 1:06d}",
+        'name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        'age': rng.randint(0, 95),
+        'gender': rng.choice(['Male', 'Female', 'Other']),
+        'disease': rng.choice(DISEASES),
+        'doctor': rng.choice(DOCTORS),
+        'admit_date': f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        'contact': f"555-{rng.randint(0, 9999):04d}",
+        'address': f"{rng.randint(1, 999)} Main St",
+        'blood_group': rng.choice(BLOOD_GROUPS),
+    } for i in range(count)]
+
+
+def best_of(repeat, func):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(records, repeat):
+    data = make_patients(records)
+    workdir = tempfile.mkdtemp()
+    results = []
+    try:
+        for name, codec in CODECS.items():
+            path = os.path.join(workdir, f"patients.{name}")
+            save = best_of(repeat, lambda: atomic_write_bytes(path, codec.dumps(data)))
+
+            def load():
+                with open(path, 'rb') as f:
+                    assert len(decode(f.read())) == records
+
+            results.append((name, save, best_of(repeat, load), os.path.getsize(path)))
+    finally:
+        shutil.rmtree(workdir)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark collection snapshot codecs")
+    parser.add_argument('--records', type=int, default=100_000, help="Records in the collection")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per measurement (best is kept)")
+    args = parser.parse_args()
+
+    results = run(args.records, args.repeat)
+    baseline = dict((name, size) for name, _, _, size in results)['json']
+    print(f"{args.records} patient records, best of {args.repeat}")
+    print(f"{'codec':<10}{'save (s)':>10}{'load (s)':>10}{'size (MB)':>12}{'vs json':>10}")
+    for name, save, load, size in results:
+        print(f"{name:<10}{save:>10.3f}{load:>10.3f}{size / 1e6:>12.2f}{size / baseline:>9.0%}")
+
+
+if __name__ == '__main__':
+    main()
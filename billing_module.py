@@ -1,13 +1,19 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 from datetime import datetime
 import uuid
 import os
+import threading
 from reportlab.lib.pagesizes import letter
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib import colors
 
+from text_search import SEARCH_LIMIT
+
+# Rows listed in the patient picker for the typed prefix
+PATIENT_LIST_LIMIT = 200
+
 class BillingModule:
     def __init__(self, parent, data_manager, user):
         self.parent = parent
@@ -16,6 +22,10 @@ class BillingModule:
         
         self.create_widgets()
         self.load_bills()
+        
+        # Patch rows as bills change instead of reloading the table
+        unsubscribe = data_manager.events.subscribe(self.on_bills_changed, 'billing')
+        self.tree.bind('<Destroy>', lambda e: unsubscribe())
     
     def create_widgets(self):
      # Title Bar
@@ -136,15 +146,10 @@ class BillingModule:
     
     def load_bills(self):
         """Load all bills into the table"""
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        
-        bills = self.data_manager.get_bills()
-        for bill in bills:
-            self.insert_bill_to_tree(bill)
+        self.search_bills()
     
     def insert_bill_to_tree(self, bill):
-        """Insert a bill into the treeview"""
+        """Insert a bill into the treeview, or refresh its row (rows are keyed by bill number)"""
         values = (
             bill['bill_no'],
             bill['patient_id'],
@@ -158,23 +163,37 @@ class BillingModule:
             bill.get('payment_method', 'N/A')
         )
         
-        self.tree.insert('', 'end', values=values, tags=(bill['status'].lower(),))
+        tags = (bill['status'].lower(),)
+        if self.tree.exists(bill['bill_no']):
+            self.tree.item(bill['bill_no'], values=values, tags=tags)
+        else:
+            self.tree.insert('', 'end', iid=bill['bill_no'], values=values, tags=tags)
     
     def search_bills(self):
         """Search bills by bill number or patient name"""
-        search_term = self.search_var.get().lower()
-        status_filter = self.status_var.get()
-        
         for item in self.tree.get_children():
             self.tree.delete(item)
         
-        bills = self.data_manager.get_bills()
-        
-        for bill in bills:
-            if (search_term in bill['bill_no'].lower() or 
-                search_term in bill['patient_name'].lower()):
-                if status_filter == "All" or bill['status'] == status_filter:
-                    self.insert_bill_to_tree(bill)
+        for bill in self.data_manager.search_text('billing', self.search_var.get(), SEARCH_LIMIT,
+                                                  where=self.matches_status):
+            self.insert_bill_to_tree(bill)
+    
+    def matches_status(self, bill):
+        status_filter = self.status_var.get()
+        return status_filter == "All" or bill['status'] == status_filter
+    
+    def matches_filters(self, bill):
+        return (self.matches_status(bill) and
+                self.data_manager.matches_text('billing', self.search_var.get(), bill))
+    
+    def on_bills_changed(self, event):
+        """Apply one change event to the table"""
+        if event.op == 'reload':
+            self.search_bills()
+        elif event.op != 'delete' and self.matches_filters(event.new):
+            self.insert_bill_to_tree(event.new)
+        elif self.tree.exists(event.key):
+            self.tree.delete(event.key)
     
     def create_new_bill(self):
         """Open dialog to create new bill with item-level entry (item, qty, cost)"""
@@ -321,7 +340,6 @@ class BillingModule:
             messagebox.showinfo('Saved', f'Bill {bill_no} saved successfully')
             save_btn.config(state='disabled')
             print_btn.config(state='normal')
-            self.load_bills()
 
         save_btn = tk.Button(action_frame, text='Save Bill', bg='#2ecc71', fg='white', command=save_bill_action)
         save_btn.pack(side='left', padx=5)
@@ -329,8 +347,7 @@ class BillingModule:
 
         def print_preview_action():
             # create a preview window with bill details
-            bills = self.data_manager.get_bills()
-            bill = next((b for b in bills if b['bill_no'] == bill_no), None)
+            bill = self.data_manager.get_bill_by_no(bill_no)
             if not bill:
                 messagebox.showerror('Error', 'Bill not found. Save first.')
                 return
@@ -375,7 +392,6 @@ class BillingModule:
 
     # ----------------- Patient List and Medicine Catalog -----------------
     def show_patient_list(self):
-        patients = self.data_manager.get_patients()
         dialog = tk.Toplevel(self.parent)
         dialog.title('Patients')
         dialog.geometry('600x400')
@@ -383,17 +399,30 @@ class BillingModule:
 
         header = tk.Frame(dialog)
         header.pack(fill='x', padx=10, pady=5)
-        tk.Label(header, text=f'Total Patients: {len(patients)}', font=('Arial', 12, 'bold')).pack(side='left')
+        tk.Label(header, text=f"Total Patients: {self.data_manager.backend.count('patients')}",
+                 font=('Arial', 12, 'bold')).pack(side='left')
+        # Only the best matches for the typed ID or name are listed
+        search_var = tk.StringVar()
+        search_entry = tk.Entry(header, textvariable=search_var, width=25)
+        search_entry.pack(side='right')
+        tk.Label(header, text='Find:').pack(side='right', padx=5)
 
         cols = ('ID', 'Name', 'Age', 'Contact')
         tree = ttk.Treeview(dialog, columns=cols, show='headings')
         for c in cols:
             tree.heading(c, text=c)
             tree.column(c, width=120)
-        for p in patients:
-            tree.insert('', 'end', values=(p.get('id'), p.get('name'), p.get('age', ''), p.get('contact', '')))
         tree.pack(fill='both', expand=True, padx=10, pady=5)
 
+        def show_matches(*_):
+            tree.delete(*tree.get_children())
+            for p in self.data_manager.autocomplete_records('patients', search_var.get(), PATIENT_LIST_LIMIT):
+                tree.insert('', 'end', values=(p.get('id'), p.get('name'), p.get('age', ''), p.get('contact', '')))
+
+        search_var.trace_add('write', show_matches)
+        show_matches()
+        search_entry.focus_set()
+
         def load_selected():
             sel = tree.selection()
             if not sel:
@@ -447,21 +476,41 @@ class BillingModule:
         tk.Button(dialog, text='Add to Bill', command=add_med_to_bill, bg='#16a085', fg='white').pack(pady=5)
 
     def export_medicines_csv(self):
-        meds = self.data_manager.get_medicines()
-        if not meds:
+        if not self.data_manager.backend.count('pharmacy'):
             messagebox.showinfo('Export', 'No medicines to export')
             return
-        filepath = os.path.join(os.path.expanduser('~'), 'medicine_catalog.csv')
-        try:
-            import csv
-            with open(filepath, 'w', newline='', encoding='utf-8') as f:
-                w = csv.writer(f)
-                w.writerow(['id','name','price','stock','category'])
-                for m in meds:
-                    w.writerow([m.get('id'), m.get('name'), m.get('price'), m.get('stock'), m.get('category')])
-            messagebox.showinfo('Export', f'Medicine catalog exported to {filepath}')
-        except Exception as e:
-            messagebox.showerror('Error', f'Export failed: {e}')
+        filepath = filedialog.asksaveasfilename(
+            parent=self.parent, title='Export Medicines',
+            initialdir=os.path.expanduser('~'), initialfile='medicine_catalog.csv',
+            defaultextension='.csv',
+            filetypes=[('CSV', '*.csv'), ('JSON Lines', '*.jsonl'),
+                       ('Compressed CSV', '*.csv.gz'), ('Compressed JSON Lines', '*.jsonl.gz')])
+        if not filepath:
+            return
+
+        # Export on a worker thread and poll for the result, so the window
+        # keeps handling events while a large catalog is written
+        result = {}
+
+        def export():
+            try:
+                result['count'] = self.data_manager.export_collection(
+                    'pharmacy', filepath, fields=['id', 'name', 'price', 'stock', 'category'])
+            except Exception as e:
+                result['error'] = e
+
+        def finish():
+            if worker.is_alive():
+                self.parent.after(100, finish)
+                return
+            if 'error' in result:
+                messagebox.showerror('Error', f"Export failed: {result['error']}")
+                return
+            messagebox.showinfo('Export', f"{result['count']} medicines exported to {filepath}")
+
+        worker = threading.Thread(target=export, daemon=True)
+        worker.start()
+        finish()
 
     def show_recent_bills(self):
         bills = self.data_manager.get_bills()
@@ -632,9 +681,7 @@ class BillingModule:
         from payment_processor import PaymentProcessor
         PaymentProcessor(self.parent, new_bill, self.process_payment)
         
-        self.data_manager.create_bill(new_bill, self.user['id'])
-        self.load_bills()
-        dialog.destroy()
+        self.data_manager.add_bill(new_bill)
         messagebox.showinfo("Success", "Bill created successfully!")
         
     def view_bill(self, event=None):
@@ -644,8 +691,7 @@ class BillingModule:
             return
         
         bill_no = self.tree.item(selected_item[0])['values'][0]
-        bills = self.data_manager.get_bills()
-        bill = next((b for b in bills if b['bill_no'] == bill_no), None)
+        bill = self.data_manager.get_bill_by_no(bill_no)
         
         if bill:
             self.show_bill_details(bill)
@@ -718,14 +764,9 @@ class BillingModule:
     
     def update_bill_status(self, bill_no, status, dialog):
         """Update bill status"""
-        bills = self.data_manager.get_bills()
-        for i, bill in enumerate(bills):
-            if bill['bill_no'] == bill_no:
-                bills[i]['status'] = status
-                self.data_manager.save_data(self.data_manager.billing_file, bills)
-                break
+        if self.data_manager.get_bill_by_no(bill_no) is not None:
+            self.data_manager.update_bill(bill_no, {'status': status})
         
-        self.load_bills()
         dialog.destroy()
         messagebox.showinfo("Success", f"Bill marked as {status}")
     
@@ -784,8 +825,7 @@ class BillingModule:
     
     def process_payment(self, updated_bill):
         """Handle payment completion and update bill"""
-        self.data_manager.create_bill(updated_bill, self.user['id'])
-        self.load_bills()
+        self.data_manager.update_bill(updated_bill['bill_no'], updated_bill)
         
         # Generate and show PDF
         self.print_bill(updated_bill)
@@ -805,8 +845,7 @@ class BillingModule:
         menu.add_separator()
         
         bill_no = self.tree.item(selected_item[0])['values'][0]
-        bills = self.data_manager.get_bills()
-        bill = next((b for b in bills if b['bill_no'] == bill_no), None)
+        bill = self.data_manager.get_bill_by_no(bill_no)
         
         if bill and bill['status'] == 'Pending':
             menu.add_command(label="Mark as Paid",
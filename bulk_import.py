@@ -0,0 +1,321 @@
+"""Bulk import of patients, medicines and appointments from CSV or JSON Lines.
+
+Input is streamed and committed in chunks: every chunk gets its IDs as one
+reserved block and is stored with a single backend write, so importing N
+rows no longer rewrites the collection N times. Bad rows are reported and
+skipped; the rest of the file is still imported.
+
+    python bulk_import.py patients branch_patients.csv
+    python bulk_import.py medicines stock.jsonl.gz --storage sqlite
+
+Appointments are checked the way the booking dialog checks them: the
+patient and doctor must exist, the doctor must be working, and the slot
+must not overlap a stored appointment or an earlier row of the import.
+
+The command line imports through the 'journal' backend by default, so each
+chunk is appended instead of rewriting the whole file ('json' would make
+an import O(N^2 / chunk)); the journal is folded into the collection files
+at the end, so every storage mode reads the result. Memory stays flat with
+'sqlite'; the JSON backends keep the collection itself in memory.
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import sys
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from appointment_intervals import IntervalIndex, duration_minutes, epoch_minutes
+
+GENDERS = {'male': 'Male', 'female': 'Female', 'other': 'Other'}
+
+
+def _clean(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Strip string values and drop empty columns"""
+    cleaned = {}
+    for key, value in row.items():
+        if key is None:
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+        if value not in ('', None):
+            cleaned[key.strip()] = value
+    return cleaned
+
+
+def _require(record: Dict[str, Any], *fields: str) -> None:
+    missing = [f for f in fields if f not in record]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+
+
+def _number(record: Dict[str, Any], field: str, kind: type, default: Any = None,
+            minimum: Optional[float] = None, maximum: Optional[float] = None) -> None:
+    """Convert record[field] to int/float in place, checking its range"""
+    if field not in record:
+        if default is not None:
+            record[field] = default
+        return
+    try:
+        value = kind(record[field])
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be a number, got {record[field]!r}")
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        raise ValueError(f"{field} out of range: {value}")
+    record[field] = value
+
+
+def _date(record: Dict[str, Any], field: str, fmt: str) -> None:
+    try:
+        datetime.strptime(str(record[field]), fmt)
+    except ValueError:
+        raise ValueError(f"{field} {record[field]!r} does not match {fmt}")
+
+
+def _keep_source_id(record: Dict[str, Any]) -> Dict[str, Any]:
+    """IDs are allocated here; an ID from the source system is kept for reference"""
+    if 'id' in record:
+        record['external_id'] = record.pop('id')
+    return record
+
+
+def validate_patient(row: Dict[str, Any]) -> Dict[str, Any]:
+    record = _keep_source_id(_clean(row))
+    _require(record, 'name')
+    _number(record, 'age', int, minimum=0, maximum=150)
+    if 'gender' in record:
+        gender = GENDERS.get(str(record['gender']).lower())
+        if gender is None:
+            raise ValueError(f"unknown gender {record['gender']!r}")
+        record['gender'] = gender
+    if 'admit_date' in record:
+        _date(record, 'admit_date', '%Y-%m-%d')
+    return record
+
+
+def validate_medicine(row: Dict[str, Any]) -> Dict[str, Any]:
+    record = _keep_source_id(_clean(row))
+    _require(record, 'name')
+    _number(record, 'stock', int, default=0, minimum=0)
+    _number(record, 'price', float, default=0.0, minimum=0)
+    return record
+
+
+def validate_appointment(row: Dict[str, Any]) -> Dict[str, Any]:
+    record = _keep_source_id(_clean(row))
+    _require(record, 'patient_id', 'doctor_id', 'date', 'time')
+    _date(record, 'date', '%Y-%m-%d')
+    _date(record, 'time', '%H:%M')
+    record.setdefault('duration', '30 min')
+    record.setdefault('status', 'Scheduled')
+    emergency = record.get('emergency', False)
+    if isinstance(emergency, str):
+        emergency = emergency.lower() in ('1', 'true', 'yes', 'y')
+    record['emergency'] = bool(emergency)
+    return record
+
+
+class AppointmentChecks:
+    """Checks validated appointment rows against the stored data, like the
+    booking dialog: known patient and doctor, within the doctor's hours, and
+    no overlap with a stored appointment or one imported earlier in this run
+    (those are not in the backend until their chunk is committed). Past
+    dates are allowed, since imports often carry history."""
+
+    def __init__(self, data_manager: Any):
+        self.data_manager = data_manager
+        self._imported: Dict[Any, IntervalIndex] = defaultdict(IntervalIndex)
+        self._count = 0
+
+    def __call__(self, record: Dict[str, Any]) -> None:
+        patient = self.data_manager.get_patient_by_id(record['patient_id'])
+        if patient is None:
+            raise ValueError(f"unknown patient {record['patient_id']!r}")
+        doctor = self.data_manager.get_doctor_by_id(record['doctor_id'])
+        if doctor is None:
+            raise ValueError(f"unknown doctor {record['doctor_id']!r}")
+        record.setdefault('patient_name', patient.get('name'))
+        record.setdefault('doctor', doctor.get('name'))
+
+        start = datetime.strptime(f"{record['date']} {record['time']}", '%Y-%m-%d %H:%M')
+        minutes = duration_minutes(record['duration'])
+        if not self.data_manager.is_doctor_available(record['doctor_id'], start, minutes):
+            raise ValueError(f"doctor {record['doctor_id']} is not working at {record['date']} {record['time']}")
+        conflicts = self.data_manager.get_appointment_conflicts(
+            record['doctor_id'], start, start + timedelta(minutes=minutes))
+        if conflicts:
+            raise ValueError(f"conflicts with appointment {conflicts[0].get('id')}")
+        index = self._imported[record['doctor_id']]
+        low = epoch_minutes(start)
+        if next(index.overlapping(low, low + minutes), None) is not None:
+            raise ValueError("conflicts with an earlier row of this import")
+        self._count += 1
+        index.add(self._count, low, low + minutes)
+
+
+# What can be imported: target collection, ID prefix, row validator and
+# (optionally) a factory for checks against the stored data
+IMPORT_TYPES = {
+    'patients': {'collection': 'patients', 'prefix': 'P', 'validate': validate_patient},
+    'medicines': {'collection': 'pharmacy', 'prefix': 'M', 'validate': validate_medicine},
+    'appointments': {'collection': 'appointments', 'prefix': 'A', 'validate': validate_appointment,
+                     'check': AppointmentChecks},
+}
+
+
+def detect_format(path: str) -> str:
+    name = path.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    raise ValueError(f"Cannot tell the format of {path}; pass csv or jsonl explicitly")
+
+
+def _open_text(path: str) -> io.TextIOBase:
+    if path == '-':
+        return sys.stdin
+    if path.lower().endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def read_rows(path: str, fmt: Optional[str] = None) -> Iterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+    """Stream (line number, row, error) from a CSV or JSONL file (optionally gzipped).
+
+    Exactly one of row/error is set; a row that cannot be parsed yields an
+    error instead of stopping the stream.
+    """
+    fmt = fmt or detect_format(path)
+    f = _open_text(path)
+    try:
+        if fmt == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row, None
+        elif fmt == 'jsonl':
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_no, None, f"invalid JSON: {e.msg}"
+                    continue
+                if not isinstance(row, dict):
+                    yield line_no, None, "expected a JSON object"
+                    continue
+                yield line_no, row, None
+        else:
+            raise ValueError(f"Unknown import format: {fmt}")
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+class ImportReport:
+    """Counts and per-row errors of one import run"""
+
+    def __init__(self, max_errors: int = 1000):
+        self.imported = 0
+        self.rows = 0
+        self.error_count = 0
+        self.errors: List[Tuple[int, str]] = []  # first max_errors (line, message)
+        self.max_errors = max_errors
+
+    def add_error(self, line_no: int, message: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line_no, message))
+
+    def __repr__(self) -> str:
+        return f"ImportReport(rows={self.rows}, imported={self.imported}, errors={self.error_count})"
+
+
+def bulk_import(data_manager: Any, kind: str, path: str, fmt: Optional[str] = None,
+                chunk_size: int = 5000,
+                on_error: Optional[Callable[[int, str], None]] = None,
+                progress: Optional[Callable[[ImportReport], None]] = None) -> ImportReport:
+    """Import rows of kind ('patients', 'medicines' or 'appointments') from path.
+
+    Rows are validated one by one; invalid rows are recorded in the report
+    (and passed to on_error) and skipped. Valid rows are committed every
+    chunk_size rows, after which progress is called with the report.
+    """
+    if kind not in IMPORT_TYPES:
+        raise ValueError(f"Cannot import {kind}; choose from {', '.join(IMPORT_TYPES)}")
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    spec = IMPORT_TYPES[kind]
+    check = spec['check'](data_manager) if 'check' in spec else None
+    report = ImportReport()
+
+    def commit(chunk: List[Dict[str, Any]]) -> None:
+        for record, new_id in zip(chunk, data_manager.reserve_ids(spec['prefix'], len(chunk))):
+            record['id'] = new_id
+        data_manager.backend.insert_many(spec['collection'], chunk)
+        report.imported += len(chunk)
+        if progress:
+            progress(report)
+
+    chunk = []
+    for line_no, row, error in read_rows(path, fmt):
+        report.rows += 1
+        if error is None:
+            try:
+                record = spec['validate'](row)
+                if check:
+                    check(record)
+                chunk.append(record)
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            report.add_error(line_no, error)
+            if on_error:
+                on_error(line_no, error)
+            continue
+        if len(chunk) >= chunk_size:
+            commit(chunk)
+            chunk = []
+    if chunk:
+        commit(chunk)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import hospital records from CSV or JSON Lines")
+    parser.add_argument('kind', choices=sorted(IMPORT_TYPES), help="What the file contains")
+    parser.add_argument('path', help="Input file (.csv, .jsonl, optionally .gz; '-' for stdin)")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help="Input format (default: from the file name)")
+    parser.add_argument('--chunk-size', type=int, default=5000, help="Rows committed per write")
+    parser.add_argument('--storage', choices=['json', 'journal', 'sqlite'], default='journal',
+                        help="Storage backend to import through (journal appends each chunk)")
+    args = parser.parse_args()
+    if args.path == '-' and not args.format:
+        parser.error("--format is required when reading from stdin")
+
+    from main import DataManager
+    data_manager = DataManager(storage=args.storage)
+
+    def on_error(line_no, message):
+        print(f"line {line_no}: {message}", file=sys.stderr)
+
+    def progress(report):
+        print(f"{report.imported} imported, {report.error_count} rejected", file=sys.stderr)
+
+    report = bulk_import(data_manager, args.kind, args.path, args.format,
+                         args.chunk_size, on_error, progress)
+    if args.storage == 'journal':
+        # Fold the journal into the collection files, which 'json' storage reads
+        data_manager.backend.compact(IMPORT_TYPES[args.kind]['collection'])
+    print(f"Imported {report.imported} of {report.rows} rows ({report.error_count} rejected)")
+    return 1 if report.error_count else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
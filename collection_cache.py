@@ -0,0 +1,105 @@
+import os
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class CollectionCache:
+    """Keeps parsed collection files in memory between reads.
+
+    Entries are keyed by file path and validated against the file's
+    modification time, size and inode, so edits made by another process
+    (or by hand) are picked up on the next read. Writes go through the cache:
+    the file is written first and the cached copy replaced afterwards.
+
+    Different files can be parsed concurrently (e.g. by a background
+    warm-up); a second reader of a file that is being parsed waits for
+    that parse instead of starting its own.
+
+    loads(path) counts how often a file was found changed on disk (also
+    with the cache disabled). Writes made through put() don't count, so a
+    change in the count means someone else changed the file.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._entries: Dict[str, Tuple[Tuple[int, int, int], Any]] = {}
+        self._lock = threading.RLock()
+        self._path_locks: Dict[str, threading.RLock] = {}
+        self._loads: Dict[str, int] = {}
+        self._seen: Dict[str, Optional[Tuple[int, int, int]]] = {}  # stamp last read or written
+
+    def _path_lock(self, path: str) -> threading.RLock:
+        with self._lock:
+            return self._path_locks.setdefault(path, threading.RLock())
+
+    @staticmethod
+    def _stamp(path: str) -> Tuple[int, int, int]:
+        """Return the (mtime, size, inode) used to detect outside edits; files
+        are replaced atomically, so the inode changes even when another
+        process rewrites a file within the filesystem's timestamp resolution"""
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def get(self, path: str, loader: Callable[[str], Any]) -> Any:
+        """Return the parsed contents of path, reloading only when it changed"""
+        if not self.enabled:
+            try:
+                self._note(path, self._stamp(path))
+            except FileNotFoundError:
+                self._note(path, None)
+            return loader(path)
+
+        with self._path_lock(path):
+            try:
+                stamp = self._stamp(path)
+            except FileNotFoundError:
+                self._entries.pop(path, None)
+                self._note(path, None)
+                return loader(path)
+
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == stamp:
+                return entry[1]
+
+            data = loader(path)
+            self._entries[path] = (stamp, data)
+            self._note(path, stamp)
+            return data
+
+    def _note(self, path: str, stamp: Optional[Tuple[int, int, int]], load: bool = True) -> None:
+        """Remember the stamp of path as read (load) or as written by put()"""
+        with self._lock:
+            if self._seen.get(path) != stamp:
+                self._seen[path] = stamp
+                if load:
+                    self._loads[path] = self._loads.get(path, 0) + 1
+
+    def put(self, path: str, data: Any, saver: Callable[[str, Any], None]) -> None:
+        """Write data to path and keep it as the cached copy"""
+        with self._path_lock(path):
+            try:
+                saver(path, data)
+            except Exception:
+                self._entries.pop(path, None)
+                raise
+
+            stamp = self._stamp(path)
+            self._note(path, stamp, load=False)
+            if self.enabled:
+                self._entries[path] = (stamp, data)
+
+    def invalidate(self, path: Optional[str] = None) -> None:
+        """Drop one cached file, or everything when no path is given"""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(path, None)
+
+    def loads(self, path: str) -> int:
+        """How many times path was read from disk (see the class docstring)"""
+        return self._loads.get(path, 0)
+
+    def is_cached(self, path: str) -> bool:
+        """Whether path currently has a cached copy"""
+        return path in self._entries
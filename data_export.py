@@ -0,0 +1,105 @@
+"""Streaming export of any collection to CSV or JSON Lines, optionally gzipped.
+
+Records flow through generators from the storage backend to the output
+file, so exporting years of bills does not build the whole result in
+memory (with the SQLite backend memory stays flat regardless of size).
+"""
+import csv
+import gzip
+import json
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'csv.gz', 'jsonl.gz')
+
+
+def detect_format(path: str) -> str:
+    """Export format implied by the file name"""
+    name = path.lower()
+    for fmt in sorted(EXPORT_FORMATS, key=len, reverse=True):
+        if name.endswith('.' + fmt):
+            return fmt
+    raise ValueError(f"Cannot tell the export format of {path}; use one of {', '.join(EXPORT_FORMATS)}")
+
+
+def select(records: Iterable[Dict[str, Any]],
+           where: Optional[Callable[[Dict[str, Any]], bool]] = None,
+           fields: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+    """Filter records with where and project them onto fields"""
+    for record in records:
+        if where is not None and not where(record):
+            continue
+        if fields is not None:
+            record = {f: record.get(f) for f in fields}
+        yield record
+
+
+def _counted(records: Iterable[Dict[str, Any]], every: int,
+             progress: Optional[Callable[[int, int], None]], total: int) -> Iterator[Dict[str, Any]]:
+    """Pass records through, calling progress(done, total) every `every` records"""
+    done = 0
+    for record in records:
+        yield record
+        done += 1
+        if progress and done % every == 0:
+            progress(done, total)
+    if progress:
+        progress(done, total)
+
+
+def write_jsonl(records: Iterable[Dict[str, Any]], f) -> None:
+    for record in records:
+        f.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+
+def write_csv(records: Iterable[Dict[str, Any]], f, fields: Optional[List[str]] = None) -> None:
+    """Write records as CSV. Without fields the columns are taken from the
+    first record; later records' extra keys are dropped."""
+    records = iter(records)
+    first = next(records, None)
+    if first is None:
+        if fields:
+            csv.writer(f).writerow(fields)
+        return
+    writer = csv.DictWriter(f, fieldnames=fields or list(first), extrasaction='ignore')
+    writer.writeheader()
+    writer.writerow(first)
+    for record in records:
+        writer.writerow(record)
+
+
+def export_records(records: Iterable[Dict[str, Any]], path: str, fmt: Optional[str] = None,
+                   fields: Optional[List[str]] = None) -> None:
+    """Write a stream of records to path in the given (or detected) format"""
+    fmt = fmt or detect_format(path)
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    opener = gzip.open if fmt.endswith('.gz') else open
+    with opener(path, 'wt', newline='', encoding='utf-8') as f:
+        if fmt.startswith('csv'):
+            write_csv(records, f, fields)
+        else:
+            write_jsonl(records, f)
+
+
+def export_collection(backend: Any, collection: str, path: str, fmt: Optional[str] = None,
+                      where: Optional[Callable[[Dict[str, Any]], bool]] = None,
+                      fields: Optional[List[str]] = None,
+                      progress: Optional[Callable[[int, int], None]] = None,
+                      chunk_size: int = 1000) -> int:
+    """Stream one collection from a storage backend to path; returns records written.
+
+    progress(done, total) is called every chunk_size records read (and once
+    at the end), which lets a Tk caller process pending events meanwhile.
+    """
+    exported = 0
+
+    def count(records):
+        nonlocal exported
+        for record in records:
+            exported += 1
+            yield record
+
+    records = _counted(backend.iter_records(collection, chunk_size), chunk_size,
+                       progress, backend.count(collection))
+    export_records(count(select(records, where, fields)), path, fmt, fields)
+    return exported
@@ -3,12 +3,43 @@ import os
 from datetime import datetime
 import hashlib
 import uuid
-from typing import Dict, List, Any, Optional
+from typing import Dict, Iterator, List, Any, Optional
 from pathlib import Path
 
+import query_engine
+from audit_log import AuditLog
+from availability import day_schedule, next_revision, rule_id, schedule_id
+from collection_cache import CollectionCache
+from data_export import export_collection
+from storage_backends import (JournalBackend, JsonBackend, PartitionedBackend, SQLiteBackend,
+                              VersionConflict, migrate_json_to_sqlite)
+
+# Collections stored through the pluggable backend (the audit log stays a plain file).
+# Appointments and bills are split into monthly files by 'partition_by'.
+COLLECTIONS = {
+    'users': {'file': 'users.json', 'key': 'id'},
+    'patients': {'file': 'patients.json', 'key': 'id'},
+    'appointments': {'file': 'appointments.json', 'key': 'id', 'partition_by': 'date',
+                     'indexes': [('patient_id',), ('doctor_id',), ('doctor_id', 'date'), ('date',)]},
+    'prescriptions': {'file': 'prescriptions.json', 'key': 'id',
+                      'indexes': [('patient_id',)]},
+    'medicines': {'file': 'medicines.json', 'key': 'id'},
+    'lab_reports': {'file': 'lab_reports.json', 'key': 'id',
+                    'indexes': [('patient_id',)]},
+    'bills': {'file': 'bills.json', 'key': 'id', 'partition_by': 'created_at',
+              'indexes': [('patient_id',)]},
+    'schedules': {'file': 'schedules.json', 'key': 'id',
+                  'indexes': [('doctor_id', 'date'), ('doctor_id',)]},
+}
+
+# Reference data shipped with the application; its files are never split
+# into partitions automatically
+BUNDLED_DATA_DIR = Path(__file__).resolve().parent / 'data'
+
 class DataManager:
-    def __init__(self, data_dir: str = "data"):
-        """Initialize DataManager with data directory"""
+    def __init__(self, data_dir: str = "data", storage: str = "json", codec: str = "compact"):
+        """Initialize DataManager with data directory, storage backend ('json', 'journal' or 'sqlite')
+        and file codec ('compact', 'json' or 'binary')"""
         self.data_dir = Path(data_dir)
         self.data_dir.mkdir(exist_ok=True)
         
@@ -21,30 +52,67 @@ class DataManager:
             'medicines': self.data_dir / 'medicines.json',
             'lab_reports': self.data_dir / 'lab_reports.json',
             'bills': self.data_dir / 'bills.json',
-            'audit_log': self.data_dir / 'audit_log.json'
+            'audit_log': self.data_dir / 'audit_log.jsonl'
         }
         
-        # Create files if they don't exist
-        for file_path in self.files.values():
-            if not file_path.exists():
-                self._save_data(file_path, [])
-    
-    def _load_data(self, file_path: Path) -> List[Dict[str, Any]]:
-        """Load data from JSON file with error handling"""
-        try:
-            with open(file_path, 'r') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return []
-    
-    def _save_data(self, file_path: Path, data: List[Dict[str, Any]]) -> None:
-        """Save data to JSON file with error handling"""
-        try:
-            with open(file_path, 'w') as f:
-                json.dump(data, f, indent=4)
-        except Exception as e:
-            self._log_error(f"Error saving to {file_path}: {str(e)}")
-            raise
+        self.codec = codec
+        self.backend = self._create_backend(storage)
+        
+        # Create collections if they don't exist
+        for collection in COLLECTIONS:
+            if not self.backend.exists(collection):
+                self.backend.save(collection, [])
+        
+        # Append-only audit trail; an old audit_log.json is converted on first use
+        self.audit_log = AuditLog(self.files['audit_log'],
+                                  legacy_path=self.data_dir / 'audit_log.json')
+    
+    def _create_backend(self, storage: str):
+        """Create the storage backend; a new SQLite database is seeded from the JSON files once.
+        Single-file bills/appointments are split into monthly partitions on
+        first use, except in the bundled data directory."""
+        auto_migrate = self.data_dir.resolve() != BUNDLED_DATA_DIR
+        if storage == 'json':
+            return PartitionedBackend(JsonBackend(str(self.data_dir), COLLECTIONS, CollectionCache(), self.codec),
+                                      auto_migrate)
+        if storage == 'journal':
+            return PartitionedBackend(JournalBackend(str(self.data_dir), COLLECTIONS, CollectionCache(), self.codec),
+                                      auto_migrate)
+        if storage == 'sqlite':
+            db_path = self.data_dir / 'hospital.db'
+            if not db_path.exists():
+                migrate_json_to_sqlite(str(self.data_dir), str(db_path), COLLECTIONS)
+            return SQLiteBackend(str(db_path), COLLECTIONS)
+        raise ValueError(f"Unknown storage backend: {storage}")
+    
+    def transaction(self):
+        """Context manager batching writes; each touched collection is written once"""
+        return self.backend.transaction()
+    
+    def snapshot(self, *collections: str):
+        """Consistent read-only view of collections (all when none are given);
+        later writes do not show through, and nothing is copied"""
+        return self.backend.snapshot(*collections)
+    
+    def update_record(self, collection: str, key: Any, change, attempts: int = 5) -> Optional[Dict[str, Any]]:
+        """Update a record with changes computed from its current contents.
+        
+        change(record) returns the changes to apply; the write is a
+        compare-and-swap on the record's version, and change is re-run on
+        the fresh record when someone else updated it in between.
+        Returns the updated record, or None if it does not exist.
+        """
+        for _ in range(attempts):
+            record = self.backend.get(collection, key)
+            if record is None:
+                return None
+            changes = change(dict(record))
+            try:
+                return self.backend.update(collection, key, changes,
+                                           expected_version=record.get('version', 0))
+            except VersionConflict:
+                continue
+        raise VersionConflict(f"{collection} {key} keeps changing; try again")
     
     def _log_action(self, action: str, details: str, user_id: Optional[str] = None) -> None:
         """Log actions for audit trail"""
@@ -56,9 +124,7 @@ class DataManager:
             'ip_address': '127.0.0.1'  # In production, get actual IP
         }
         
-        logs = self._load_data(self.files['audit_log'])
-        logs.append(log_entry)
-        self._save_data(self.files['audit_log'], logs)
+        self.audit_log.append(log_entry)
     
     def _log_error(self, error_msg: str) -> None:
         """Log error messages"""
@@ -70,7 +136,7 @@ class DataManager:
     
     def authenticate_user(self, username: str, password: str) -> Optional[Dict[str, Any]]:
         """Authenticate user and return user data if successful"""
-        users = self._load_data(self.files['users'])
+        users = self.backend.load('users')
         hashed_password = self._hash_password(password)
         
         for user in users:
@@ -82,7 +148,7 @@ class DataManager:
     # User Management
     def create_user(self, username: str, password: str, role: str, **kwargs) -> Dict[str, Any]:
         """Create new user with validation"""
-        users = self._load_data(self.files['users'])
+        users = self.backend.load('users')
         
         # Validate username uniqueness
         if any(u['username'] == username for u in users):
@@ -99,34 +165,27 @@ class DataManager:
             **kwargs
         }
         
-        users.append(new_user)
-        self._save_data(self.files['users'], users)
+        self.backend.insert('users', new_user)
         self._log_action('CREATE_USER', f'Created user {username}', user_id)
         
         return {k: v for k, v in new_user.items() if k != 'password'}
     
     def update_user(self, user_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
         """Update user data with validation"""
-        users = self._load_data(self.files['users'])
-        
-        for i, user in enumerate(users):
-            if user['id'] == user_id:
-                if 'password' in data:
-                    data['password'] = self._hash_password(data['password'])
-                users[i].update(data)
-                self._save_data(self.files['users'], users)
-                self._log_action('UPDATE_USER', 
-                               f'Updated user {user["username"]}', 
-                               user_id)
-                return {k: v for k, v in users[i].items() if k != 'password'}
-        
-        raise ValueError("User not found")
+        if 'password' in data:
+            data['password'] = self._hash_password(data['password'])
+        user = self.backend.update('users', user_id, data)
+        if user is None:
+            raise ValueError("User not found")
+        
+        self._log_action('UPDATE_USER', 
+                       f'Updated user {user["username"]}', 
+                       user_id)
+        return {k: v for k, v in user.items() if k != 'password'}
     
     # Patient Management
     def add_patient(self, data: Dict[str, Any], user_id: str) -> Dict[str, Any]:
         """Add new patient record"""
-        patients = self._load_data(self.files['patients'])
-        
         patient_id = str(uuid.uuid4())
         new_patient = {
             'id': patient_id,
@@ -134,8 +193,7 @@ class DataManager:
             **data
         }
         
-        patients.append(new_patient)
-        self._save_data(self.files['patients'], patients)
+        self.backend.insert('patients', new_patient)
         self._log_action('ADD_PATIENT', 
                         f'Added patient {data.get("name")}', 
                         user_id)
@@ -144,24 +202,18 @@ class DataManager:
     
     def update_patient(self, patient_id: str, data: Dict[str, Any], user_id: str) -> Dict[str, Any]:
         """Update patient record"""
-        patients = self._load_data(self.files['patients'])
-        
-        for i, patient in enumerate(patients):
-            if patient['id'] == patient_id:
-                patients[i].update(data)
-                self._save_data(self.files['patients'], patients)
-                self._log_action('UPDATE_PATIENT', 
-                               f'Updated patient {patient["name"]}', 
-                               user_id)
-                return patients[i]
-        
-        raise ValueError("Patient not found")
+        patient = self.backend.update('patients', patient_id, data)
+        if patient is None:
+            raise ValueError("Patient not found")
+        
+        self._log_action('UPDATE_PATIENT', 
+                       f'Updated patient {patient["name"]}', 
+                       user_id)
+        return patient
     
     # Appointment Management
     def create_appointment(self, data: Dict[str, Any], user_id: str) -> Dict[str, Any]:
         """Create new appointment"""
-        appointments = self._load_data(self.files['appointments'])
-        
         appointment_id = str(uuid.uuid4())
         new_appointment = {
             'id': appointment_id,
@@ -170,19 +222,55 @@ class DataManager:
             **data
         }
         
-        appointments.append(new_appointment)
-        self._save_data(self.files['appointments'], appointments)
+        self.backend.insert('appointments', new_appointment)
         self._log_action('CREATE_APPOINTMENT', 
                         f'Created appointment for patient {data.get("patient_id")}',
                         user_id)
         
         return new_appointment
     
+    # Doctor Schedules
+    def update_doctor_schedule(self, schedule: Dict[str, Any], user_id: Optional[str] = None) -> Dict[str, Any]:
+        """Save a doctor's hours for schedule['date'], overriding their rules on that date"""
+        key = schedule_id(schedule['doctor_id'], schedule['date'])
+        with self.backend.transaction():
+            record = dict(schedule, revision=next_revision(
+                self.backend.find('schedules', doctor_id=schedule['doctor_id'])))
+            if self.backend.get('schedules', key) is None:
+                self.backend.insert('schedules', {'id': key, **record})
+            else:
+                self.backend.update('schedules', key, record)
+        self._log_action('UPDATE_SCHEDULE',
+                        f'Set schedule of doctor {schedule["doctor_id"]} on {schedule["date"]}',
+                        user_id)
+        return self.backend.get('schedules', key)
+    
+    def set_doctor_schedule_rule(self, rule: Dict[str, Any], user_id: Optional[str] = None) -> Dict[str, Any]:
+        """Save recurring hours of rule['doctor_id'] on the rule['weekdays'] mask
+        from rule['start_date'] to rule['end_date'] (None: open-ended), as one
+        record. Newer rules and dated schedules win where they overlap."""
+        with self.backend.transaction():
+            revision = next_revision(self.backend.find('schedules', doctor_id=rule['doctor_id']))
+            record = {**rule, 'id': rule_id(rule['doctor_id'], revision), 'revision': revision}
+            self.backend.insert('schedules', record)
+        self._log_action('UPDATE_SCHEDULE',
+                        f'Set schedule of doctor {rule["doctor_id"]} from {rule["start_date"]} '
+                        f'to {rule.get("end_date") or "further notice"}',
+                        user_id)
+        return record
+    
+    def get_doctor_schedule(self, doctor_id: str, date: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get a doctor's saved schedule rules and dated schedules, or with a date
+        the schedule in force that day as a one-item list (empty if none)"""
+        schedules = self.backend.find('schedules', doctor_id=doctor_id)
+        if date is None:
+            return schedules
+        schedule = day_schedule(schedules, date)
+        return [schedule] if schedule else []
+    
     # Medicine Management
     def add_medicine(self, data: Dict[str, Any], user_id: str) -> Dict[str, Any]:
         """Add new medicine to inventory"""
-        medicines = self._load_data(self.files['medicines'])
-        
         medicine_id = str(uuid.uuid4())
         new_medicine = {
             'id': medicine_id,
@@ -190,8 +278,7 @@ class DataManager:
             **data
         }
         
-        medicines.append(new_medicine)
-        self._save_data(self.files['medicines'], medicines)
+        self.backend.insert('medicines', new_medicine)
         self._log_action('ADD_MEDICINE', 
                         f'Added medicine {data.get("name")}',
                         user_id)
@@ -199,31 +286,24 @@ class DataManager:
         return new_medicine
     
     def update_medicine_stock(self, medicine_id: str, quantity_change: int, user_id: str) -> Dict[str, Any]:
-        """Update medicine stock levels"""
-        medicines = self._load_data(self.files['medicines'])
-        
-        for i, medicine in enumerate(medicines):
-            if medicine['id'] == medicine_id:
-                new_quantity = medicine['quantity'] + quantity_change
-                if new_quantity < 0:
-                    raise ValueError("Insufficient stock")
-                
-                medicines[i]['quantity'] = new_quantity
-                medicines[i]['last_updated'] = datetime.now().isoformat()
-                
-                self._save_data(self.files['medicines'], medicines)
-                self._log_action('UPDATE_STOCK',
-                               f'Updated {medicine["name"]} stock by {quantity_change}',
-                               user_id)
-                return medicines[i]
-        
-        raise ValueError("Medicine not found")
+        """Update medicine stock levels (safe against concurrent stock changes)"""
+        def change(medicine: Dict[str, Any]) -> Dict[str, Any]:
+            new_quantity = medicine['quantity'] + quantity_change
+            if new_quantity < 0:
+                raise ValueError("Insufficient stock")
+            return {'quantity': new_quantity, 'last_updated': datetime.now().isoformat()}
+        
+        medicine = self.update_record('medicines', medicine_id, change)
+        if medicine is None:
+            raise ValueError("Medicine not found")
+        self._log_action('UPDATE_STOCK',
+                       f'Updated {medicine["name"]} stock by {quantity_change}',
+                       user_id)
+        return medicine
     
     # Lab Report Management
     def create_lab_report(self, data: Dict[str, Any], user_id: str) -> Dict[str, Any]:
         """Create new lab report"""
-        reports = self._load_data(self.files['lab_reports'])
-        
         report_id = str(uuid.uuid4())
         new_report = {
             'id': report_id,
@@ -232,8 +312,7 @@ class DataManager:
             **data
         }
         
-        reports.append(new_report)
-        self._save_data(self.files['lab_reports'], reports)
+        self.backend.insert('lab_reports', new_report)
         self._log_action('CREATE_LAB_REPORT',
                         f'Created lab report for patient {data.get("patient_id")}',
                         user_id)
@@ -243,8 +322,6 @@ class DataManager:
     # Billing Management
     def create_bill(self, data: Dict[str, Any], user_id: str) -> Dict[str, Any]:
         """Create new bill"""
-        bills = self._load_data(self.files['bills'])
-        
         bill_id = str(uuid.uuid4())
         new_bill = {
             'id': bill_id,
@@ -253,8 +330,7 @@ class DataManager:
             **data
         }
         
-        bills.append(new_bill)
-        self._save_data(self.files['bills'], bills)
+        self.backend.insert('bills', new_bill)
         self._log_action('CREATE_BILL',
                         f'Created bill for patient {data.get("patient_id")}',
                         user_id)
@@ -264,8 +340,6 @@ class DataManager:
     # Prescription Management
     def create_prescription(self, data: Dict[str, Any], user_id: str) -> Dict[str, Any]:
         """Create new prescription"""
-        prescriptions = self._load_data(self.files['prescriptions'])
-        
         prescription_id = str(uuid.uuid4())
         new_prescription = {
             'id': prescription_id,
@@ -273,8 +347,7 @@ class DataManager:
             **data
         }
         
-        prescriptions.append(new_prescription)
-        self._save_data(self.files['prescriptions'], prescriptions)
+        self.backend.insert('prescriptions', new_prescription)
         self._log_action('CREATE_PRESCRIPTION',
                         f'Created prescription for patient {data.get("patient_id")}',
                         user_id)
@@ -284,50 +357,67 @@ class DataManager:
     # Getters for analytics
     def get_users(self) -> List[Dict[str, Any]]:
         """Get all users"""
-        users = self._load_data(self.files['users'])
+        users = self.backend.load('users')
         return [{k: v for k, v in u.items() if k != 'password'} for u in users]
     
     def get_patients(self) -> List[Dict[str, Any]]:
         """Get all patients"""
-        return self._load_data(self.files['patients'])
+        return self.backend.load('patients')
     
     def get_appointments(self) -> List[Dict[str, Any]]:
         """Get all appointments"""
-        return self._load_data(self.files['appointments'])
+        return self.backend.load('appointments')
+    
+    def get_appointments_for_doctor(self, doctor_id: str, date: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get a doctor's appointments, optionally for one date"""
+        if date is None:
+            return self.backend.find('appointments', doctor_id=doctor_id)
+        return self.backend.find('appointments', doctor_id=doctor_id, date=date)
+    
+    def get_appointments_between(self, start_date: Optional[str] = None,
+                                 end_date: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get appointments dated within [start_date, end_date]; only the matching months are read"""
+        return self.backend.find_range('appointments', 'date', start_date, end_date)
     
     def get_medicines(self) -> List[Dict[str, Any]]:
         """Get all medicines"""
-        return self._load_data(self.files['medicines'])
+        return self.backend.load('medicines')
     
     def get_lab_reports(self) -> List[Dict[str, Any]]:
         """Get all lab reports"""
-        return self._load_data(self.files['lab_reports'])
+        return self.backend.load('lab_reports')
     
     def get_bills(self) -> List[Dict[str, Any]]:
         """Get all bills"""
-        return self._load_data(self.files['bills'])
+        return self.backend.load('bills')
+    
+    def get_bills_for_patient(self, patient_id: str) -> List[Dict[str, Any]]:
+        """Get all bills of one patient"""
+        return self.backend.find('bills', patient_id=patient_id)
     
     def get_prescriptions(self) -> List[Dict[str, Any]]:
         """Get all prescriptions"""
-        return self._load_data(self.files['prescriptions'])
+        return self.backend.load('prescriptions')
     
-    def get_audit_logs(self) -> List[Dict[str, Any]]:
-        """Get all audit logs"""
-        return self._load_data(self.files['audit_log'])
+    def get_audit_logs(self, start: Optional[Any] = None, end: Optional[Any] = None,
+                       user_id: Optional[str] = None, action: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Stream audit log entries, optionally filtered by time range, user and action"""
+        return self.audit_log.read(start=start, end=end, user_id=user_id, action=action)
+    
+    def export_collection(self, collection: str, path: str, fmt: Optional[str] = None,
+                          where: Optional[Any] = None, fields: Optional[List[str]] = None,
+                          progress: Optional[Any] = None) -> int:
+        """Stream a collection to CSV/JSONL (gzipped for *.gz paths); returns records written"""
+        return export_collection(self.backend, collection, path, fmt, where, fields, progress)
     
     # Search functionality
-    def search_records(self, collection: str, query: Dict[str, Any]) -> List[Dict[str, Any]]:
-        """Search records in a collection based on query parameters"""
-        data = self._load_data(self.files[collection])
-        results = []
-        
-        for record in data:
-            matches = True
-            for key, value in query.items():
-                if key not in record or record[key] != value:
-                    matches = False
-                    break
-            if matches:
-                results.append(record)
-        
-        return results
\ No newline at end of file
+    def search_records(self, collection: str, query: Dict[str, Any], order_by: Optional[Any] = None,
+                       limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+        """Search records in a collection; query supports equality, $in, ranges, $prefix,
+        $contains and $and/$or (see query_engine), answered through an index when one fits"""
+        return query_engine.search(self.backend, collection, query, order_by, limit, offset)
+    
+    def explain_search(self, collection: str, query: Dict[str, Any], order_by: Optional[Any] = None,
+                       limit: Optional[int] = None, offset: int = 0) -> str:
+        """Describe the plan search_records would use for the same arguments"""
+        return query_engine.explain(self.backend, collection, query, order_by, limit, offset)
@@ -6,6 +6,8 @@ from tkcalendar import Calendar
 import json
 import os
 
+from availability import weekday_mask
+
 class DoctorModule:
     def __init__(self, parent, data_manager, user):
         self.parent = parent
@@ -107,7 +109,7 @@ class DoctorModule:
         
         dialog = tk.Toplevel(self.parent)
         dialog.title("Set Schedule")
-        dialog.geometry("500x700")
+        dialog.geometry("500x750")
         dialog.transient(self.parent)
         dialog.grab_set()
         
@@ -134,6 +136,20 @@ class DoctorModule:
                           mindate=datetime.now())
         end_cal.pack(side='left', padx=5)
         
+        # Working Days
+        days_frame = tk.Frame(main_frame)
+        days_frame.pack(fill='x', pady=10)
+        
+        tk.Label(days_frame, text="Working Days:",
+                font=('Arial', 11, 'bold')).pack(side='left')
+        
+        day_vars = []
+        for i, day_name in enumerate(['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']):
+            day_var = tk.BooleanVar(value=i < 5)
+            tk.Checkbutton(days_frame, text=day_name,
+                          variable=day_var).pack(side='left')
+            day_vars.append(day_var)
+        
         # Time Range
         time_frame = tk.Frame(main_frame)
         time_frame.pack(fill='x', pady=20)
@@ -254,6 +270,10 @@ class DoctorModule:
                 if end_date < start_date:
                     raise ValueError("End date must be after start date")
                 
+                weekdays = weekday_mask(i for i, day_var in enumerate(day_vars) if day_var.get())
+                if not weekdays:
+                    raise ValueError("Select at least one working day")
+                
                 # Get breaks
                 breaks = []
                 for break_var in self.break_vars:
@@ -261,24 +281,18 @@ class DoctorModule:
                     break_end = f"{break_var[2].get()}:{break_var[3].get()}"
                     breaks.append([break_start, break_end])
                 
-                # Create schedule for each day
-                current_date = start_date
-                while current_date <= end_date:
-                    # Skip weekends
-                    if current_date.weekday() < 5:  # Monday to Friday
-                        schedule_data = {
-                            'doctor_id': doctor_id,
-                            'date': current_date.strftime("%Y-%m-%d"),
-                            'start_time': f"{start_hour.get()}:{start_minute.get()}",
-                            'end_time': f"{end_hour.get()}:{end_minute.get()}",
-                            'slot_duration': int(duration_var.get()),
-                            'breaks': breaks,
-                            'available': True
-                        }
-                        
-                        self.data_manager.update_doctor_schedule(schedule_data)
-                    
-                    current_date += timedelta(days=1)
+                # One rule for the whole range, expanded when a day is looked at
+                self.data_manager.set_doctor_schedule_rule({
+                    'doctor_id': doctor_id,
+                    'weekdays': weekdays,
+                    'start_date': start_date.strftime("%Y-%m-%d"),
+                    'end_date': end_date.strftime("%Y-%m-%d"),
+                    'start_time': f"{start_hour.get()}:{start_minute.get()}",
+                    'end_time': f"{end_hour.get()}:{end_minute.get()}",
+                    'slot_duration': int(duration_var.get()),
+                    'breaks': breaks,
+                    'available': True
+                })
                 
                 messagebox.showinfo("Success", "Schedule updated successfully!")
                 dialog.destroy()
@@ -313,9 +327,9 @@ class DoctorModule:
         tk.Label(main_frame, text=f"Analytics for Dr. {doctor_name}",
                 font=('Arial', 16, 'bold')).pack(pady=(0,20))
         
-        # Get statistics
-        appointments = [a for a in self.data_manager.get_appointments()
-                       if a['doctor_id'] == doctor_id]
+        # Get statistics from one consistent, read-only view
+        snapshot = self.data_manager.snapshot('appointments')
+        appointments = [a for a in snapshot['appointments'] if a['doctor_id'] == doctor_id]
         
         total_appointments = len(appointments)
         completed = len([a for a in appointments if a['status'] == 'completed'])
@@ -445,9 +459,7 @@ class DoctorModule:
             return
         
         # Get appointments for this day
-        appointments = [a for a in self.data_manager.get_appointments()
-                      if a['doctor_id'] == doctor_id and 
-                      a['date'] == selected_date]
+        appointments = self.data_manager.get_appointments_for_doctor(doctor_id, selected_date)
         
         # Generate time slots
         start_time = datetime.strptime(schedule['start_time'], "%H:%M")
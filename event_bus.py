@@ -0,0 +1,164 @@
+"""In-process change notifications for open screens.
+
+Every write made through DataManager publishes a ChangeEvent, so a module
+showing a table can patch just the affected row instead of clearing the
+Treeview and reloading the whole collection after each save.
+
+    unsubscribe = data_manager.events.subscribe(on_change, 'patients')
+
+Callbacks run synchronously on the thread that made the write, after it
+has been stored. Writes inside a transaction are announced when it
+commits, and not at all if it is rolled back. on_commit() ties other
+follow-up work (e.g. queueing a new appointment) to the same rule.
+"""
+import threading
+import traceback
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+
+class ChangeEvent(NamedTuple):
+    """One stored change. op is 'insert', 'update', 'delete' or 'reload';
+    'reload' (bulk inserts, whole-collection saves) carries no record and
+    means the subscriber should re-read the collection."""
+    collection: str
+    op: str
+    key: Any = None
+    new: Optional[Dict[str, Any]] = None
+    old: Optional[Dict[str, Any]] = None
+
+
+class EventBus:
+    """Delivers ChangeEvents to the callbacks subscribed to a collection"""
+
+    def __init__(self):
+        self._subscribers: Dict[Optional[str], List[Callable[[ChangeEvent], None]]] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def subscribe(self, callback: Callable[[ChangeEvent], None], *collections: str) -> Callable[[], None]:
+        """Call callback(event) on changes to collections (every collection
+        when none are given). Returns a function that unsubscribes again."""
+        topics = collections or (None,)
+        with self._lock:
+            for topic in topics:
+                self._subscribers.setdefault(topic, []).append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                for topic in topics:
+                    if callback in self._subscribers.get(topic, []):
+                        self._subscribers[topic].remove(callback)
+        return unsubscribe
+
+    def wants(self, collection: str) -> bool:
+        """Whether anyone listens to collection (lets publishers skip building events)"""
+        return bool(self._subscribers.get(collection) or self._subscribers.get(None))
+
+    def publish(self, event: ChangeEvent) -> None:
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            pending.append(event)
+            return
+        with self._lock:
+            callbacks = self._subscribers.get(event.collection, []) + self._subscribers.get(None, [])
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception:
+                # A broken screen must not fail a write that is already stored
+                traceback.print_exc()
+
+    def on_commit(self, callback: Callable[..., None], *args: Any) -> None:
+        """Call callback(*args) once this thread's held-back events are
+        published (right away outside deferred()); dropped with them if
+        the block raises"""
+        if getattr(self._local, 'pending', None) is None:
+            callback(*args)
+        else:
+            self._local.after.append((callback, args))
+
+    @contextmanager
+    def deferred(self):
+        """Hold back this thread's events until the block ends; they are
+        dropped if it raises. Nested blocks join the outermost one."""
+        if getattr(self._local, 'pending', None) is not None:
+            yield
+            return
+        self._local.pending = []
+        self._local.after = []
+        try:
+            yield
+            events, after = self._local.pending, self._local.after
+        finally:
+            self._local.pending = None
+            self._local.after = None
+        for event in events:
+            self.publish(event)
+        for callback, args in after:
+            callback(*args)
+
+
+class PublishingBackend:
+    """Storage backend wrapper that publishes every write to an EventBus.
+
+    Old and new records are copies, so subscribers can keep them. When
+    nobody listens to a collection its writes pass straight through.
+    """
+
+    def __init__(self, inner: Any, bus: EventBus):
+        self.inner = inner
+        self.bus = bus
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.inner, name)
+
+    def _key_of(self, collection: str, record: Dict[str, Any], key: Any) -> Any:
+        key_field = self.inner.collections[collection]['key']
+        return key if key_field is None else record.get(key_field)
+
+    def _current(self, collection: str, key: Any) -> Optional[Dict[str, Any]]:
+        record = self.inner.get(collection, key)
+        return None if record is None else dict(record)
+
+    @contextmanager
+    def transaction(self):
+        with self.bus.deferred(), self.inner.transaction():
+            yield
+
+    def save(self, collection: str, data: Any) -> None:
+        self.inner.save(collection, data)
+        if self.bus.wants(collection):
+            self.bus.publish(ChangeEvent(collection, 'reload'))
+
+    def insert(self, collection: str, record: Dict[str, Any], key: Any = None) -> None:
+        self.inner.insert(collection, record, key)
+        if self.bus.wants(collection):
+            key = self._key_of(collection, record, key)
+            # The stored record, which carries the version the backend gave it
+            self.bus.publish(ChangeEvent(collection, 'insert', key,
+                                         new=self._current(collection, key) or dict(record)))
+
+    def insert_many(self, collection: str, records: List[Dict[str, Any]]) -> None:
+        self.inner.insert_many(collection, records)
+        if self.bus.wants(collection):
+            self.bus.publish(ChangeEvent(collection, 'reload'))
+
+    def update(self, collection: str, key: Any, changes: Dict[str, Any],
+               expected_version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        if not self.bus.wants(collection):
+            return self.inner.update(collection, key, changes, expected_version)
+        old = self._current(collection, key)
+        record = self.inner.update(collection, key, changes, expected_version)
+        if record is not None:
+            self.bus.publish(ChangeEvent(collection, 'update', key, new=dict(record), old=old))
+        return record
+
+    def delete(self, collection: str, key: Any) -> bool:
+        if not self.bus.wants(collection):
+            return self.inner.delete(collection, key)
+        old = self._current(collection, key)
+        deleted = self.inner.delete(collection, key)
+        if deleted:
+            self.bus.publish(ChangeEvent(collection, 'delete', key, old=old))
+        return deleted
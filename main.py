@@ -3,6 +3,7 @@ from tkinter import ttk, messagebox, filedialog
 from tkinter import font as tkfont
 import json
 import csv
+from concurrent.futures import ThreadPoolExecutor
 import os
 from datetime import datetime, timedelta
 import random
@@ -25,6 +26,21 @@ from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
 import seaborn as sns
 from analytics_manager import AnalyticsManager
 from billing_module import BillingModule
+from collection_cache import CollectionCache
+from data_export import export_collection
+from event_bus import EventBus, PublishingBackend
+from id_sequences import IdSequences, max_sequence_number
+import patient_matching
+import query_engine
+from text_search import SEARCH_LIMIT, TextSearch
+from autocomplete import AUTOCOMPLETE_LIMIT, Autocomplete
+from autocomplete_combobox import AutocompleteCombobox
+from appointment_intervals import AppointmentIntervals, duration_minutes
+from availability import DoctorAvailability, day_schedule, next_revision, rule_id, schedule_id
+from slot_finder import SlotFinder
+import batch_scheduler
+from storage_backends import (COLLECTIONS, JournalBackend, JsonBackend, PartitionedBackend, SQLiteBackend,
+                              VersionConflict, migrate_json_to_sqlite)
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
@@ -93,7 +109,17 @@ class Queue:
 class DataManager:
     """Centralized data management with CSV/JSON support"""
     
-    def __init__(self):
+    # ID prefix -> (collection, id field) used to seed a new sequence
+    ID_PREFIXES = {
+        'P': ('patients', 'id'),
+        'D': ('doctors', 'id'),
+        'A': ('appointments', 'id'),
+        'M': ('pharmacy', 'id'),
+        'L': ('lab_reports', 'id'),
+        'B': ('billing', 'bill_no'),
+    }
+    
+    def __init__(self, use_cache=True, storage='json', codec='compact'):
         # Set data directory in the user's home folder
         self.data_dir = os.path.join(os.path.expanduser('~'), 'hospital_data')
         self.ensure_data_directory()
@@ -107,6 +133,47 @@ class DataManager:
         self.billing_file = os.path.join(self.data_dir, "billing.json")
         self.users_file = os.path.join(self.data_dir, "users.json")
         
+        # File path -> collection name, for callers still using load_data/save_data
+        self.file_collections = {
+            self.patients_file: 'patients',
+            self.doctors_file: 'doctors',
+            self.appointments_file: 'appointments',
+            self.pharmacy_file: 'pharmacy',
+            self.lab_file: 'lab_reports',
+            self.billing_file: 'billing',
+            self.users_file: 'users'
+        }
+        
+        # Parsed collections kept in memory; set use_cache=False to always hit disk
+        self.cache = CollectionCache(enabled=use_cache)
+        
+        # Storage backend: 'json' (one file per collection), 'journal'
+        # (snapshots + append-only change log) or 'sqlite'. codec picks how
+        # the file backends write snapshots: 'compact', 'json' (indented) or 'binary'
+        self.codec = codec
+        
+        # Every write is announced on self.events so open screens can
+        # update the changed rows instead of reloading whole tables
+        self.events = EventBus()
+        self.backend = PublishingBackend(self.create_backend(storage), self.events)
+        
+        # Trigram indexes behind the search boxes, patched from the same events
+        self.text_search = TextSearch(self.backend, self.events)
+        # Sorted name/ID index behind the patient and doctor pickers
+        self.completions = Autocomplete(self.backend, self.events)
+        # Per-doctor appointment intervals behind the booking conflict check
+        self.appointment_intervals = AppointmentIntervals(self.backend, self.events)
+        # Working hours per doctor and day, parsed once from schedules, doctor
+        # records and the bundled data/doctors.json
+        self.availability = DoctorAvailability(
+            self.backend, self.events,
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'doctors.json'))
+        # Free-cell bitmaps per doctor and day behind the next-free-slot search
+        self.slot_finder = SlotFinder(self.backend, self.events, self.appointment_intervals, self.availability)
+        
+        # Persistent per-prefix ID counters shared by every process
+        self.id_sequences = IdSequences(os.path.join(self.data_dir, "sequences.json"))
+        
         # Initialize default data
         self.initialize_default_data()
         
@@ -116,6 +183,22 @@ class DataManager:
         # Appointment queue
         self.appointment_queue = Queue()
     
+    def create_backend(self, storage):
+        """Create the storage backend; a new SQLite database is seeded from existing JSON files once"""
+        if storage == 'json':
+            return PartitionedBackend(JsonBackend(self.data_dir, COLLECTIONS, self.cache, self.codec))
+        if storage == 'journal':
+            return PartitionedBackend(JournalBackend(self.data_dir, COLLECTIONS, self.cache, self.codec))
+        if storage == 'sqlite':
+            db_path = os.path.join(self.data_dir, "hospital.db")
+            is_new = not os.path.exists(db_path)
+            # Bills and appointments may already be split into monthly partition directories
+            if is_new and any(os.path.exists(path) or os.path.isdir(os.path.splitext(path)[0])
+                              for path in self.file_collections):
+                migrate_json_to_sqlite(self.data_dir, db_path)
+            return SQLiteBackend(db_path)
+        raise ValueError(f"Unknown storage backend: {storage}")
+    
     def ensure_data_directory(self):
         """Create data directory if it doesn't exist"""
         if not os.path.exists(self.data_dir):
@@ -125,7 +208,7 @@ class DataManager:
         """Initialize with sample data if files don't exist"""
         
         # Users
-        if not os.path.exists(self.users_file):
+        if not self.backend.exists('users'):
             users = {
                 "admin": {"password": "admin123", "role": "admin", "name": "Administrator"},
                 "reception": {"password": "reception123", "role": "reception", "name": "Reception Desk"},
@@ -136,7 +219,7 @@ class DataManager:
             self.save_data(self.users_file, users)
         
         # Doctors
-        if not os.path.exists(self.doctors_file):
+        if not self.backend.exists('doctors'):
             doctors = [
                 {"id": "D001", "name": "Dr. Sarah Smith", "specialization": "Cardiology", 
                  "contact": "555-0101", "availability": "Mon-Fri 9AM-5PM", "email": "sarah.smith@hospital.com"},
@@ -152,7 +235,7 @@ class DataManager:
             self.save_data(self.doctors_file, doctors)
         
         # Patients
-        if not os.path.exists(self.patients_file):
+        if not self.backend.exists('patients'):
             patients = [
                 {"id": "P001", "name": "Robert Anderson", "age": 45, "gender": "Male", 
                  "disease": "Hypertension", "doctor": "Dr. Sarah Smith", "admit_date": "2025-01-15",
@@ -167,7 +250,7 @@ class DataManager:
             self.save_data(self.patients_file, patients)
         
         # Pharmacy
-        if not os.path.exists(self.pharmacy_file):
+        if not self.backend.exists('pharmacy'):
             pharmacy = [
                 {"id": "M001", "name": "Paracetamol", "stock": 500, "price": 2.50, "category": "Pain Relief"},
                 {"id": "M002", "name": "Amoxicillin", "stock": 300, "price": 15.00, "category": "Antibiotic"},
@@ -178,7 +261,7 @@ class DataManager:
             self.save_data(self.pharmacy_file, pharmacy)
         
         # Lab Reports
-        if not os.path.exists(self.lab_file):
+        if not self.backend.exists('lab_reports'):
             lab_reports = [
                 {"id": "L001", "patient_id": "P001", "patient_name": "Robert Anderson", 
                  "test": "Blood Test", "result": "Normal", "date": "2025-01-16", "remarks": "All parameters within range"},
@@ -188,7 +271,7 @@ class DataManager:
             self.save_data(self.lab_file, lab_reports)
         
         # Appointments
-        if not os.path.exists(self.appointments_file):
+        if not self.backend.exists('appointments'):
             appointments = [
                 {"id": "A001", "patient_name": "Robert Anderson", "patient_id": "P001", 
                  "doctor": "Dr. Sarah Smith", "doctor_id": "D001",
@@ -204,7 +287,7 @@ class DataManager:
             self.save_data(self.appointments_file, appointments)
         
         # Billing
-        if not os.path.exists(self.billing_file):
+        if not self.backend.exists('billing'):
             billing = [
                 {"bill_no": "B001", "patient_id": "P001", "patient_name": "Robert Anderson", 
                  "services": "Consultation, Blood Test", "subtotal": 150.00, "tax": 15.00, 
@@ -212,172 +295,337 @@ class DataManager:
             ]
             self.save_data(self.billing_file, billing)
     
+    def warm_up(self, collections=None, max_workers=2):
+        """Parse collections (and build their search indexes) on a background
+        thread pool so later screens find them in memory. users is done
+        first since login needs it.
+        File reads overlap, but parsing holds the GIL, so few workers are
+        enough. Returns {collection: future}; failures surface again on
+        first real use.
+        """
+        order = ['users', 'patients', 'doctors', 'appointments', 'billing', 'pharmacy', 'lab_reports']
+        collections = collections or order
+        
+        def prepare(collection):
+            self.backend.preload(collection)
+            if collection in self.text_search.fields:
+                self.text_search.index(collection)
+            if collection in self.completions.fields:
+                self.completions.index(collection)
+            if collection == self.appointment_intervals.collection:
+                self.appointment_intervals.build()
+            if collection == 'doctors':
+                self.slot_finder.prepare()
+        
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='warm-up')
+        futures = {c: executor.submit(prepare, c) for c in collections}
+        executor.shutdown(wait=False)
+        return futures
+    
+    def transaction(self):
+        """Group several writes: `with data_manager.transaction(): ...`
+        Each touched collection is written once when the block ends, and
+        nothing is written if the block raises.
+        """
+        return self.backend.transaction()
+    
+    def snapshot(self, *collections):
+        """Consistent read-only view of collections (all when none are given).
+        
+        Nothing is copied and later writes do not show through, so charts
+        and analytics can read it, even on a worker thread, while others
+        keep saving: snapshot = dm.snapshot('billing'); snapshot['billing']
+        """
+        return self.backend.snapshot(*collections)
+    
+    def export_collection(self, collection, path, fmt=None, where=None, fields=None, progress=None):
+        """Stream a collection to a CSV/JSONL file (gzipped for *.gz paths).
+        where filters records, fields picks and orders the columns and
+        progress(done, total) is called every 1000 records.
+        """
+        return export_collection(self.backend, collection, path, fmt, where, fields, progress)
+    
+    def search_records(self, collection, query, order_by=None, limit=None, offset=0):
+        """Records matching a query, read through an index when one fits:
+        search_records('appointments', {'doctor_id': 'D001', 'date': {'$gte': today}},
+                       order_by='date', limit=10)  (operators: see query_engine)
+        """
+        return query_engine.search(self.backend, collection, query, order_by, limit, offset)
+    
+    def explain_search(self, collection, query, order_by=None, limit=None, offset=0):
+        """Describe the plan search_records would use for the same arguments"""
+        return query_engine.explain(self.backend, collection, query, order_by, limit, offset)
+    
+    def search_text(self, collection, term, limit=None, where=None):
+        """Patients, medicines or bills whose search fields contain term (or
+        nearly do, for typos), best matches first; where filters further"""
+        return self.text_search.search(collection, term, limit, where)
+    
+    def matches_text(self, collection, term, record):
+        """Whether search_text(collection, term) would return record"""
+        return self.text_search.matches(collection, term, record)
+    
+    def autocomplete(self, collection, prefix, limit=AUTOCOMPLETE_LIMIT):
+        """'ID - Name' labels of patients or doctors whose ID, name or a word
+        of the name starts with prefix"""
+        return self.completions.complete(collection, prefix, limit)
+    
+    def autocomplete_records(self, collection, prefix, limit=AUTOCOMPLETE_LIMIT):
+        """The patient or doctor records behind autocomplete()"""
+        return self.completions.records(collection, prefix, limit)
+    
+    def find_duplicate_patients(self, threshold=0.85, max_block=200):
+        """Likely duplicate patients, compared only within shared blocking keys"""
+        return patient_matching.find_duplicates(self.backend.iter_records('patients'), threshold, max_block)
+    
+    def merge_patients(self, keep_id, duplicate_id):
+        """Fold duplicate_id into keep_id, re-pointing its appointments, bills and lab reports"""
+        return patient_matching.merge_patients(self.backend, keep_id, duplicate_id)
+    
     def save_data(self, filepath, data):
-        """Save data to JSON file"""
-        with open(filepath, 'w') as f:
-            json.dump(data, f, indent=4)
+        """Replace the whole collection stored at filepath"""
+        self.backend.save(self.file_collections[filepath], data)
     
     def load_data(self, filepath):
-        """Load data from JSON file"""
-        if os.path.exists(filepath):
-            with open(filepath, 'r') as f:
-                return json.load(f)
-        return [] if filepath != self.users_file else {}
+        """Load the whole collection stored at filepath"""
+        return self.backend.load(self.file_collections[filepath])
+    
+    def update_record(self, collection, key, change, attempts=5):
+        """Update a record with changes computed from its current contents.
+        
+        change(record) returns the changes to apply. The write only succeeds
+        if nobody updated the record since it was read (compare-and-swap on
+        its version); otherwise change is re-run on the fresh record, so a
+        value derived from stale data never overwrites a newer one.
+        Returns the updated record, or None if it does not exist.
+        """
+        for _ in range(attempts):
+            record = self.backend.get(collection, key)
+            if record is None:
+                return None
+            changes = change(dict(record))
+            try:
+                return self.backend.update(collection, key, changes,
+                                           expected_version=record.get('version', 0))
+            except VersionConflict:
+                continue
+        raise VersionConflict(f"{collection} {key} keeps changing; try again")
     
     # Patient operations
     def get_patients(self):
-        return self.load_data(self.patients_file)
+        return self.backend.load('patients')
     
     def add_patient(self, patient):
-        patients = self.get_patients()
-        patients.append(patient)
-        self.save_data(self.patients_file, patients)
+        self.backend.insert('patients', patient)
     
     def update_patient(self, patient_id, updated_data):
-        patients = self.get_patients()
-        for i, patient in enumerate(patients):
-            if patient['id'] == patient_id:
-                patients[i].update(updated_data)
-                self.save_data(self.patients_file, patients)
-                return True
-        return False
+        return self.backend.update('patients', patient_id, updated_data) is not None
     
     def delete_patient(self, patient_id):
-        patients = self.get_patients()
-        patients = [p for p in patients if p['id'] != patient_id]
-        self.save_data(self.patients_file, patients)
+        self.backend.delete('patients', patient_id)
     
     def get_patient_by_id(self, patient_id):
-        """Dictionary lookup for O(n) search"""
-        patients = self.get_patients()
-        patient_dict = {p['id']: p for p in patients}
-        return patient_dict.get(patient_id)
+        return self.backend.get('patients', patient_id)
     
     # Doctor operations
     def get_doctors(self):
-        return self.load_data(self.doctors_file)
+        return self.backend.load('doctors')
     
     def add_doctor(self, doctor):
-        doctors = self.get_doctors()
-        doctors.append(doctor)
-        self.save_data(self.doctors_file, doctors)
+        self.backend.insert('doctors', doctor)
     
     def update_doctor(self, doctor_id, updated_data):
-        doctors = self.get_doctors()
-        for i, doctor in enumerate(doctors):
-            if doctor['id'] == doctor_id:
-                doctors[i].update(updated_data)
-                self.save_data(self.doctors_file, doctors)
-                return True
-        return False
+        return self.backend.update('doctors', doctor_id, updated_data) is not None
     
     def delete_doctor(self, doctor_id):
-        doctors = self.get_doctors()
-        doctors = [d for d in doctors if d['id'] != doctor_id]
-        self.save_data(self.doctors_file, doctors)
+        self.backend.delete('doctors', doctor_id)
+    
+    def get_doctor_by_id(self, doctor_id):
+        return self.backend.get('doctors', doctor_id)
+    
+    def get_reference_availability(self, doctor_id):
+        """Weekly availability ({'days': [...], 'timing': ...}) of a doctor in the
+        bundled data/doctors.json, or None"""
+        return self.availability.reference(doctor_id)
+    
+    def get_working_windows(self, doctor_id, day):
+        """(start, end) minutes after midnight a doctor works on day (a date or
+        'YYYY-MM-DD'); [] on a day off, None when their hours are unknown"""
+        return self.availability.working_windows(doctor_id, day)
+    
+    def get_doctor_workday(self, doctor_id, day):
+        """The doctor's Workday on day (prints as '09:00-13:00, 14:00-17:00' or
+        'off'), None when their hours are unknown"""
+        return self.availability.workday(doctor_id, day)
+    
+    def is_doctor_available(self, doctor_id, start, duration_minutes):
+        """Whether the doctor works throughout [start, start + duration_minutes)"""
+        return self.availability.is_available(doctor_id, start, duration_minutes)
+    
+    def update_doctor_schedule(self, schedule):
+        """Save a doctor's hours for schedule['date'], overriding their rules on that date"""
+        key = schedule_id(schedule['doctor_id'], schedule['date'])
+        with self.backend.transaction():
+            record = dict(schedule, revision=next_revision(
+                self.backend.find('schedules', doctor_id=schedule['doctor_id'])))
+            if self.backend.get('schedules', key) is None:
+                self.backend.insert('schedules', {'id': key, **record})
+            else:
+                self.backend.update('schedules', key, record)
+        return self.backend.get('schedules', key)
+    
+    def set_doctor_schedule_rule(self, rule):
+        """Save recurring hours of rule['doctor_id'] on the rule['weekdays'] mask
+        from rule['start_date'] to rule['end_date'] (None: open-ended), as one
+        record. Newer rules and dated schedules win where they overlap."""
+        with self.backend.transaction():
+            revision = next_revision(self.backend.find('schedules', doctor_id=rule['doctor_id']))
+            record = {**rule, 'id': rule_id(rule['doctor_id'], revision), 'revision': revision}
+            self.backend.insert('schedules', record)
+        return record
+    
+    def get_doctor_schedule(self, doctor_id, date=None):
+        """A doctor's saved schedule rules and dated schedules, or with a date
+        the schedule in force that day as a one-item list (empty if none)"""
+        schedules = self.backend.find('schedules', doctor_id=doctor_id)
+        if date is None:
+            return schedules
+        schedule = day_schedule(schedules, date)
+        return [schedule] if schedule else []
+    
+    def find_free_slots(self, doctor_id=None, specialization=None, department=None,
+                        duration=30, count=5, after=None):
+        """The next count free slots (Slot: start, doctor_id, doctor_name) of
+        duration minutes for a doctor, or any doctor of a specialization or
+        department, earliest first"""
+        return self.slot_finder.next_slots(doctor_id, specialization, department, duration, count, after)
+    
+    def schedule_requests(self, requests, after=None, horizon_days=batch_scheduler.HORIZON_DAYS, dry_run=False):
+        """Place a waiting list of BookingRequests in free slots and, unless
+        dry_run, book them all in one transaction; returns a BatchReport"""
+        report = batch_scheduler.plan(self.slot_finder, requests, after, horizon_days)
+        if report.bookings and not dry_run:
+            batch_scheduler.book(self.backend, self.slot_finder, report,
+                                 self.reserve_ids('A', len(report.bookings)))
+            for appointment in report.appointments:
+                self.events.on_commit(self.appointment_queue.enqueue, appointment)
+        return report
     
     # Appointment operations
     def get_appointments(self):
-        return self.load_data(self.appointments_file)
+        return self.backend.load('appointments')
     
     def add_appointment(self, appointment):
-        appointments = self.get_appointments()
-        appointments.append(appointment)
-        self.save_data(self.appointments_file, appointments)
-        self.appointment_queue.enqueue(appointment)
+        self.backend.insert('appointments', appointment)
+        # Inside transaction() the appointment is queued only once it commits
+        self.events.on_commit(self.appointment_queue.enqueue, appointment)
     
     def update_appointment(self, appointment_id, updated_data):
-        appointments = self.get_appointments()
-        for i, appt in enumerate(appointments):
-            if appt['id'] == appointment_id:
-                appointments[i].update(updated_data)
-                self.save_data(self.appointments_file, appointments)
-                return True
-        return False
+        return self.backend.update('appointments', appointment_id, updated_data) is not None
     
     def delete_appointment(self, appointment_id):
-        appointments = self.get_appointments()
-        appointments = [a for a in appointments if a['id'] != appointment_id]
-        self.save_data(self.appointments_file, appointments)
+        self.backend.delete('appointments', appointment_id)
+    
+    def get_appointment_by_id(self, appointment_id):
+        return self.backend.get('appointments', appointment_id)
+    
+    def get_appointments_for_doctor(self, doctor_id, date=None):
+        """Appointments of one doctor, optionally on one date (uses the doctor/date indexes)"""
+        if date is None:
+            return self.backend.find('appointments', doctor_id=doctor_id)
+        return self.backend.find('appointments', doctor_id=doctor_id, date=date)
+    
+    def get_appointment_conflicts(self, doctor_id, start, end, exclude=None):
+        """The doctor's appointments overlapping [start, end) (datetimes), other than exclude"""
+        return self.appointment_intervals.conflicts(doctor_id, start, end, exclude)
+    
+    def get_appointments_overlapping(self, start, end, doctor_id=None):
+        """Appointments overlapping [start, end), of one doctor or of all, by start time"""
+        return self.appointment_intervals.overlapping(start, end, doctor_id)
+    
+    def get_appointments_between(self, start_date=None, end_date=None):
+        """Appointments dated within [start_date, end_date] ('YYYY-MM-DD', either end may be open)"""
+        return self.backend.find_range('appointments', 'date', start_date, end_date)
     
     # Pharmacy operations
     def get_medicines(self):
-        return self.load_data(self.pharmacy_file)
+        return self.backend.load('pharmacy')
     
     def add_medicine(self, medicine):
-        medicines = self.get_medicines()
-        medicines.append(medicine)
-        self.save_data(self.pharmacy_file, medicines)
+        self.backend.insert('pharmacy', medicine)
     
     def update_medicine(self, medicine_id, updated_data):
-        medicines = self.get_medicines()
-        for i, med in enumerate(medicines):
-            if med['id'] == medicine_id:
-                medicines[i].update(updated_data)
-                self.save_data(self.pharmacy_file, medicines)
-                return True
-        return False
+        return self.backend.update('pharmacy', medicine_id, updated_data) is not None
+    
+    def adjust_medicine_stock(self, medicine_id, delta):
+        """Add delta (negative to remove) to the current stock; returns the new stock.
+        Raises ValueError if the stock would go negative."""
+        def change(medicine):
+            stock = int(medicine.get('stock', 0)) + delta
+            if stock < 0:
+                raise ValueError(f"Only {medicine.get('stock', 0)} in stock")
+            return {'stock': stock}
+        
+        medicine = self.update_record('pharmacy', medicine_id, change)
+        return None if medicine is None else medicine['stock']
     
     def delete_medicine(self, medicine_id):
-        medicines = self.get_medicines()
-        medicines = [m for m in medicines if m['id'] != medicine_id]
-        self.save_data(self.pharmacy_file, medicines)
+        self.backend.delete('pharmacy', medicine_id)
+    
+    def get_medicine_by_id(self, medicine_id):
+        return self.backend.get('pharmacy', medicine_id)
     
     # Lab operations
     def get_lab_reports(self):
-        return self.load_data(self.lab_file)
+        return self.backend.load('lab_reports')
     
     def add_lab_report(self, report):
-        reports = self.get_lab_reports()
-        reports.append(report)
-        self.save_data(self.lab_file, reports)
+        self.backend.insert('lab_reports', report)
     
     def update_lab_report(self, report_id, updated_data):
-        reports = self.get_lab_reports()
-        for i, report in enumerate(reports):
-            if report['id'] == report_id:
-                reports[i].update(updated_data)
-                self.save_data(self.lab_file, reports)
-                return True
-        return False
+        return self.backend.update('lab_reports', report_id, updated_data) is not None
     
     def delete_lab_report(self, report_id):
-        reports = self.get_lab_reports()
-        reports = [r for r in reports if r['id'] != report_id]
-        self.save_data(self.lab_file, reports)
+        self.backend.delete('lab_reports', report_id)
+    
+    def get_lab_report_by_id(self, report_id):
+        return self.backend.get('lab_reports', report_id)
     
     # Billing operations
     def get_bills(self):
-        return self.load_data(self.billing_file)
+        return self.backend.load('billing')
     
     def add_bill(self, bill):
-        bills = self.get_bills()
         # Push to undo stack
         self.billing_undo_stack.push(('add', bill))
-        bills.append(bill)
-        self.save_data(self.billing_file, bills)
+        self.backend.insert('billing', bill)
 
-    def update_bill(self, bill):
-        """Update an existing bill by bill_no; if not present, add it."""
-        bills = self.get_bills()
-        for i, b in enumerate(bills):
-            if b.get('bill_no') == bill.get('bill_no'):
-                bills[i].update(bill)
-                self.save_data(self.billing_file, bills)
-                return True
-        # Not found -> append
-        bills.append(bill)
-        self.save_data(self.billing_file, bills)
+    def update_bill(self, bill_no, changes):
+        """Apply changes to the bill bill_no; if not present, add it."""
+        if self.backend.update('billing', bill_no, changes) is None:
+            # Not found -> append
+            self.backend.insert('billing', dict(changes, bill_no=bill_no))
         return True
     
+    def delete_bill(self, bill_no):
+        return self.backend.delete('billing', bill_no)
+    
+    def get_bill_by_no(self, bill_no):
+        return self.backend.get('billing', bill_no)
+    
+    def get_bills_for_patient(self, patient_id):
+        return self.backend.find('billing', patient_id=patient_id)
+    
+    def get_bills_between(self, start_date=None, end_date=None):
+        """Bills dated within [start_date, end_date] ('YYYY-MM-DD', either end may be open)"""
+        return self.backend.find_range('billing', 'date', start_date, end_date)
+    
     def undo_last_bill(self):
         """Undo last billing operation using Stack"""
         if not self.billing_undo_stack.is_empty():
             operation, bill = self.billing_undo_stack.pop()
             if operation == 'add':
-                bills = self.get_bills()
-                bills = [b for b in bills if b['bill_no'] != bill['bill_no']]
-                self.save_data(self.billing_file, bills)
+                self.backend.delete('billing', bill['bill_no'])
                 return True
         return False
     
@@ -387,7 +635,7 @@ class DataManager:
         The users file stores a mapping username -> {password, role, name}.
         This function converts it to a list of dicts with 'id' set to username.
         """
-        data = self.load_data(self.users_file)
+        data = self.backend.load('users')
         if isinstance(data, dict):
             users = []
             for uname, info in data.items():
@@ -399,12 +647,11 @@ class DataManager:
     
     def verify_user(self, username, password):
         # The users file stores a dict mapping usernames to info. Verify against it.
-        data = self.load_data(self.users_file)
-        if isinstance(data, dict) and username in data:
-            if data[username].get('password') == password:
-                user = data[username].copy()
-                user['id'] = username
-                return user
+        info = self.backend.get('users', username)
+        if info and info.get('password') == password:
+            user = info.copy()
+            user['id'] = username
+            return user
         return None
 
     def add_user(self, username, password, role, name, **kwargs):
@@ -412,30 +659,35 @@ class DataManager:
         to remain compatible with the existing simple verifier. If you prefer hashed
         passwords we can migrate to hashed storage (recommended).
         """
-        data = self.load_data(self.users_file)
-        if not isinstance(data, dict):
-            data = {}
-        if username in data:
+        if self.backend.get('users', username) is not None:
             raise ValueError('Username already exists')
-        data[username] = {'password': password, 'role': role, 'name': name}
+        info = {'password': password, 'role': role, 'name': name}
         # Merge extra fields
         for k, v in kwargs.items():
-            data[username][k] = v
-        self.save_data(self.users_file, data)
-        return {'id': username, **data[username]}
-    
-    def generate_id(self, prefix, existing_list):
-        """Generate unique ID"""
-        if not existing_list:
-            return f"{prefix}001"
-        
-        max_num = 0
-        for item in existing_list:
-            if 'id' in item:
-                num_part = int(item['id'][len(prefix):])
-                max_num = max(max_num, num_part)
-        
-        return f"{prefix}{str(max_num + 1).zfill(3)}"
+            info[k] = v
+        self.backend.insert('users', info, key=username)
+        return {'id': username, **info}
+    
+    def generate_id(self, prefix, existing_list=None):
+        """Allocate the next ID for prefix from its persistent sequence.
+        The records are only scanned once, to seed a sequence on first use;
+        existing_list is the fallback seed for prefixes not in ID_PREFIXES.
+        """
+        return self.id_sequences.next_id(prefix, seed=lambda: self._sequence_seed(prefix, existing_list))
+    
+    def reserve_ids(self, prefix, count):
+        """Allocate a block of consecutive IDs at once (bulk imports)"""
+        return self.id_sequences.reserve(prefix, count,
+                                         seed=lambda: self._sequence_seed(prefix, None))
+    
+    def _sequence_seed(self, prefix, existing_list):
+        """Highest number already used for prefix"""
+        if prefix in self.ID_PREFIXES:
+            collection, field = self.ID_PREFIXES[prefix]
+            records = self.backend.load(collection)
+        else:
+            records, field = existing_list or [], 'id'
+        return max_sequence_number(prefix, (r.get(field, '') for r in records))
 
 # ==================== LOGIN WINDOW ====================
 
@@ -862,13 +1114,12 @@ class DashboardModule:
         # Get statistics
         patients = self.data_manager.get_patients()
         doctors = self.data_manager.get_doctors()
-        appointments = self.data_manager.get_appointments()
         bills = self.data_manager.get_bills()
         
         total_revenue = sum(bill['total'] for bill in bills if bill.get('status') == 'Paid')
         
         today = datetime.now().strftime("%Y-%m-%d")
-        today_appointments = [a for a in appointments if a.get('date') == today]
+        today_appointments = self.data_manager.search_records('appointments', {'date': today})
         
         stats = [
             {'title': 'Total Patients', 'value': len(patients), 'icon': '🏥', 'color': '#3498db'},
@@ -1002,6 +1253,10 @@ class PatientsModule:
         
         self.create_widgets()
         self.load_patients()
+        
+        # Patch rows as patients change instead of reloading the table
+        unsubscribe = data_manager.events.subscribe(self.on_patients_changed, 'patients')
+        self.tree.bind('<Destroy>', lambda e: unsubscribe())
     
     def create_widgets(self):
         # Title Bar
@@ -1074,49 +1329,46 @@ class PatientsModule:
     
     def load_patients(self):
         """Load all patients into table"""
-        # Clear existing
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        
-        patients = self.data_manager.get_patients()
-        
-        for patient in patients:
-            self.tree.insert('', 'end', values=(
-                patient['id'],
-                patient['name'],
-                patient['age'],
-                patient['gender'],
-                patient['disease'],
-                patient['doctor'],
-                patient['admit_date'],
-                patient['contact'],
-                patient.get('blood_group', 'N/A')
-            ))
+        self.search_patients()
     
     def search_patients(self):
         """Search patients by name or ID"""
-        search_term = self.search_var.get().lower()
-        
         # Clear existing
         for item in self.tree.get_children():
             self.tree.delete(item)
         
-        patients = self.data_manager.get_patients()
-        
-        for patient in patients:
-            if (search_term in patient['name'].lower() or 
-                search_term in patient['id'].lower()):
-                self.tree.insert('', 'end', values=(
-                    patient['id'],
-                    patient['name'],
-                    patient['age'],
-                    patient['gender'],
-                    patient['disease'],
-                    patient['doctor'],
-                    patient['admit_date'],
-                    patient['contact'],
-                    patient.get('blood_group', 'N/A')
-                ))
+        for patient in self.data_manager.search_text('patients', self.search_var.get(), SEARCH_LIMIT):
+            self.show_patient(patient)
+    
+    def matches_search(self, patient):
+        return self.data_manager.matches_text('patients', self.search_var.get(), patient)
+    
+    def show_patient(self, patient):
+        """Insert or refresh the patient's row (rows are keyed by patient ID)"""
+        values = (
+            patient['id'],
+            patient['name'],
+            patient['age'],
+            patient['gender'],
+            patient['disease'],
+            patient['doctor'],
+            patient['admit_date'],
+            patient['contact'],
+            patient.get('blood_group', 'N/A')
+        )
+        if self.tree.exists(patient['id']):
+            self.tree.item(patient['id'], values=values)
+        else:
+            self.tree.insert('', 'end', iid=patient['id'], values=values)
+    
+    def on_patients_changed(self, event):
+        """Apply one change event to the table"""
+        if event.op == 'reload':
+            self.search_patients()
+        elif event.op != 'delete' and self.matches_search(event.new):
+            self.show_patient(event.new)
+        elif self.tree.exists(event.key):
+            self.tree.delete(event.key)
     
     def add_patient(self):
         """Open dialog to add new patient"""
@@ -1139,8 +1391,7 @@ class PatientsModule:
         fields = {}
         
         # Patient ID (auto-generated)
-        patients = self.data_manager.get_patients()
-        new_id = self.data_manager.generate_id('P', patients)
+        new_id = self.data_manager.generate_id('P')
         
         tk.Label(form_frame, text=f"Patient ID: {new_id}", font=('Arial', 11, 'bold')).grid(
             row=0, column=0, columnspan=2, pady=(0, 20))
@@ -1197,7 +1448,6 @@ class PatientsModule:
             self.data_manager.add_patient(patient_data)
             messagebox.showinfo("Success", "Patient added successfully!")
             dialog.destroy()
-            self.load_patients()
         
         tk.Button(btn_frame, text="💾 Save", font=('Arial', 11, 'bold'),
                  bg='#2ecc71', fg='white', relief='flat', cursor='hand2',
@@ -1357,7 +1607,6 @@ class PatientsModule:
             self.data_manager.update_patient(patient_id, updated_data)
             messagebox.showinfo("Success", "Patient updated successfully!")
             dialog.destroy()
-            self.load_patients()
         
         tk.Button(btn_frame, text="💾 Update", font=('Arial', 11, 'bold'),
                  bg='#2ecc71', fg='white', relief='flat', cursor='hand2',
@@ -1373,7 +1622,6 @@ class PatientsModule:
             self.data_manager.delete_patient(patient_id)
             messagebox.showinfo("Success", "Patient deleted successfully!")
             parent_dialog.destroy()
-            self.load_patients()
     
     def show_context_menu(self, event):
         """Show right-click context menu"""
@@ -1404,7 +1652,6 @@ class PatientsModule:
             if messagebox.askyesno("Confirm Delete", "Are you sure you want to delete this patient?"):
                 self.data_manager.delete_patient(patient_id)
                 messagebox.showinfo("Success", "Patient deleted successfully!")
-                self.load_patients()
 
 # ==================== DOCTORS MODULE ====================
 
@@ -1500,8 +1747,7 @@ class DoctorsModule:
         
         fields = {}
         
-        doctors = self.data_manager.get_doctors()
-        new_id = self.data_manager.generate_id('D', doctors)
+        new_id = self.data_manager.generate_id('D')
         
         tk.Label(form_frame, text=f"Doctor ID: {new_id}", font=('Arial', 11, 'bold')).grid(
             row=0, column=0, columnspan=2, pady=(0, 20))
@@ -1555,8 +1801,7 @@ class DoctorsModule:
         item = self.tree.item(selected[0])
         doctor_id = item['values'][0]
         
-        doctors = self.data_manager.get_doctors()
-        doctor = next((d for d in doctors if d['id'] == doctor_id), None)
+        doctor = self.data_manager.get_doctor_by_id(doctor_id)
         
         if not doctor:
             return
@@ -1650,28 +1895,13 @@ class AppointmentsModule:
     
     def _convert_duration_to_minutes(self, duration_str):
         """Convert duration string to minutes"""
-        if 'min' in duration_str:
-            return int(duration_str.split()[0])
-        elif 'hour' in duration_str:
-            hours = float(duration_str.split()[0])
-            return int(hours * 60)
-        return 30  # default to 30 minutes
-    
-    def _check_appointment_conflict(self, appointments, start_time, end_time, doctor_id):
+        return duration_minutes(duration_str)
+    
+    def _check_appointment_conflict(self, start_time, end_time, doctor_id):
         """Check if the appointment time conflicts with existing appointments"""
         doctor_id = doctor_id.split(' - ')[0]  # Extract doctor ID from the combobox value
-        for appt in appointments:
-            if appt['doctor_id'] == doctor_id:
-                # Convert appointment time to datetime
-                appt_date = datetime.strptime(f"{appt['date']} {appt['time']}", "%Y-%m-%d %H:%M")
-                # Calculate appointment end time based on duration
-                duration = self._convert_duration_to_minutes(appt.get('duration', '30 min'))
-                appt_end = appt_date + timedelta(minutes=duration)
-                
-                # Check for overlap
-                if not (end_time <= appt_date or start_time >= appt_end):
-                    return True
-        return False
+        # Looked up in the doctor's interval index, not by parsing their appointments
+        return bool(self.data_manager.get_appointment_conflicts(doctor_id, start_time, end_time))
 
     def _get_doctor_availability(self, doctor_id):
         """Load doctor availability from data/doctors.json if present.
@@ -1679,57 +1909,7 @@ class AppointmentsModule:
         Returns availability dict like { 'days': [...], 'timing': '09:00 AM - 05:00 PM' }
         or None if not found.
         """
-        try:
-            import json
-            with open(os.path.join(os.path.dirname(__file__), 'data', 'doctors.json'), 'r') as f:
-                data = json.load(f)
-                doctors = data.get('doctors', []) if isinstance(data, dict) else data
-                for d in doctors:
-                    if d.get('id') == doctor_id or d.get('id') == doctor_id.split(' - ')[0]:
-                        return d.get('availability')
-        except Exception:
-            return None
-
-    def _is_within_doctor_availability(self, availability, appt_datetime, duration_minutes):
-        """Check whether a datetime and duration fits into doctor's availability.
-
-        availability: {'days': ['Monday', ...], 'timing': '09:00 AM - 05:00 PM'}
-        """
-        if not availability:
-            return True  # If unknown, allow and rely on conflict checks
-
-        # Check day
-        appt_day = appt_datetime.strftime('%A')
-        days = availability.get('days', [])
-        if days and appt_day not in days:
-            return False
-
-        # Parse timing
-        timing = availability.get('timing', '')
-        try:
-            parts = timing.split('-')
-            start_str = parts[0].strip()
-            end_str = parts[1].strip()
-
-            # Convert like '09:00 AM' to 24h time
-            start_dt = datetime.strptime(start_str, '%I:%M %p')
-            end_dt = datetime.strptime(end_str, '%I:%M %p')
-
-            appt_time_only = appt_datetime.replace(year=start_dt.year, month=start_dt.month, day=start_dt.day)
-            # Construct todays start/end with the appt date
-            start_today = appt_datetime.replace(hour=start_dt.hour, minute=start_dt.minute, second=0, microsecond=0)
-            end_today = appt_datetime.replace(hour=end_dt.hour, minute=end_dt.minute, second=0, microsecond=0)
-
-            appt_end = appt_datetime + timedelta(minutes=duration_minutes)
-
-            # If end time crosses the end_today, it's not allowed
-            if appt_datetime < start_today or appt_end > end_today:
-                return False
-        except Exception:
-            # If parsing fails, be permissive and allow booking (but conflict checks still apply)
-            return True
-
-        return True
+        return self.data_manager.get_reference_availability(doctor_id)
 
     def load_appointments(self):
         for item in self.tree.get_children():
@@ -1773,11 +1953,10 @@ class AppointmentsModule:
         
         # Patient Selection
         tk.Label(form_frame, text="Patient:", font=('Arial', 11)).pack(anchor='w')
-        patients = self.data_manager.get_patients()
-        patient_options = [f"{p['id']} - {p['name']}" for p in patients]
         self.patient_var = tk.StringVar()
-        patient_cb = ttk.Combobox(form_frame, textvariable=self.patient_var, 
-                                 values=patient_options, width=40)
+        patient_cb = AutocompleteCombobox(form_frame,
+                                          lambda text: self.data_manager.autocomplete('patients', text),
+                                          textvariable=self.patient_var, width=40)
         patient_cb.pack(fill='x', pady=(0, 15))
         
         # Doctor Selection
@@ -1865,6 +2044,23 @@ class AppointmentsModule:
                                   values=durations, width=15)
         duration_cb.pack(side='left')
         
+        # Next free slots of the chosen doctor (or of any doctor in a specialization)
+        slots_frame = tk.Frame(form_frame)
+        slots_frame.pack(fill='x', pady=(0, 15))
+        
+        tk.Label(slots_frame, text="Specialization:", font=('Arial', 11)).pack(side='left')
+        specializations = sorted({d.get('specialization', '') for d in self.data_manager.get_doctors()} - {''})
+        self.specialization_var = tk.StringVar()
+        ttk.Combobox(slots_frame, textvariable=self.specialization_var,
+                     values=[''] + specializations, width=18).pack(side='left', padx=5)
+        tk.Button(slots_frame, text="Find Free Slots", font=('Arial', 10),
+                  command=self.show_free_slots).pack(side='left', padx=5)
+        
+        self.slots_list = tk.Listbox(form_frame, height=4, font=('Arial', 10))
+        self.slots_list.pack(fill='x', pady=(0, 15))
+        self.slots_list.bind('<<ListboxSelect>>', self.use_free_slot)
+        self.free_slots = []
+        
         # Purpose/Notes
         tk.Label(form_frame, text="Purpose:", font=('Arial', 11)).pack(anchor='w')
         self.purpose_text = tk.Text(form_frame, height=4, font=('Arial', 11))
@@ -1887,6 +2083,34 @@ class AppointmentsModule:
                  bg='#2ecc71', fg='white', command=lambda: self.save_appointment(dialog),
                  width=15).pack(side='right', padx=5)
                  
+    def show_free_slots(self):
+        """List the next free slots of the selected doctor, or of the chosen specialization"""
+        doctor = self.doctor_var.get()
+        specialization = self.specialization_var.get().strip()
+        if not doctor and not specialization:
+            messagebox.showerror("Error", "Please select a doctor or a specialization")
+            return
+        self.free_slots = self.data_manager.find_free_slots(
+            doctor_id=None if specialization else doctor.split(' - ')[0],
+            specialization=specialization or None,
+            duration=self._convert_duration_to_minutes(self.duration_var.get()), count=10)
+        self.slots_list.delete(0, 'end')
+        for slot in self.free_slots:
+            self.slots_list.insert('end', str(slot))
+        if not self.free_slots:
+            self.slots_list.insert('end', "No free slots in the next 90 days")
+    
+    def use_free_slot(self, event=None):
+        """Fill doctor, date and time from the picked free slot"""
+        selection = self.slots_list.curselection()
+        if not selection or selection[0] >= len(self.free_slots):
+            return
+        slot = self.free_slots[selection[0]]
+        self.doctor_var.set(f"{slot.doctor_id} - {slot.doctor_name}")
+        self.date_var.set(slot.start.strftime("%Y-%m-%d"))
+        self.hour_var.set(slot.start.strftime("%H"))
+        self.minute_var.set(slot.start.strftime("%M"))
+    
     def save_appointment(self, dialog):
         # Get values from form
         patient = self.patient_var.get()
@@ -1902,7 +2126,11 @@ class AppointmentsModule:
             
         # Split IDs from display strings
         patient_id = patient.split(' - ')[0]
-        patient_name = patient.split(' - ')[1]
+        patient_record = self.data_manager.get_patient_by_id(patient_id)
+        if patient_record is None:
+            messagebox.showerror("Error", "Please pick a patient from the suggestions")
+            return
+        patient_name = patient_record['name']
         doctor_id = doctor.split(' - ')[0]
         doctor_name = doctor.split(' - ')[1]
         
@@ -1921,27 +2149,22 @@ class AppointmentsModule:
         duration_minutes = self._convert_duration_to_minutes(duration)
         appt_end = appt_datetime + timedelta(minutes=duration_minutes)
 
-        # Get existing appointments
-        appointments = self.data_manager.get_appointments()
-
-        # Check doctor availability (if defined in data/doctors.json)
+        # Check doctor availability (dated schedule, doctor record or data/doctors.json)
         doctor_id = doctor.split(' - ')[0]
-        availability = self._get_doctor_availability(doctor_id)
-        if availability and not self._is_within_doctor_availability(availability, appt_datetime, duration_minutes):
-            timing = availability.get('timing', 'N/A')
-            days = ', '.join(availability.get('days', [])) if availability.get('days') else 'N/A'
+        if not self.data_manager.is_doctor_available(doctor_id, appt_datetime, duration_minutes):
+            workday = self.data_manager.get_doctor_workday(doctor_id, appt_datetime.date())
             messagebox.showerror("Not Available", 
                                  f"Selected doctor is not available on {appt_datetime.strftime('%A')} at {time_str}.\n"
-                                 f"Availability: {days} | {timing}")
+                                 f"Working hours that day: {workday}")
             return
 
         # Check for conflicts with existing appointments
-        if self._check_appointment_conflict(appointments, appt_datetime, appt_end, doctor):
+        if self._check_appointment_conflict(appt_datetime, appt_end, doctor):
             messagebox.showerror("Error", "This time slot conflicts with an existing appointment")
             return
 
         # Generate new appointment ID properly using data manager
-        new_id = self.data_manager.generate_id('A', appointments)
+        new_id = self.data_manager.generate_id('A')
         
         # Create appointment data
         appointment_data = {
@@ -1986,8 +2209,13 @@ class PharmacyModule:
         self.parent = parent
         self.data_manager = data_manager
         self.user = user
+        self.low_stock = {}  # medicine ID -> alert line, for stock <= 20
         self.create_widgets()
         self.load_medicines()
+        
+        # Patch rows and alerts as medicines change instead of reloading
+        unsubscribe = data_manager.events.subscribe(self.on_medicines_changed, 'pharmacy')
+        self.tree.bind('<Destroy>', lambda e: unsubscribe())
     
     def create_widgets(self):
         title_frame = tk.Frame(self.parent, bg='white')
@@ -2064,56 +2292,71 @@ class PharmacyModule:
         """Load medicines and update low stock alerts"""
         for item in self.tree.get_children():
             self.tree.delete(item)
+        self.low_stock.clear()
         
-        medicines = self.data_manager.get_medicines()
-        low_stock_items = []
-        
-        for med in medicines:
-            stock = med['stock']
-            status = "🟢 In Stock" if stock > 20 else "🟡 Low Stock" if stock > 0 else "🔴 Out of Stock"
-            
-            if stock <= 20:  # Low stock threshold
-                low_stock_items.append(f"⚠️ {med['name']}: {stock} units remaining")
-            
-            self.tree.insert('', 'end', values=(
-                med['id'],
-                med['name'],
-                med['category'],
-                stock,
-                f"${med['price']:.2f}",
-                status
-            ))
-        
-        # Update alerts
-        self.alert_list.delete('1.0', 'end')
-        if low_stock_items:
-            self.alert_list.insert('1.0', '\n'.join(low_stock_items))
-        else:
-            self.alert_list.insert('1.0', "✅ All items sufficiently stocked")
+        for med in self.data_manager.get_medicines():
+            self.track_stock(med)
+            if self.matches_search(med):
+                self.show_medicine(med)
+        self.update_alerts()
     
     def search_medicines(self):
         """Search medicines by name or category"""
-        search_term = self.search_var.get().lower()
-        
         for item in self.tree.get_children():
             self.tree.delete(item)
         
-        medicines = self.data_manager.get_medicines()
-        
-        for med in medicines:
-            if (search_term in med['name'].lower() or 
-                search_term in med['category'].lower()):
-                stock = med['stock']
-                status = "🟢 In Stock" if stock > 20 else "🟡 Low Stock" if stock > 0 else "🔴 Out of Stock"
-                
-                self.tree.insert('', 'end', values=(
-                    med['id'],
-                    med['name'],
-                    med['category'],
-                    stock,
-                    f"${med['price']:.2f}",
-                    status
-                ))
+        for med in self.data_manager.search_text('pharmacy', self.search_var.get(), SEARCH_LIMIT):
+            self.show_medicine(med)
+    
+    def matches_search(self, med):
+        return self.data_manager.matches_text('pharmacy', self.search_var.get(), med)
+    
+    def show_medicine(self, med):
+        """Insert or refresh the medicine's row (rows are keyed by medicine ID)"""
+        stock = med['stock']
+        status = "🟢 In Stock" if stock > 20 else "🟡 Low Stock" if stock > 0 else "🔴 Out of Stock"
+        values = (
+            med['id'],
+            med['name'],
+            med['category'],
+            stock,
+            f"${med['price']:.2f}",
+            status
+        )
+        if self.tree.exists(med['id']):
+            self.tree.item(med['id'], values=values)
+        else:
+            self.tree.insert('', 'end', iid=med['id'], values=values)
+    
+    def track_stock(self, med):
+        if med['stock'] <= 20:  # Low stock threshold
+            self.low_stock[med['id']] = f"⚠️ {med['name']}: {med['stock']} units remaining"
+        else:
+            self.low_stock.pop(med['id'], None)
+    
+    def update_alerts(self):
+        self.alert_list.delete('1.0', 'end')
+        if self.low_stock:
+            self.alert_list.insert('1.0', '\n'.join(self.low_stock.values()))
+        else:
+            self.alert_list.insert('1.0', "✅ All items sufficiently stocked")
+    
+    def on_medicines_changed(self, event):
+        """Apply one change event to the table and the low stock alerts"""
+        if event.op == 'reload':
+            self.load_medicines()
+            return
+        if event.op == 'delete':
+            self.low_stock.pop(event.key, None)
+            if self.tree.exists(event.key):
+                self.tree.delete(event.key)
+        else:
+            self.track_stock(event.new)
+            if self.matches_search(event.new):
+                self.show_medicine(event.new)
+            elif self.tree.exists(event.key):
+                self.tree.delete(event.key)
+        self.update_alerts()
     
     def add_medicine(self):
         """Add new medicine to inventory"""
@@ -2133,8 +2376,7 @@ class PharmacyModule:
         fields = {}
         
         # Generate new ID
-        medicines = self.data_manager.get_medicines()
-        new_id = self.data_manager.generate_id('M', medicines)
+        new_id = self.data_manager.generate_id('M')
         
         tk.Label(form_frame, text=f"Medicine ID: {new_id}", 
                 font=('Arial', 11, 'bold')).pack(pady=(0, 20))
@@ -2207,7 +2449,6 @@ class PharmacyModule:
             self.data_manager.add_medicine(medicine_data)
             messagebox.showinfo("Success", "Medicine added successfully!")
             dialog.destroy()
-            self.load_medicines()
         
         # Buttons
         btn_frame = tk.Frame(form_frame)
@@ -2280,33 +2521,32 @@ class PharmacyModule:
         def update():
             try:
                 quantity = int(quantity_var.get())
-                if quantity <= 0:
-                    messagebox.showerror("Error", "Please enter a positive number!")
-                    return
-                
-                new_stock = current_stock + quantity if adj_var.get() == '+' else current_stock - quantity
-                
-                if new_stock < 0:
-                    messagebox.showerror("Error", "Stock cannot be negative!")
-                    return
-                
-                # Update in database
-                medicines = self.data_manager.get_medicines()
-                for med in medicines:
-                    if med['id'] == medicine_id:
-                        med['stock'] = new_stock
-                        break
-                
-                self.data_manager.save_data(self.data_manager.pharmacy_file, medicines)
-                
-                messagebox.showinfo("Success", 
-                                  f"Stock updated successfully!\n"
-                                  f"New stock: {new_stock}")
-                dialog.destroy()
-                self.load_medicines()
-                
             except ValueError:
                 messagebox.showerror("Error", "Please enter a valid number!")
+                return
+            if quantity <= 0:
+                messagebox.showerror("Error", "Please enter a positive number!")
+                return
+            
+            # Apply the adjustment to the stored stock, not the figure shown
+            # when the dialog opened: another workstation may have changed it
+            delta = quantity if adj_var.get() == '+' else -quantity
+            try:
+                new_stock = self.data_manager.adjust_medicine_stock(medicine_id, delta)
+            except VersionConflict as e:
+                messagebox.showerror("Error", str(e))
+                return
+            except ValueError as e:
+                messagebox.showerror("Error", f"Stock cannot be negative!\n{e}")
+                return
+            if new_stock is None:
+                messagebox.showerror("Error", "Medicine no longer exists!")
+                return
+            
+            messagebox.showinfo("Success", 
+                              f"Stock updated successfully!\n"
+                              f"New stock: {new_stock}")
+            dialog.destroy()
         
         tk.Button(form_frame, text="🔄 Update Stock", font=('Arial', 11, 'bold'),
                  bg='#2ecc71', fg='white', relief='flat', cursor='hand2',
@@ -2321,8 +2561,7 @@ class PharmacyModule:
         item = self.tree.item(selected[0])
         medicine_id = item['values'][0]
         
-        medicines = self.data_manager.get_medicines()
-        medicine = next((m for m in medicines if m['id'] == medicine_id), None)
+        medicine = self.data_manager.get_medicine_by_id(medicine_id)
         
         if not medicine:
             return
@@ -2467,8 +2706,7 @@ class LabModule:
         form_frame.pack(fill='both', expand=True)
         
         # Report ID
-        reports = self.data_manager.get_lab_reports()
-        new_id = self.data_manager.generate_id('L', reports)
+        new_id = self.data_manager.generate_id('L')
         
         tk.Label(form_frame, text=f"Report ID: {new_id}", font=('Arial', 11, 'bold')).grid(
             row=0, column=0, columnspan=2, pady=(0, 20))
@@ -2554,8 +2792,7 @@ class LabModule:
         item = self.tree.item(selected[0])
         report_id = item['values'][0]
         
-        reports = self.data_manager.get_lab_reports()
-        report = next((r for r in reports if r['id'] == report_id), None)
+        report = self.data_manager.get_lab_report_by_id(report_id)
         
         if not report:
             return
@@ -2789,31 +3026,30 @@ class BillReportsModule:
         for item in self.tree.get_children():
             self.tree.delete(item)
         
-        bills = self.data_manager.get_bills()
-        
-        # Apply patient filter
-        selected_patient = self.patient_var.get()
-        if selected_patient != "All Patients":
-            patient_id = selected_patient.split(' - ')[0]
-            bills = [b for b in bills if b['patient_id'] == patient_id]
-        
-        # Apply date filter
+        start_date = end_date = None
         filter_option = self.filter_var.get()
         if filter_option != "All":
             today = datetime.now()
             if filter_option == "Today":
-                bills = [b for b in bills if b['date'] == today.strftime("%Y-%m-%d")]
+                start_date = end_date = today.strftime("%Y-%m-%d")
             elif filter_option == "This Week":
-                week_ago = today - timedelta(days=7)
-                bills = [b for b in bills if datetime.strptime(b['date'], "%Y-%m-%d") >= week_ago]
+                start_date = (today - timedelta(days=7)).strftime("%Y-%m-%d")
             elif filter_option == "This Month":
-                month_ago = today - timedelta(days=30)
-                bills = [b for b in bills if datetime.strptime(b['date'], "%Y-%m-%d") >= month_ago]
+                start_date = (today - timedelta(days=30)).strftime("%Y-%m-%d")
             elif filter_option == "Custom Range" and hasattr(self, 'custom_date_range'):
                 start_date, end_date = self.custom_date_range
-                bills = [b for b in bills if start_date <= b['date'] <= end_date]
         
-        for bill in bills:
+        query = {}
+        if start_date or end_date:
+            query['date'] = {op: value for op, value in (('$gte', start_date), ('$lte', end_date)) if value}
+        
+        # Apply patient filter
+        selected_patient = self.patient_var.get()
+        if selected_patient != "All Patients":
+            query['patient_id'] = selected_patient.split(' - ')[0]
+        
+        # The planner uses the patient index, else the date index (reading only those months)
+        for bill in self.data_manager.search_records('billing', query):
             self.tree.insert('', 'end', values=(
                 bill['bill_no'],
                 bill['patient_name'],
@@ -2833,8 +3069,7 @@ class BillReportsModule:
         item = self.tree.item(selected[0])
         bill_no = item['values'][0]
         
-        bills = self.data_manager.get_bills()
-        bill = next((b for b in bills if b['bill_no'] == bill_no), None)
+        bill = self.data_manager.get_bill_by_no(bill_no)
         
         if not bill:
             return
@@ -2935,14 +3170,17 @@ class BillReportsModule:
                     messagebox.showerror("Error", "Please enter transaction ID")
                     return
                     
-                bill['status'] = 'PAID'
-                bill['payment_method'] = payment_method.get()
-                bill['transaction_id'] = transaction_id.get()
-                bill['payment_date'] = datetime.now().strftime("%Y-%m-%d")
-                bill['payment_notes'] = notes.get('1.0', 'end-1c')
+                payment = {
+                    'status': 'PAID',
+                    'payment_method': payment_method.get(),
+                    'transaction_id': transaction_id.get(),
+                    'payment_date': datetime.now().strftime("%Y-%m-%d"),
+                    'payment_notes': notes.get('1.0', 'end-1c')
+                }
                 
                 # Update bill in data manager
-                self.data_manager.update_bill(bill)
+                self.data_manager.update_bill(bill['bill_no'], payment)
+                bill.update(payment)
                 self.load_reports()
                 
                 messagebox.showinfo("Success", "Payment recorded successfully!")
@@ -3045,8 +3283,7 @@ class BillReportsModule:
         item = self.tree.item(selected[0])
         bill_no = item['values'][0]
         
-        bills = self.data_manager.get_bills()
-        bill = next((b for b in bills if b['bill_no'] == bill_no), None)
+        bill = self.data_manager.get_bill_by_no(bill_no)
         
         if bill:
             self.quick_pay(bill, None)
@@ -3060,8 +3297,7 @@ class BillReportsModule:
         item = self.tree.item(selected[0])
         bill_no = item['values'][0]
         
-        bills = self.data_manager.get_bills()
-        bill = next((b for b in bills if b['bill_no'] == bill_no), None)
+        bill = self.data_manager.get_bill_by_no(bill_no)
         
         if not bill:
             return
@@ -3099,13 +3335,15 @@ class BillReportsModule:
         notes_text.pack(fill='x', pady=(5, 15))
         
         def update_status():
-            bill['status'] = status_var.get()
-            bill['payment_method'] = method_var.get()
-            bill['payment_notes'] = notes_text.get('1.0', 'end-1c')
+            changes = {
+                'status': status_var.get(),
+                'payment_method': method_var.get(),
+                'payment_notes': notes_text.get('1.0', 'end-1c')
+            }
             if status_var.get().upper() == 'PAID':
-                bill['payment_date'] = datetime.now().strftime("%Y-%m-%d")
+                changes['payment_date'] = datetime.now().strftime("%Y-%m-%d")
             
-            self.data_manager.update_bill(bill)
+            self.data_manager.update_bill(bill['bill_no'], changes)
             self.load_reports()
             dialog.destroy()
             messagebox.showinfo("Success", "Payment status updated successfully!")
@@ -3124,8 +3362,7 @@ class BillReportsModule:
         item = self.tree.item(selected[0])
         bill_no = item['values'][0]
         
-        bills = self.data_manager.get_bills()
-        bill = next((b for b in bills if b['bill_no'] == bill_no), None)
+        bill = self.data_manager.get_bill_by_no(bill_no)
         
         if bill:
             self.generate_bill_pdf(bill)
@@ -3139,8 +3376,7 @@ class BillReportsModule:
         item = self.tree.item(selected[0])
         bill_no = item['values'][0]
         
-        bills = self.data_manager.get_bills()
-        bill = next((b for b in bills if b['bill_no'] == bill_no), None)
+        bill = self.data_manager.get_bill_by_no(bill_no)
         
         if bill:
             self.email_bill(bill)
@@ -3173,6 +3409,9 @@ class BillReportsModule:
         dialog.geometry("800x600")
         dialog.transient(self.parent)
         
+        # Every chart reads the same read-only snapshot of the bills
+        bills = self.data_manager.snapshot('billing')['billing']
+        
         # Notebook for different analytics views
         notebook = ttk.Notebook(dialog)
         notebook.pack(fill='both', expand=True, padx=10, pady=10)
@@ -3180,27 +3419,25 @@ class BillReportsModule:
         # Revenue Trends
         revenue_frame = ttk.Frame(notebook)
         notebook.add(revenue_frame, text="Revenue Trends")
-        self.create_revenue_chart(revenue_frame)
+        self.create_revenue_chart(revenue_frame, bills)
         
         # Payment Methods
         payment_frame = ttk.Frame(notebook)
         notebook.add(payment_frame, text="Payment Methods")
-        self.create_payment_methods_chart(payment_frame)
+        self.create_payment_methods_chart(payment_frame, bills)
         
         # Status Overview
         status_frame = ttk.Frame(notebook)
         notebook.add(status_frame, text="Status Overview")
-        self.create_status_overview(status_frame)
+        self.create_status_overview(status_frame, bills)
         
         # Bills by Month
         monthly_frame = ttk.Frame(notebook)
         notebook.add(monthly_frame, text="Monthly Analysis")
-        self.create_monthly_analysis(monthly_frame)
+        self.create_monthly_analysis(monthly_frame, bills)
     
-    def create_revenue_chart(self, parent):
+    def create_revenue_chart(self, parent, bills):
         """Create revenue trends chart"""
-        bills = self.data_manager.get_bills()
-        
         # Group bills by date
         dates = {}
         for bill in bills:
@@ -3246,10 +3483,8 @@ class BillReportsModule:
             tk.Label(stats_frame, text=value, font=('Arial', 11)).grid(
                 row=i//2, column=i%2*2+1, sticky='w', padx=5, pady=5)
     
-    def create_payment_methods_chart(self, parent):
+    def create_payment_methods_chart(self, parent, bills):
         """Create payment methods distribution chart"""
-        bills = self.data_manager.get_bills()
-        
         # Count payment methods
         methods = {}
         for bill in bills:
@@ -3295,10 +3530,8 @@ class BillReportsModule:
             tk.Label(stats_frame, text=f"₹{method_amounts[method]:,.2f}", 
                     font=('Arial', 11)).pack(side='left', padx=5)
     
-    def create_status_overview(self, parent):
+    def create_status_overview(self, parent, bills):
         """Create payment status overview"""
-        bills = self.data_manager.get_bills()
-        
         # Group by status
         status_counts = {}
         status_amounts = {}
@@ -3335,10 +3568,8 @@ class BillReportsModule:
         canvas.draw()
         canvas.get_tk_widget().pack(fill='both', expand=True, padx=10, pady=10)
     
-    def create_monthly_analysis(self, parent):
+    def create_monthly_analysis(self, parent, bills):
         """Create monthly bills analysis"""
-        bills = self.data_manager.get_bills()
-        
         # Group by month
         monthly_data = {}
         for bill in bills:
@@ -3488,19 +3719,20 @@ class BillReportsModule:
         transaction_id = tk.Entry(transaction_frame, width=40)
         transaction_id.pack(fill='x', pady=5)
         
+        pending_payment = {}
+        
         def process_payment():
             if not transaction_id.get().strip():
                 messagebox.showerror("Error", "Please enter transaction ID")
                 return
                 
-            # Update bill status
-            # Update bill in-memory (not yet saved)
-            bill['_pending_payment'] = {
+            # Keep the payment in the dialog until it is saved
+            pending_payment.update({
                 'status': 'PAID',
                 'payment_method': payment_method.get(),
                 'transaction_id': transaction_id.get(),
                 'payment_date': datetime.now().strftime("%Y-%m-%d")
-            }
+            })
             # Enable Save button
             save_btn.config(state='normal')
             messagebox.showinfo("Processed", "Payment processed locally. Click Save to persist the payment.")
@@ -3516,21 +3748,14 @@ class BillReportsModule:
         process_button.pack(side='left', padx=5)
 
         def save_payment():
-            pending = bill.get('_pending_payment')
-            if not pending:
+            if not pending_payment:
                 messagebox.showerror("Error", "No processed payment to save. Click Process first.")
                 return
-            # Apply pending payment fields to bill and persist
-            bill['status'] = f"PAID"
-            bill['payment_method'] = pending.get('payment_method')
-            bill['transaction_id'] = pending.get('transaction_id')
-            bill['payment_date'] = pending.get('payment_date')
-            # Remove pending marker
-            if '_pending_payment' in bill:
-                del bill['_pending_payment']
 
-            # Persist
-            self.data_manager.update_bill(bill)
+            # Persist, then show the paid bill in this dialog
+            self.data_manager.update_bill(bill['bill_no'], pending_payment)
+            bill.update(pending_payment)
+            pending_payment.clear()
             self.load_reports()
             messagebox.showinfo("Saved", "Payment saved successfully.")
             # Enable print button
@@ -3906,8 +4131,7 @@ class BillReportsModule:
         form_frame.pack(fill='both', expand=True)
         
         # Bill number
-        bills = self.data_manager.get_bills()
-        new_bill_no = self.data_manager.generate_id('B', bills)
+        new_bill_no = self.data_manager.generate_id('B')
         
         tk.Label(form_frame, text=f"Bill Number: {new_bill_no}", font=('Arial', 14, 'bold')).pack(pady=10)
         
@@ -4345,8 +4569,7 @@ class BillReportsModule:
         item = self.tree.item(selected[0])
         bill_no = item['values'][0]
         
-        bills = self.data_manager.get_bills()
-        bill = next((b for b in bills if b['bill_no'] == bill_no), None)
+        bill = self.data_manager.get_bill_by_no(bill_no)
         
         if not bill:
             return
@@ -4512,10 +4735,9 @@ class EmergencyModule:
         tk.Label(inner_frame, text="Assign Doctor:", font=('Arial', 12, 'bold'),
                 bg='white').grid(row=len(field_list)+1, column=0, sticky='w', pady=10, padx=(0, 20))
         
-        doctors = self.data_manager.get_doctors()
-        doctor_names = [d['name'] for d in doctors]
-        fields['doctor'] = ttk.Combobox(inner_frame, values=doctor_names,
-                                       state='readonly', font=('Arial', 11), width=30)
+        fields['doctor'] = AutocompleteCombobox(inner_frame,
+                                                lambda text: self.data_manager.autocomplete('doctors', text),
+                                                font=('Arial', 11), width=30)
         fields['doctor'].grid(row=len(field_list)+1, column=1, pady=10)
         
         def register_emergency():
@@ -4527,13 +4749,34 @@ class EmergencyModule:
                     return
                 patient_data[key] = value
             
-            patients = self.data_manager.get_patients()
-            patient_data['id'] = self.data_manager.generate_id('P', patients)
-            patient_data['admit_date'] = datetime.now().strftime("%Y-%m-%d")
+            doctor = self.data_manager.get_doctor_by_id(patient_data['doctor'].split(' - ')[0])
+            if doctor is None:
+                messagebox.showerror("Error", "Please pick a doctor from the suggestions")
+                return
+            patient_data['doctor'] = doctor['name']
+            
+            now = datetime.now()
+            patient_data['id'] = self.data_manager.generate_id('P')
+            patient_data['admit_date'] = now.strftime("%Y-%m-%d")
             patient_data['address'] = 'Emergency'
             patient_data['blood_group'] = 'Unknown'
             
-            self.data_manager.add_patient(patient_data)
+            # Register the patient and book them with the assigned doctor in one go
+            with self.data_manager.transaction():
+                self.data_manager.add_patient(patient_data)
+                self.data_manager.add_appointment({
+                    'id': self.data_manager.generate_id('A'),
+                    'patient_name': patient_data['name'],
+                    'patient_id': patient_data['id'],
+                    'doctor': doctor['name'],
+                    'doctor_id': doctor['id'],
+                    'date': now.strftime("%Y-%m-%d"),
+                    'time': now.strftime("%H:%M"),
+                    'duration': '30 min',
+                    'purpose': 'Emergency',
+                    'status': 'Scheduled',
+                    'emergency': True
+                })
             
             messagebox.showinfo("Success", 
                               f"Emergency patient registered!\n"
@@ -4563,6 +4806,9 @@ def main():
     # Create login window
     root = tk.Tk()
     LoginWindow(root, data_manager)
+    
+    # Parse the collections in the background while the login window is up
+    data_manager.warm_up()
     root.mainloop()
 
 if __name__ == "__main__":
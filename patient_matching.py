@@ -0,0 +1,348 @@
+"""Find and merge duplicate patient records.
+
+Emergency registrations are created in a hurry (address 'Emergency',
+blood group 'Unknown') and often duplicate a patient already on file.
+find_duplicates() groups patients by cheap blocking keys and only
+compares records that share a block, so a run costs about N times the
+block size instead of N^2:
+
+- phonetic name code: Soundex of the first name and the surname
+- age together with the first name's Soundex code, and with the
+  surname's (so a typo that changes one code still meets a block)
+- the last seven digits of the contact number
+
+Pairs within a block are scored on name (Jaro-Winkler), contact, age,
+gender and blood group; placeholder values count as unknown. Blocks
+larger than max_block (a shared placeholder phone number, say) are
+skipped and reported rather than compared pairwise.
+
+merge_patients() keeps one record, fills its missing fields from the
+duplicate, re-points appointments, bills and lab reports to it and
+deletes the duplicate, all in one transaction.
+
+    python patient_matching.py                     # list merge candidates
+    python patient_matching.py --merge P001 P042   # merge P042 into P001
+"""
+import argparse
+import functools
+import re
+import sys
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# Values the emergency form fills in when the real one is unknown
+PLACEHOLDERS = {'address': {'emergency'}, 'blood_group': {'unknown'}}
+
+# Collections pointing at a patient through patient_id (each has that index)
+PATIENT_REFERENCES = ('appointments', 'billing', 'lab_reports')
+
+# Weight of each field in the match score
+WEIGHTS = {'name': 0.5, 'contact': 0.25, 'age': 0.1, 'gender': 0.1, 'blood_group': 0.05}
+
+_SOUNDEX_CODES = {c: str(d) for d, letters in enumerate(
+    ['aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r']) for c in letters}
+
+
+def soundex(word: str) -> str:
+    """American Soundex code ('Robert' -> 'R163'); '' for a word without letters"""
+    letters = re.sub(r'[^a-z]', '', word.lower())
+    if not letters:
+        return ''
+    code, previous = letters[0].upper(), _SOUNDEX_CODES[letters[0]]
+    for c in letters[1:]:
+        digit = _SOUNDEX_CODES[c]
+        if digit != '0' and digit != previous:
+            code += digit
+        if c not in 'hw':  # h and w do not separate equal codes
+            previous = digit
+    return (code + '000')[:4]
+
+
+def jaro_winkler(a: str, b: str) -> float:
+    """Similarity of two strings in [0, 1], favouring a shared prefix"""
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    window = max(max(len(a), len(b)) // 2 - 1, 0)
+    unmatched_b = list(b)  # matched characters are blanked out with None
+    matches_a = []
+    positions_b = []
+    for i, c in enumerate(a):
+        try:
+            j = unmatched_b.index(c, max(0, i - window), i + window + 1)
+        except ValueError:
+            continue
+        unmatched_b[j] = None
+        matches_a.append(c)
+        positions_b.append(j)
+    if not matches_a:
+        return 0.0
+    matches_b = [b[j] for j in sorted(positions_b)]
+    m = len(matches_a)
+    transpositions = sum(x != y for x, y in zip(matches_a, matches_b)) / 2
+    jaro = (m / len(a) + m / len(b) + (m - transpositions) / m) / 3
+    prefix = 0
+    for x, y in zip(a[:4], b[:4]):
+        if x != y:
+            break
+        prefix += 1
+    return jaro + prefix * 0.1 * (1 - jaro)
+
+
+def _known(record: Dict[str, Any], field: str) -> Optional[str]:
+    value = record.get(field)
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value or value.lower() in PLACEHOLDERS.get(field, ()):
+        return None
+    return value
+
+
+def _name_words(record: Dict[str, Any]) -> List[str]:
+    name = re.sub(r'[^a-z ]', ' ', str(record.get('name') or '').lower())
+    return [w for w in name.split() if w not in ('dr', 'mr', 'mrs', 'ms', 'miss')]
+
+
+def _digits(record: Dict[str, Any]) -> Optional[str]:
+    digits = re.sub(r'\D', '', str(record.get('contact') or ''))
+    return digits[-7:] if len(digits) >= 7 else None
+
+
+def _age(record: Dict[str, Any]) -> Optional[int]:
+    try:
+        return int(record.get('age'))
+    except (TypeError, ValueError):
+        return None
+
+
+def blocking_keys(record: Dict[str, Any]) -> List[Tuple[str, Any]]:
+    """Blocks a patient falls into; only patients sharing one are compared"""
+    keys: List[Tuple[str, Any]] = []
+    words = _name_words(record)
+    if words:
+        first, last = soundex(words[0]), soundex(words[-1])
+        keys.append(('name', first, last))
+        age = _age(record)
+        if age is not None:
+            keys.append(('age', age, first))
+            keys.append(('age', age, last))
+    digits = _digits(record)
+    if digits:
+        keys.append(('contact', digits))
+    return keys
+
+
+class _Features(NamedTuple):
+    """The parts of a patient record that matching compares, normalised once"""
+    name: Tuple[str, ...]  # first name and surname (or the only word)
+    contact: Optional[str]
+    age: Optional[int]
+    gender: Optional[str]
+    blood_group: Optional[str]
+
+
+def _features(record: Dict[str, Any]) -> _Features:
+    words = _name_words(record)
+    gender, blood_group = _known(record, 'gender'), _known(record, 'blood_group')
+    return _Features(tuple(words[:1] + words[1:][-1:]), _digits(record), _age(record),
+                     gender.lower() if gender else None, blood_group.lower() if blood_group else None)
+
+
+@functools.lru_cache(maxsize=1 << 18)
+def _word_similarity(a: str, b: str) -> float:
+    return jaro_winkler(a, b)
+
+
+def _name_similarity(a: Tuple[str, ...], b: Tuple[str, ...]) -> float:
+    """Mean similarity of first names and of surnames, in either word order.
+
+    Names repeat across patients far more than whole names do, so the
+    per-word scores are cached."""
+    if len(a) == 1 or len(b) == 1:
+        return max(_word_similarity(x, y) for x in a for y in b) * (0.9 if len(a) != len(b) else 1.0)
+    (first_a, last_a), (first_b, last_b) = a, b
+    return max(_word_similarity(first_a, first_b) + _word_similarity(last_a, last_b),
+               _word_similarity(first_a, last_b) + _word_similarity(last_a, first_b)) / 2
+
+
+def _compare(a: _Features, b: _Features, name: Optional[float] = None) -> Dict[str, float]:
+    scores: Dict[str, float] = {}
+    if a.name and b.name:
+        scores['name'] = _name_similarity(a.name, b.name) if name is None else name
+    if a.contact and b.contact:
+        scores['contact'] = float(a.contact == b.contact)
+    if a.age is not None and b.age is not None:
+        gap = abs(a.age - b.age)
+        scores['age'] = 1.0 if gap <= 1 else 0.5 if gap <= 3 else 0.0
+    if a.gender and b.gender:
+        scores['gender'] = float(a.gender == b.gender)
+    if a.blood_group and b.blood_group:
+        scores['blood_group'] = float(a.blood_group == b.blood_group)
+    return scores
+
+
+def field_scores(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, float]:
+    """Similarity in [0, 1] of each field both records know"""
+    return _compare(_features(a), _features(b))
+
+
+def weighted_score(scores: Dict[str, float]) -> float:
+    """Match score in [0, 1]: the WEIGHTS average over the known fields"""
+    total = sum(WEIGHTS[f] for f in scores)
+    return sum(WEIGHTS[f] * s for f, s in scores.items()) / total if total else 0.0
+
+
+def reasons(scores: Dict[str, float]) -> List[str]:
+    return [f"name {scores['name']:.2f}" if f == 'name' else
+            f"{'same' if s == 1 else 'different' if s == 0 else 'close'} {f.replace('_', ' ')}"
+            for f, s in scores.items()]
+
+
+def _completeness(record: Dict[str, Any]) -> int:
+    return sum(1 for field in record if _known(record, field) is not None)
+
+
+def choose_survivor(a: Dict[str, Any], b: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """(record to keep, duplicate): the non-emergency, more complete, older record survives"""
+    def rank(record):
+        return (_known(record, 'address') is None, -_completeness(record),
+                str(record.get('admit_date') or '9999'), str(record.get('id')))
+    return (a, b) if rank(a) <= rank(b) else (b, a)
+
+
+class MergeCandidate(NamedTuple):
+    keep_id: Any
+    duplicate_id: Any
+    score: float
+    reasons: List[str]
+
+
+class DuplicateReport:
+    """Merge candidates of one run and what it took to find them"""
+
+    def __init__(self):
+        self.patients = 0
+        self.blocks = 0
+        self.comparisons = 0
+        self.skipped_blocks: List[Tuple[Tuple[str, Any], int]] = []  # (key, size)
+        self.candidates: List[MergeCandidate] = []
+
+    def __repr__(self) -> str:
+        return (f"DuplicateReport(patients={self.patients}, comparisons={self.comparisons}, "
+                f"candidates={len(self.candidates)}, skipped_blocks={len(self.skipped_blocks)})")
+
+
+def find_duplicates(patients: Iterable[Dict[str, Any]], threshold: float = 0.85,
+                    max_block: int = 200, min_name: float = 0.8) -> DuplicateReport:
+    """Likely duplicate pairs, best first.
+
+    A pair is a candidate when its score reaches threshold and the names
+    alone are at least min_name similar (relatives share contact numbers).
+    """
+    report = DuplicateReport()
+    records: List[Dict[str, Any]] = []
+    features: List[_Features] = []
+    blocks: Dict[Tuple[str, Any], List[int]] = defaultdict(list)
+    for record in patients:
+        for key in blocking_keys(record):
+            blocks[key].append(len(records))
+        records.append(record)
+        features.append(_features(record))
+    report.patients = len(records)
+    report.blocks = len(blocks)
+
+    seen = set()
+    for key, members in blocks.items():
+        if len(members) > max_block:
+            report.skipped_blocks.append((key, len(members)))
+            continue
+        for n, i in enumerate(members):
+            for j in members[n + 1:]:
+                if (i, j) in seen:
+                    continue
+                seen.add((i, j))
+                report.comparisons += 1
+                a, b = features[i], features[j]
+                if not (a.name and b.name):
+                    continue
+                name = _name_similarity(a.name, b.name)
+                if name < min_name:
+                    continue
+                scores = _compare(a, b, name)
+                score = weighted_score(scores)
+                if score >= threshold:
+                    keep, duplicate = choose_survivor(records[i], records[j])
+                    report.candidates.append(MergeCandidate(keep.get('id'), duplicate.get('id'),
+                                                            round(score, 3), reasons(scores)))
+    report.candidates.sort(key=lambda c: -c.score)
+    return report
+
+
+def merge_patients(backend: Any, keep_id: Any, duplicate_id: Any,
+                   references: Iterable[str] = PATIENT_REFERENCES) -> Dict[str, int]:
+    """Fold duplicate_id into keep_id; returns how many records were re-pointed per collection"""
+    if keep_id == duplicate_id:
+        raise ValueError("Cannot merge a patient into itself")
+    moved = {}
+    with backend.transaction():
+        keep = backend.get('patients', keep_id)
+        duplicate = backend.get('patients', duplicate_id)
+        if keep is None or duplicate is None:
+            raise ValueError(f"No patient {keep_id if keep is None else duplicate_id}")
+
+        # The survivor keeps its own values; only unknown ones are filled in
+        changes = {field: value for field, value in duplicate.items()
+                   if field not in ('id', 'version', 'merged_ids')
+                   and _known(keep, field) is None and _known(duplicate, field) is not None}
+        changes['merged_ids'] = (list(keep.get('merged_ids', [])) + [duplicate_id]
+                                 + list(duplicate.get('merged_ids', [])))
+        backend.update('patients', keep_id, changes)
+
+        name = changes.get('name', keep.get('name'))
+        for collection in references:
+            key_field = backend.collections[collection]['key']
+            records = backend.find(collection, patient_id=duplicate_id)
+            for record in records:
+                change = {'patient_id': keep_id}
+                if 'patient_name' in record:
+                    change['patient_name'] = name
+                backend.update(collection, record[key_field], change)
+            moved[collection] = len(records)
+        backend.delete('patients', duplicate_id)
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find (and merge) duplicate patient records")
+    parser.add_argument('--threshold', type=float, default=0.85, help="Minimum match score (0-1)")
+    parser.add_argument('--max-block', type=int, default=200, help="Largest block compared pairwise")
+    parser.add_argument('--merge', nargs=2, metavar=('KEEP_ID', 'DUPLICATE_ID'),
+                        help="Merge one duplicate into the record to keep")
+    parser.add_argument('--storage', choices=['json', 'journal', 'sqlite'], default='json',
+                        help="Storage backend of the data directory")
+    args = parser.parse_args()
+
+    from main import DataManager
+    data_manager = DataManager(storage=args.storage)
+
+    if args.merge:
+        moved = data_manager.merge_patients(*args.merge)
+        print(f"Merged {args.merge[1]} into {args.merge[0]}: "
+              + ', '.join(f"{count} {collection}" for collection, count in moved.items()))
+        return 0
+
+    report = data_manager.find_duplicate_patients(args.threshold, args.max_block)
+    for candidate in report.candidates:
+        print(f"{candidate.score:.3f}  keep {candidate.keep_id}  merge {candidate.duplicate_id}  "
+              f"({', '.join(candidate.reasons)})")
+    for key, size in report.skipped_blocks:
+        print(f"skipped block {key} with {size} patients", file=sys.stderr)
+    print(f"{len(report.candidates)} candidates from {report.comparisons} comparisons "
+          f"over {report.patients} patients")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
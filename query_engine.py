@@ -0,0 +1,396 @@
+"""Queries over a storage backend, planned against the collection's indexes.
+
+A query is a dict of field -> condition, all of which must hold. A plain
+value means equality; a dict of operators applies each of them:
+
+    {'doctor_id': 'D001',
+     'date': {'$gte': '2025-01-01', '$lt': '2025-02-01'},
+     'status': {'$in': ['Scheduled', 'Confirmed']},
+     'patient_name': {'$contains': 'smi'}}
+
+Operators are $eq, $gt, $gte, $lt, $lte, $in, $prefix and $contains
+(case-insensitive substring, or membership for list fields). '$and' and
+'$or' take a list of queries and nest freely.
+
+The planner picks one access path before reading anything: a primary-key
+lookup, an equality lookup on a declared index (exact values or $in), a
+range over a single-field index ($gt/$lt/$prefix; date ranges also prune
+monthly partitions), a union of index paths for an $or, or else a scan
+that streams the collection. Whatever the path does not guarantee is
+checked record by record. explain() shows the chosen plan:
+
+    print(explain(backend, 'appointments', query, order_by='-date', limit=20))
+"""
+import itertools
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+RANGE_OPERATORS = {'$gt', '$gte', '$lt', '$lte'}
+OPERATORS = RANGE_OPERATORS | {'$eq', '$in', '$prefix', '$contains'}
+
+# Upper bound for a prefix range: sorts after every string starting with the prefix
+_MAX_CHAR = chr(0x10FFFF)
+
+# Access paths in order of preference
+PRIMARY_KEY, INDEX_LOOKUP, INDEX_UNION, INDEX_RANGE, INDEX_PREFIX, SCAN = range(6)
+
+
+class Eq:
+    def __init__(self, field: str, value: Any):
+        self.field = field
+        self.value = value
+
+    def matches(self, record: Dict[str, Any]) -> bool:
+        return self.field in record and record[self.field] == self.value
+
+    def __str__(self) -> str:
+        return f"{self.field} = {self.value!r}"
+
+
+class In:
+    def __init__(self, field: str, values: Iterable[Any]):
+        self.field = field
+        self.values = list(values)
+
+    def matches(self, record: Dict[str, Any]) -> bool:
+        return self.field in record and record[self.field] in self.values
+
+    def __str__(self) -> str:
+        return f"{self.field} IN ({', '.join(repr(v) for v in self.values)})"
+
+
+class Range:
+    """low <(=) field <(=) high; None leaves a side open, missing values never match"""
+
+    def __init__(self, field: str, low: Any = None, high: Any = None,
+                 include_low: bool = True, include_high: bool = True):
+        self.field = field
+        self.low, self.high = low, high
+        self.include_low, self.include_high = include_low, include_high
+
+    @property
+    def inclusive(self) -> bool:
+        return ((self.low is None or self.include_low) and
+                (self.high is None or self.include_high))
+
+    def matches(self, record: Dict[str, Any]) -> bool:
+        value = record.get(self.field)
+        if value is None:
+            return False
+        try:
+            if self.low is not None and (value < self.low if self.include_low else value <= self.low):
+                return False
+            if self.high is not None and (value > self.high if self.include_high else value >= self.high):
+                return False
+        except TypeError:
+            return False
+        return True
+
+    def __str__(self) -> str:
+        text = self.field
+        if self.low is not None:
+            text = f"{self.low!r} {'<=' if self.include_low else '<'} {text}"
+        if self.high is not None:
+            text = f"{text} {'<=' if self.include_high else '<'} {self.high!r}"
+        return text
+
+
+class Prefix:
+    def __init__(self, field: str, prefix: str):
+        self.field = field
+        self.prefix = prefix
+
+    def matches(self, record: Dict[str, Any]) -> bool:
+        value = record.get(self.field)
+        return isinstance(value, str) and value.startswith(self.prefix)
+
+    def __str__(self) -> str:
+        return f"{self.field} STARTS WITH {self.prefix!r}"
+
+
+class Contains:
+    """Case-insensitive substring of a string field, or membership in a list field"""
+
+    def __init__(self, field: str, value: Any):
+        self.field = field
+        self.value = value
+        self._needle = value.lower() if isinstance(value, str) else value
+
+    def matches(self, record: Dict[str, Any]) -> bool:
+        value = record.get(self.field)
+        if isinstance(value, str):
+            return isinstance(self._needle, str) and self._needle in value.lower()
+        if isinstance(value, (list, tuple)):
+            return self.value in value
+        return False
+
+    def __str__(self) -> str:
+        return f"{self.field} CONTAINS {self.value!r}"
+
+
+class And:
+    def __init__(self, conditions: Sequence[Any]):
+        self.conditions = list(conditions)
+
+    def matches(self, record: Dict[str, Any]) -> bool:
+        return all(c.matches(record) for c in self.conditions)
+
+    def __str__(self) -> str:
+        return ' AND '.join(_grouped(c) for c in self.conditions) or 'TRUE'
+
+
+class Or:
+    def __init__(self, conditions: Sequence[Any]):
+        self.conditions = list(conditions)
+
+    def matches(self, record: Dict[str, Any]) -> bool:
+        return any(c.matches(record) for c in self.conditions)
+
+    def __str__(self) -> str:
+        return ' OR '.join(_grouped(c) for c in self.conditions) or 'FALSE'
+
+
+def _grouped(condition: Any) -> str:
+    return f"({condition})" if isinstance(condition, (And, Or)) and len(condition.conditions) > 1 else str(condition)
+
+
+def _field_conditions(field: str, spec: Any) -> List[Any]:
+    if not (isinstance(spec, dict) and spec and all(str(k).startswith('$') for k in spec)):
+        return [Eq(field, spec)]
+    unknown = set(spec) - OPERATORS
+    if unknown:
+        raise ValueError(f"Unknown query operator: {', '.join(sorted(unknown))}")
+    conditions = []
+    if '$eq' in spec:
+        conditions.append(Eq(field, spec['$eq']))
+    if '$in' in spec:
+        if isinstance(spec['$in'], (str, bytes)) or not isinstance(spec['$in'], Iterable):
+            raise ValueError(f"$in on {field} needs a list of values")
+        conditions.append(In(field, spec['$in']))
+    if RANGE_OPERATORS & set(spec):
+        if '$gt' in spec and '$gte' in spec or '$lt' in spec and '$lte' in spec:
+            raise ValueError(f"Give {field} one lower and one upper bound")
+        conditions.append(Range(field, spec.get('$gte', spec.get('$gt')), spec.get('$lte', spec.get('$lt')),
+                                include_low='$gt' not in spec, include_high='$lt' not in spec))
+    if '$prefix' in spec:
+        if not isinstance(spec['$prefix'], str):
+            raise ValueError(f"$prefix on {field} needs a string")
+        conditions.append(Prefix(field, spec['$prefix']))
+    if '$contains' in spec:
+        conditions.append(Contains(field, spec['$contains']))
+    return conditions
+
+
+def parse(query: Optional[Dict[str, Any]]) -> And:
+    """Turn a query dict into a condition tree (an And of its terms)"""
+    conditions: List[Any] = []
+    for field, spec in (query or {}).items():
+        if field in ('$and', '$or'):
+            if not isinstance(spec, (list, tuple)):
+                raise ValueError(f"{field} needs a list of queries")
+            branches = [parse(q) for q in spec]
+            if field == '$and':
+                for branch in branches:
+                    conditions.extend(branch.conditions)
+            else:
+                conditions.append(Or(branches))
+        elif str(field).startswith('$'):
+            raise ValueError(f"Unknown query operator: {field}")
+        else:
+            conditions.extend(_field_conditions(field, spec))
+    return And(conditions)
+
+
+def matches(query: Optional[Dict[str, Any]], record: Dict[str, Any]) -> bool:
+    """Whether one record satisfies a query (e.g. to test a changed record)"""
+    return parse(query).matches(record)
+
+
+def _distinct(values: Iterable[Any]) -> Optional[List[Any]]:
+    try:
+        return list(dict.fromkeys(values))
+    except TypeError:  # unhashable values cannot be looked up in an index
+        return None
+
+
+class _Access:
+    """One way of producing candidate records"""
+
+    def __init__(self, kind: int, description: str, fetch: Callable[[], Iterable[Dict[str, Any]]],
+                 covered: Sequence[Any] = (), ordered_by: Optional[str] = None):
+        self.kind = kind
+        self.description = description
+        self.fetch = fetch
+        self.covered = list(covered)
+        self.ordered_by = ordered_by
+
+
+def _paths(backend: Any, collection: str, conjunction: And) -> List[_Access]:
+    """Every index-backed access path that can answer the conjunction"""
+    spec = backend.collections[collection]
+    key_field = spec.get('key')
+    lookups: Dict[str, Tuple[Any, List[Any]]] = {}
+    for condition in conjunction.conditions:
+        if isinstance(condition, Eq) and condition.value is not None:
+            lookups.setdefault(condition.field, (condition, [condition.value]))
+        elif isinstance(condition, In) and condition.field not in lookups:
+            values = _distinct(v for v in condition.values if v is not None)
+            if values is not None:
+                lookups[condition.field] = (condition, values)
+    paths = []
+
+    if key_field in lookups:
+        condition, keys = lookups[key_field]
+        paths.append(_Access(
+            PRIMARY_KEY, f"primary key {condition}",
+            lambda: [r for r in (backend.get(collection, k) for k in keys) if r is not None],
+            [condition]))
+
+    for group in spec.get('indexes', []):
+        if not all(f in lookups for f in group):
+            continue
+        combos = list(itertools.product(*(lookups[f][1] for f in group)))
+        conditions = [lookups[f][0] for f in group]
+
+        def fetch(group=group, combos=combos):
+            for combo in combos:
+                yield from backend.find(collection, **dict(zip(group, combo)))
+        lookup = ' AND '.join(str(c) for c in conditions)
+        paths.append(_Access(INDEX_LOOKUP, f"index ({', '.join(group)}) {lookup}"
+                             f"{f' [{len(combos)} lookups]' if len(combos) > 1 else ''}",
+                             fetch, conditions))
+
+    single = {group[0] for group in spec.get('indexes', []) if len(group) == 1}
+    for condition in conjunction.conditions:
+        if not isinstance(condition, (Range, Prefix)) or condition.field not in single:
+            continue
+        if isinstance(condition, Range):
+            low, high, covered = condition.low, condition.high, condition.inclusive
+            kind = INDEX_RANGE
+        else:
+            if not condition.prefix:
+                continue
+            low, high, covered = condition.prefix, condition.prefix + _MAX_CHAR, False
+            kind = INDEX_PREFIX
+        paths.append(_Access(
+            kind, f"index range ({condition.field}) {condition}",
+            lambda field=condition.field, low=low, high=high: backend.find_range(collection, field, low, high),
+            [condition] if covered else [], ordered_by=condition.field))
+
+    key = key_field or None
+    for condition in conjunction.conditions:
+        if not isinstance(condition, Or) or not condition.conditions:
+            continue
+        branches = []
+        for branch in condition.conditions:
+            options = _paths(backend, collection, branch)
+            if not options:
+                break
+            branches.append(min(options, key=_rank))
+        else:
+            def union(branches=branches):
+                seen = set()
+                for access in branches:
+                    for record in access.fetch():
+                        ident = record.get(key) if key else id(record)
+                        if ident not in seen:
+                            seen.add(ident)
+                            yield record
+            paths.append(_Access(INDEX_UNION, 'union of ' + '; '.join(a.description for a in branches),
+                                 union))
+    return paths
+
+
+def _rank(access: _Access) -> tuple:
+    # Longer equality indexes select fewer records
+    return (access.kind, -len(access.covered))
+
+
+def _sort_keys(order_by: Union[None, str, Sequence[str]]) -> List[Tuple[str, bool]]:
+    if not order_by:
+        return []
+    if isinstance(order_by, str):
+        order_by = [order_by]
+    return [(f[1:], True) if f.startswith('-') else (f, False) for f in order_by]
+
+
+class Plan:
+    """The access path and the remaining steps chosen for one query"""
+
+    def __init__(self, backend: Any, collection: str, condition: And, access: _Access,
+                 order_by: Union[None, str, Sequence[str]] = None,
+                 limit: Optional[int] = None, offset: int = 0):
+        self.backend = backend
+        self.collection = collection
+        self.access = access
+        self.filter = And([c for c in condition.conditions if not any(c is d for d in access.covered)])
+        self.sort = _sort_keys(order_by)
+        if self.sort == [(access.ordered_by, False)]:
+            self.sort = []  # the index range already returns this order
+        self.limit = limit
+        self.offset = offset
+
+    def explain(self) -> str:
+        lines = [f"{self.collection}: {self.access.description}"]
+        if self.filter.conditions:
+            lines.append(f"  filter: {self.filter}")
+        if self.sort:
+            lines.append('  sort: ' + ', '.join(f"{f} {'DESC' if desc else 'ASC'}" for f, desc in self.sort))
+        if self.offset:
+            lines.append(f"  offset: {self.offset}")
+        if self.limit is not None:
+            lines.append(f"  limit: {self.limit}" + ('' if self.sort else ' (stops reading early)'))
+        return '\n'.join(lines)
+
+    def __str__(self) -> str:
+        return self.explain()
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        records: Iterable[Dict[str, Any]] = self.access.fetch()
+        if self.filter.conditions:
+            records = filter(self.filter.matches, records)
+        if self.sort:
+            records = list(records)
+            for field, descending in reversed(self.sort):
+                # Stable sorts, last key first; missing values go last either way
+                present = [r for r in records if r.get(field) is not None]
+                present.sort(key=lambda r: r[field], reverse=descending)
+                records = present + [r for r in records if r.get(field) is None]
+        stop = None if self.limit is None else self.offset + self.limit
+        return itertools.islice(records, self.offset, stop)
+
+    def execute(self) -> List[Dict[str, Any]]:
+        return list(self)
+
+
+def plan(backend: Any, collection: str, query: Optional[Dict[str, Any]] = None,
+         order_by: Union[None, str, Sequence[str]] = None,
+         limit: Optional[int] = None, offset: int = 0) -> Plan:
+    """Choose how to answer a query; nothing is read until the plan runs.
+
+    order_by is a field or list of fields, '-field' for descending; records
+    missing a sort field come last. Without order_by, records come in the
+    order the chosen path reads them.
+    """
+    if collection not in backend.collections:
+        raise ValueError(f"Unknown collection: {collection}")
+    if limit is not None and limit < 0 or offset < 0:
+        raise ValueError("limit and offset cannot be negative")
+    condition = parse(query)
+    paths = _paths(backend, collection, condition)
+    access = min(paths, key=_rank) if paths else _Access(
+        SCAN, 'full scan', lambda: backend.iter_records(collection))
+    return Plan(backend, collection, condition, access, order_by, limit, offset)
+
+
+def search(backend: Any, collection: str, query: Optional[Dict[str, Any]] = None,
+           order_by: Union[None, str, Sequence[str]] = None,
+           limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+    """Records of collection matching query (see the module docstring)"""
+    return plan(backend, collection, query, order_by, limit, offset).execute()
+
+
+def explain(backend: Any, collection: str, query: Optional[Dict[str, Any]] = None,
+            order_by: Union[None, str, Sequence[str]] = None,
+            limit: Optional[int] = None, offset: int = 0) -> str:
+    """Describe how search() would answer the query, without running it"""
+    return plan(backend, collection, query, order_by, limit, offset).explain()
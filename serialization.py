@@ -0,0 +1,87 @@
+"""Codecs used to write collection snapshots to disk.
+
+'json' is the original indented format, 'compact' is the same JSON without
+whitespace, and 'binary' is a pickle (protocol 5) snapshot behind a magic
+header and format version. Reading never needs to know which codec wrote a
+file: decode() recognises the binary header and treats anything else as
+JSON, so existing indented files keep loading after switching codecs.
+"""
+import io
+import json
+import pickle
+from typing import Any, Dict
+
+MAGIC = b'HMSDATA'
+FORMAT_VERSION = 1
+
+
+class JsonCodec:
+    """Human-readable JSON (the original on-disk format)"""
+
+    name = 'json'
+
+    def __init__(self, indent: int = 4):
+        self.indent = indent
+
+    def dumps(self, data: Any) -> bytes:
+        return json.dumps(data, indent=self.indent).encode('utf-8')
+
+    def loads(self, payload: bytes) -> Any:
+        return json.loads(payload)
+
+
+class CompactJsonCodec(JsonCodec):
+    """JSON without indentation or spaces: about half the size, faster to parse"""
+
+    name = 'compact'
+
+    def __init__(self):
+        super().__init__(indent=None)
+
+    def dumps(self, data: Any) -> bytes:
+        return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+class _DataUnpickler(pickle.Unpickler):
+    """Only plain containers and scalars are ever stored, so refuse to
+    import anything; a tampered file cannot run code on load."""
+
+    def find_class(self, module: str, name: str) -> Any:
+        raise pickle.UnpicklingError(f"Refusing to load {module}.{name} from a data file")
+
+
+class BinaryCodec:
+    """Pickle protocol 5 snapshot: MAGIC, one format-version byte, payload"""
+
+    name = 'binary'
+
+    def dumps(self, data: Any) -> bytes:
+        return MAGIC + bytes([FORMAT_VERSION]) + pickle.dumps(data, protocol=5)
+
+    def loads(self, payload: bytes) -> Any:
+        if not payload.startswith(MAGIC):
+            raise ValueError("Not a binary data file")
+        version = payload[len(MAGIC)]
+        if version > FORMAT_VERSION:
+            raise ValueError(f"Data file format {version} is newer than supported ({FORMAT_VERSION})")
+        return _DataUnpickler(io.BytesIO(payload[len(MAGIC) + 1:])).load()
+
+
+CODECS: Dict[str, Any] = {
+    'json': JsonCodec(),
+    'compact': CompactJsonCodec(),
+    'binary': BinaryCodec(),
+}
+
+
+def get_codec(name: str) -> Any:
+    if name not in CODECS:
+        raise ValueError(f"Unknown codec: {name}; choose from {', '.join(CODECS)}")
+    return CODECS[name]
+
+
+def decode(payload: bytes) -> Any:
+    """Load a snapshot written by any codec"""
+    if payload.startswith(MAGIC):
+        return CODECS['binary'].loads(payload)
+    return json.loads(payload)
@@ -0,0 +1,305 @@
+"""Next free appointment slots for a doctor, a specialization or a department.
+
+A doctor's working hours on a day come from DoctorAvailability (the
+schedule rule or dated schedule in force, else their weekly
+availability; all day when nothing says, since such a doctor may be booked
+at any time by hand). Each day becomes a bitmap of UNIT-minute cells (an int,
+bit i = the cell starting i * UNIT minutes after midnight): working
+cells minus breaks minus the cells booked in the doctor's appointment
+interval index. A slot of n cells may start where n
+consecutive bits are set, which is n - 1 shifts and ANDs on the bitmap.
+
+Day bitmaps are cached per doctor along with a bitmap of the days that
+have any free cell, so a search skips fully booked days without looking
+at them, and a doctor's next free day is one bit operation. Change
+events on appointments, schedules and doctors drop only the cached days
+they touch. Another process's writes raise no events; when the backend's
+external_version() of one of those collections moves, every bitmap is
+dropped.
+"""
+import heapq
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from appointment_intervals import AppointmentIntervals, epoch_minutes
+from availability import ALL_DAY, DoctorAvailability
+
+UNIT = 5  # minutes per bitmap cell
+HORIZON_DAYS = 90  # how far ahead searches look by default
+CELLS = 24 * 60 // UNIT
+
+
+def _cells(start: int, end: int) -> int:
+    """Bitmap of the cells touching [start, end) minutes of a day"""
+    first, last = max(start // UNIT, 0), min(-(-end // UNIT), CELLS)
+    return ((1 << (last - first)) - 1) << first if last > first else 0
+
+
+def _inner_cells(start: int, end: int) -> int:
+    """Bitmap of the cells lying wholly inside [start, end) minutes of a day"""
+    first, last = max(-(-start // UNIT), 0), min(end // UNIT, CELLS)
+    return ((1 << (last - first)) - 1) << first if last > first else 0
+
+
+def slot_cells(start: datetime, duration: int) -> Tuple[int, int]:
+    """(day ordinal, cell bitmap) a slot of duration minutes from start occupies"""
+    minute = start.hour * 60 + start.minute
+    return start.toordinal(), _cells(minute, minute + duration)
+
+
+class Slot(NamedTuple):
+    start: datetime
+    doctor_id: Any
+    doctor_name: str
+
+    def __str__(self) -> str:
+        return f"{self.start:%Y-%m-%d %H:%M} - {self.doctor_name} ({self.doctor_id})"
+
+
+class _DoctorDays:
+    """Cached day bitmaps of one doctor"""
+
+    def __init__(self):
+        self.free: Dict[int, Tuple[int, int]] = {}  # day ordinal -> (free cells, slot start grid)
+        self.computed = 0  # bitmap over day ordinals - base
+        self.open_days = 0  # days with at least one free cell
+        self.base: Optional[int] = None
+
+    def drop(self, day: int) -> None:
+        self.free.pop(day, None)
+        if self.base is not None and day >= self.base:
+            bit = 1 << (day - self.base)
+            self.computed &= ~bit
+            self.open_days &= ~bit
+
+
+class SlotFinder:
+    """Free-slot search over the doctors collection, kept current from an EventBus"""
+
+    def __init__(self, backend: Any, bus: Any, intervals: AppointmentIntervals,
+                 availability: DoctorAvailability):
+        self.backend = backend
+        self.intervals = intervals
+        self.availability = availability
+        self._doctors: Optional[Dict[Any, Dict[str, Any]]] = None
+        self._groups: Dict[Tuple[str, str], List[Any]] = {}  # (specialization, department) -> doctor IDs
+        self._days: Dict[Any, _DoctorDays] = {}
+        self._generation: Any = None  # see _check_generation
+        self._lock = threading.RLock()
+        bus.subscribe(self._on_change, 'doctors', 'schedules', intervals.collection)
+
+    # Inputs -----------------------------------------------------------------
+
+    def doctors(self) -> Dict[Any, Dict[str, Any]]:
+        with self._lock:
+            self._check_generation()
+            if self._doctors is None:
+                key_field = self.backend.collections['doctors']['key']
+                self._doctors = {d.get(key_field): d for d in self.backend.iter_records('doctors')}
+                self._groups.clear()
+            return self._doctors
+
+    def _working(self, doctor_id: Any, day: date) -> Tuple[int, int]:
+        """(working cells, slot start grid) of a doctor on a day, before bookings.
+        Unknown hours count as available, as in DoctorAvailability.is_available.
+        Starts off the cell grid (a 9:02 start, a 7-minute step) are rounded up to it."""
+        workday = self.availability.workday(doctor_id, day) or ALL_DAY
+        if not workday.windows:
+            return 0, 0
+        working = grid = 0
+        for start, end in workday.windows:
+            working |= _inner_cells(start, end)
+        first, last = workday.windows[0][0], workday.windows[-1][1]
+        for minute in range(first, last, workday.step):
+            cell = -(-minute // UNIT)
+            if cell < CELLS:
+                grid |= 1 << cell
+        return working, grid
+
+    def _doctor_days(self, doctor_id: Any) -> _DoctorDays:
+        days = self._days.get(doctor_id)
+        if days is None:
+            days = self._days[doctor_id] = _DoctorDays()
+        return days
+
+    def _free(self, doctor_id: Any, ordinal: int) -> Tuple[int, int]:
+        days = self._doctor_days(doctor_id)
+        cached = days.free.get(ordinal)
+        if cached is None:
+            day = date.fromordinal(ordinal)
+            working, grid = self._working(doctor_id, day)
+            if working:
+                midnight = epoch_minutes(datetime(day.year, day.month, day.day))
+                for start, end, _ in self.intervals.index(doctor_id).overlapping(midnight, midnight + 24 * 60):
+                    working &= ~_cells(start - midnight, end - midnight)
+            cached = days.free[ordinal] = (working, grid)
+        return cached
+
+    def _open_days(self, doctor_id: Any, first: int, last: int) -> int:
+        """Bitmap (bit 0 = first) of the days in [first, last) with a free cell"""
+        days = self._doctor_days(doctor_id)
+        if days.base is None or first < days.base:
+            shift = 0 if days.base is None else days.base - first
+            days.computed <<= shift
+            days.open_days <<= shift
+            days.base = first
+        span = ((1 << (last - first)) - 1) << (first - days.base)
+        missing = span & ~days.computed
+        while missing:
+            bit = missing & -missing
+            ordinal = days.base + bit.bit_length() - 1
+            if self._free(doctor_id, ordinal)[0]:
+                days.open_days |= bit
+            days.computed |= bit
+            missing ^= bit
+        return (days.open_days & span) >> (first - days.base)
+
+    # Search -----------------------------------------------------------------
+
+    def _ranked(self, doctor_id: Any, specialization: Optional[str], department: Optional[str]) -> List[Any]:
+        """IDs of the doctors a search covers, ordered by ID (shared, do not modify)"""
+        if doctor_id is not None:
+            return [doctor_id]
+        wanted = ((specialization or '').strip().lower(), (department or '').strip().lower())
+        with self._lock:
+            doctors = self.doctors()
+            group = self._groups.get(wanted)
+            if group is None:
+                wanted_specialization, wanted_department = wanted
+                group = self._groups[wanted] = sorted(
+                    (key for key, doctor in doctors.items()
+                     if (not wanted_specialization
+                         or str(doctor.get('specialization', '')).lower() == wanted_specialization)
+                     and (not wanted_department
+                          or str(doctor.get('department') or doctor.get('specialization', '')).lower()
+                          == wanted_department)), key=str)
+            return group
+
+    def candidates(self, doctor_id: Any = None, specialization: Optional[str] = None,
+                   department: Optional[str] = None) -> List[Any]:
+        """IDs of the doctors a search covers (all when no filter is given), by ID"""
+        return list(self._ranked(doctor_id, specialization, department))
+
+    def next_slots(self, doctor_id: Any = None, specialization: Optional[str] = None,
+                   department: Optional[str] = None, duration: int = 30, count: int = 5,
+                   after: Optional[datetime] = None, horizon_days: int = HORIZON_DAYS,
+                   taken: Optional[Dict[Tuple[Any, int], int]] = None) -> List[Slot]:
+        """The first count free slots of duration minutes from after (default
+        now) within horizon_days, over one doctor or every doctor of a
+        specialization or department, earliest first. taken maps (doctor_id,
+        day ordinal) to cells promised but not booked yet, which count as busy."""
+        after = after or datetime.now()
+        cells = max(1, -(-duration // UNIT))
+        first = after.toordinal()
+        last = first + horizon_days
+        earliest = -(-(after.hour * 60 + after.minute + (after.second > 0)) // UNIT)
+        # The best count starts so far as a max-heap of (-day, -cell, -doctor rank);
+        # doctors are ranked by ID so ties go to the lower one
+        best: List[Tuple[int, int, int]] = []
+        with self._lock:
+            self._check_generation()
+            doctors = self.doctors()
+            ranked = self._ranked(doctor_id, specialization, department)
+            queue: List[Tuple[int, int, int]] = []  # (day ordinal, doctor rank, open days from that day)
+            for rank, key in enumerate(ranked):
+                open_days = self._open_days(key, first, last)
+                if open_days:
+                    offset = (open_days & -open_days).bit_length() - 1
+                    queue.append((first + offset, rank, open_days >> offset))
+            heapq.heapify(queue)
+            while queue:
+                ordinal, rank, open_days = heapq.heappop(queue)
+                if len(best) == count and ordinal > -best[0][0]:
+                    break  # every later day is worse than all slots found
+                free, grid = self._free(ranked[rank], ordinal)
+                if taken:
+                    free &= ~taken.get((ranked[rank], ordinal), 0)
+                if ordinal == first:
+                    free &= ~((1 << earliest) - 1)
+                starts = free
+                for k in range(1, cells):
+                    starts &= free >> k
+                starts &= grid
+                while starts:
+                    bit = starts & -starts
+                    entry = (-ordinal, 1 - bit.bit_length(), -rank)
+                    if len(best) < count:
+                        heapq.heappush(best, entry)
+                    elif entry > best[0]:
+                        heapq.heapreplace(best, entry)
+                    else:
+                        break  # this doctor's later starts are worse still
+                    starts ^= bit
+                open_days >>= 1
+                if open_days:
+                    offset = (open_days & -open_days).bit_length() - 1
+                    heapq.heappush(queue, (ordinal + 1 + offset, rank, open_days >> offset))
+        slots = []
+        for ordinal, cell, rank in sorted((-o, -c, -r) for o, c, r in best):
+            key = ranked[rank]
+            midnight = datetime.combine(date.fromordinal(ordinal), datetime.min.time())
+            slots.append(Slot(midnight + timedelta(minutes=cell * UNIT), key,
+                              doctors.get(key, {}).get('name', str(key))))
+        return slots
+
+    def prepare(self, horizon_days: int = HORIZON_DAYS) -> None:
+        """Build every doctor's day bitmaps for the horizon (warm-up)"""
+        first = date.today().toordinal()
+        with self._lock:
+            self._check_generation()
+            for key in self.doctors():
+                self._open_days(key, first, first + horizon_days)
+
+    # Invalidation -----------------------------------------------------------
+
+    def _check_generation(self) -> None:
+        """Forget every bitmap (and the doctors) once working hours were
+        dropped without a change event (the bundled file, or doctors and
+        schedules changed by another process) or appointments were changed
+        by another process"""
+        generation = (self.availability.refresh(),
+                      self.backend.external_version('doctors'),
+                      self.backend.external_version(self.intervals.collection))
+        if self._generation != generation:
+            self._generation = generation
+            self._days.clear()
+            self._doctors = None
+
+    def _drop(self, doctor_id: Any, ordinals: Iterable[int]) -> None:
+        days = self._days.get(doctor_id)
+        if days is not None:
+            for ordinal in ordinals:
+                days.drop(ordinal)
+
+    @staticmethod
+    def _appointment_days(appointment: Optional[Dict[str, Any]]) -> List[int]:
+        if not appointment:
+            return []
+        try:
+            day = date.fromisoformat(appointment['date']).toordinal()
+        except (KeyError, TypeError, ValueError):
+            return []
+        return [day, day + 1]  # an evening appointment may run past midnight
+
+    def _on_change(self, event: Any) -> None:
+        with self._lock:
+            if event.op == 'reload':
+                if event.collection == 'doctors':
+                    self._doctors = None
+                self._days.clear()
+            elif event.collection == 'doctors':
+                self._doctors = None
+                self._days.pop(event.key, None)
+            elif event.collection == 'schedules':
+                for record in (event.old, event.new):
+                    if record:
+                        try:
+                            self._drop(record.get('doctor_id'), [date.fromisoformat(record['date']).toordinal()])
+                        except (KeyError, TypeError, ValueError):
+                            # A recurring rule may cover any day
+                            self._days.pop(record.get('doctor_id'), None)
+            else:
+                for record in (event.old, event.new):
+                    if record:
+                        self._drop(record.get('doctor_id'), self._appointment_days(record))
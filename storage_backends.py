@@ -0,0 +1,1610 @@
+import argparse
+import bisect
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import weakref
+from collections.abc import Mapping, Sequence
+from contextlib import contextmanager
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, List, Optional
+
+from collection_cache import CollectionCache
+from serialization import decode, get_codec
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Collections managed by main.DataManager. 'key' is the field that identifies
+# a record; map-shaped collections (users) are stored as {key: record}.
+# 'indexes' lists the field groups find()/find_range() can query; every
+# backend keeps an index per group (JSON in memory, SQLite in the database).
+# 'partition_by' names the date field that splits a growing collection into
+# monthly files (see PartitionedBackend; SQLite keeps one table).
+COLLECTIONS = {
+    'patients': {'file': 'patients.json', 'key': 'id'},
+    'doctors': {'file': 'doctors.json', 'key': 'id'},
+    'appointments': {'file': 'appointments.json', 'key': 'id', 'partition_by': 'date',
+                     'indexes': [('doctor_id', 'date'), ('doctor_id',), ('patient_id',), ('date',)]},
+    'pharmacy': {'file': 'pharmacy.json', 'key': 'id'},
+    'lab_reports': {'file': 'lab_reports.json', 'key': 'id',
+                    'indexes': [('patient_id',)]},
+    'billing': {'file': 'billing.json', 'key': 'bill_no', 'partition_by': 'date',
+                'indexes': [('patient_id',), ('date',)]},
+    'users': {'file': 'users.json', 'key': None, 'shape': 'map'},
+    'schedules': {'file': 'schedules.json', 'key': 'id',
+                  'indexes': [('doctor_id', 'date'), ('doctor_id',)]},
+}
+
+
+def _is_map(spec: Dict[str, Any]) -> bool:
+    return spec.get('shape') == 'map'
+
+
+def _empty(spec: Dict[str, Any]) -> Any:
+    return {} if _is_map(spec) else []
+
+
+def _copy_container(data: Any) -> Any:
+    """Shallow-copy a collection (the records stay shared)"""
+    return dict(data) if isinstance(data, dict) else list(data)
+
+
+class VersionConflict(ValueError):
+    """An update expected a record version that is no longer the stored one"""
+
+
+# Every record carries a version, bumped by each update. Passing the version
+# that was read as update(..., expected_version=) turns the write into a
+# compare-and-swap: it fails with VersionConflict instead of overwriting a
+# change someone else saved in the meantime. Records written before versions
+# existed count as version 0.
+VERSION_FIELD = 'version'
+
+
+def _stamped(record: Dict[str, Any]) -> Dict[str, Any]:
+    """A copy of a new record with its first version; the caller's dict is left alone"""
+    record = dict(record)
+    record.setdefault(VERSION_FIELD, 1)
+    return record
+
+
+def _versioned(collection: str, key: Any, current: Dict[str, Any], changes: Dict[str, Any],
+               expected_version: Optional[int]) -> Dict[str, Any]:
+    """changes plus the next version; raises VersionConflict if current is not the expected version"""
+    version = current.get(VERSION_FIELD, 0)
+    if expected_version is not None and version != expected_version:
+        raise VersionConflict(f"{collection} {key} was changed elsewhere "
+                              f"(version {version}, expected {expected_version})")
+    return dict(changes, **{VERSION_FIELD: version + 1})
+
+
+def _copy_records(data: Any) -> Any:
+    """Copy a collection and each record in it (files wrapped as
+    {"<collection>": [...]} are copied one level further down)"""
+    if isinstance(data, dict):
+        return {key: _copy_records(value) if isinstance(value, list) else dict(value)
+                for key, value in data.items()}
+    return [dict(record) for record in data]
+
+
+def _index_group(collection: str, spec: Dict[str, Any], fields: Any) -> tuple:
+    """Return the declared index whose fields are exactly `fields`"""
+    for group in spec.get('indexes', []):
+        if set(group) == set(fields):
+            return tuple(group)
+    raise ValueError(f"No index on {collection}({', '.join(sorted(fields))})")
+
+
+class SecondaryIndex:
+    """Records grouped by the values of one declared field group.
+
+    Groups keep records in insertion order. Single-field indexes also keep
+    their values sorted (built on the first range query) so range lookups
+    are a bisect instead of a scan.
+    """
+
+    def __init__(self, fields: tuple, records: Any = ()):
+        self.fields = tuple(fields)
+        self.groups: Dict[tuple, List[Dict[str, Any]]] = {}
+        self._sorted: Optional[List[Any]] = None
+        for record in records:
+            self.add(record)
+
+    def value(self, record: Dict[str, Any]) -> tuple:
+        return tuple(record.get(f) for f in self.fields)
+
+    def add(self, record: Dict[str, Any]) -> None:
+        value = self.value(record)
+        group = self.groups.get(value)
+        if group is None:
+            self.groups[value] = [record]
+            if self._sorted is not None and value[0] is not None:
+                bisect.insort(self._sorted, value[0])
+        else:
+            group.append(record)
+
+    def remove(self, record: Dict[str, Any]) -> None:
+        value = self.value(record)
+        group = self.groups.get(value, [])
+        for i, candidate in enumerate(group):
+            if candidate is record:
+                del group[i]
+                break
+        if not group and value in self.groups:
+            del self.groups[value]
+            if self._sorted is not None and value[0] is not None:
+                del self._sorted[bisect.bisect_left(self._sorted, value[0])]
+
+    def lookup(self, value: tuple) -> List[Dict[str, Any]]:
+        return list(self.groups.get(value, []))
+
+    def range(self, low: Any = None, high: Any = None) -> List[Dict[str, Any]]:
+        """Records whose value lies in [low, high] (None leaves a side open), in value order"""
+        if len(self.fields) != 1:
+            raise ValueError("Range queries need a single-field index")
+        if self._sorted is None:
+            self._sorted = sorted(v[0] for v in self.groups if v[0] is not None)
+        lo = 0 if low is None else bisect.bisect_left(self._sorted, low)
+        hi = len(self._sorted) if high is None else bisect.bisect_right(self._sorted, high)
+        result = []
+        for value in self._sorted[lo:hi]:
+            result.extend(self.groups[(value,)])
+        return result
+
+
+def atomic_write_json(filepath: str, data: Any, indent: Optional[int] = 4) -> None:
+    """Write data as JSON atomically (see atomic_write_bytes)"""
+    atomic_write_bytes(filepath, json.dumps(data, indent=indent).encode('utf-8'))
+
+
+def atomic_write_bytes(filepath: str, payload: bytes) -> None:
+    """Write to a temp file in the same directory, fsync it and rename it
+    over filepath, so a crash never leaves a truncated file behind"""
+    directory = os.path.dirname(filepath) or '.'
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(filepath) + '.', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _freeze(value: Any) -> Any:
+    """Read-only view of a record; nested dicts and lists are frozen too
+    (as read-only mappings and tuples), so nothing reachable from a
+    snapshot can be changed through it"""
+    if isinstance(value, dict):
+        if any(isinstance(v, (dict, list)) for v in value.values()):
+            value = {k: _freeze(v) for k, v in value.items()}
+        return MappingProxyType(value)
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class FrozenCollection(Sequence):
+    """Read-only view of a list collection as it was when a snapshot was taken.
+
+    It shares the backend's own lists instead of copying them (a
+    partitioned collection is a view over several); records come out as
+    read-only mappings, nested values included (see _freeze). Use
+    dict(record) for a modifiable copy.
+    """
+
+    def __init__(self, chunks: List[List[Dict[str, Any]]]):
+        self._chunks = chunks
+        self._len = sum(len(chunk) for chunk in chunks)
+        self._sources: List['FrozenCollection'] = []
+
+    @classmethod
+    def concat(cls, views: List['FrozenCollection']) -> 'FrozenCollection':
+        view = cls([chunk for view in views for chunk in view._chunks])
+        # Backends watch the partition views to know a snapshot still shares
+        # their data, so they must live as long as the combined view
+        view._sources = views
+        return view
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[Any]:
+        for chunk in self._chunks:
+            for record in chunk:
+                yield _freeze(record)
+
+    def __getitem__(self, i: Any) -> Any:
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._len))]
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError("snapshot index out of range")
+        for chunk in self._chunks:
+            if i < len(chunk):
+                return _freeze(chunk[i])
+            i -= len(chunk)
+
+
+class FrozenMap(Mapping):
+    """Read-only view of a map-shaped collection (see FrozenCollection)"""
+
+    def __init__(self, data: Dict[Any, Dict[str, Any]]):
+        self._data = data
+
+    def __getitem__(self, key: Any) -> Any:
+        return _freeze(self._data[key])
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def _frozen(data: Any) -> Any:
+    return FrozenMap(data) if isinstance(data, dict) else FrozenCollection([data])
+
+
+class Snapshot:
+    """A consistent, read-only view of some collections at one moment.
+
+    snapshot['billing'] is a FrozenCollection (FrozenMap for map-shaped
+    collections). Writers never modify data a snapshot refers to: they
+    replace containers and records instead (copy-on-write), so analytics
+    can read a snapshot on a worker thread while writes go on. version is
+    the number of writes the backend had committed when it was taken
+    (writes made by this process).
+    """
+
+    def __init__(self, version: int, collections: Dict[str, Any]):
+        self.version = version
+        self._collections = collections
+
+    def __getitem__(self, collection: str) -> Any:
+        return self._collections[collection]
+
+    def __contains__(self, collection: str) -> bool:
+        return collection in self._collections
+
+    def __repr__(self) -> str:
+        sizes = ', '.join(f"{c}={len(v)}" for c, v in self._collections.items())
+        return f"Snapshot(version={self.version}, {sizes})"
+
+
+class FileLock:
+    """Exclusive advisory lock on a file, shared by processes and threads.
+
+    Several workstations may point at the same data directory; every
+    mutation holds this lock from reading the current data to writing the
+    result, so concurrent writers queue up instead of losing each other's
+    changes. The lock is reentrant within a thread, which lets a
+    transaction hold it across all of its writes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self) -> 'FileLock':
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                self._file = open(self.path, 'a+')
+                if fcntl is not None:
+                    fcntl.flock(self._file, fcntl.LOCK_EX)
+                else:
+                    self._file.seek(0)
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+            except BaseException:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+
+class JsonBackend:
+    """One file per collection, written with a serialization codec
+    ('compact' JSON by default; indented files from older versions and
+    binary snapshots load just the same).
+
+    Record operations load the whole collection, change it and write it
+    back; the collection cache keeps the parsed copy between calls and a
+    primary-key index makes lookups by key O(1).
+
+    Inside transaction() changes go to per-thread working copies and each
+    touched file is written once, atomically, when the block ends.
+    """
+
+    name = 'json'
+
+    def __init__(self, data_dir: str, collections: Dict[str, Dict[str, Any]] = COLLECTIONS,
+                 cache: Optional[CollectionCache] = None, codec: str = 'compact'):
+        self.data_dir = data_dir
+        self.codec = get_codec(codec)
+        self.collections = collections
+        self.cache = cache if cache is not None else CollectionCache()
+        self._key_indexes: Dict[str, tuple] = {}
+        self._secondary_indexes: Dict[str, tuple] = {}
+        # Guards the indexes, which warm-up threads build while others read
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        # Held by every write (and by a whole transaction) in every process
+        self.write_lock = FileLock(os.path.join(data_dir, '.write.lock'))
+        self.generation = 0  # writes committed through this backend
+
+    def _transaction(self) -> Optional[Dict[str, Any]]:
+        """The current thread's open transaction, if any"""
+        return getattr(self._local, 'transaction', None)
+
+    @contextmanager
+    def transaction(self):
+        """Buffer writes until the block ends, then write each touched
+        collection once; if the block raises nothing is written.
+        Nested blocks join the outermost transaction. The write lock is held
+        throughout, so the block reads and commits a consistent state."""
+        if self._transaction() is not None:
+            yield
+            return
+        with self.write_lock:
+            txn = self._local.transaction = {'data': {}, 'dirty': []}
+            try:
+                yield
+            finally:
+                self._local.transaction = None
+            self._commit(txn)
+
+    def _commit(self, txn: Dict[str, Any]) -> None:
+        for collection in txn['dirty']:
+            self.cache.put(self.path(collection), txn['data'][collection], self._write_file)
+        if txn['dirty']:
+            self.generation += 1
+
+    def path(self, collection: str) -> str:
+        """Return the JSON file backing a collection"""
+        return os.path.join(self.data_dir, self.collections[collection]['file'])
+
+    def _read_file(self, filepath: str) -> Any:
+        with open(filepath, 'rb') as f:
+            return decode(f.read())
+
+    def _write_file(self, filepath: str, data: Any) -> None:
+        atomic_write_bytes(filepath, self.codec.dumps(data))
+
+    def exists(self, collection: str) -> bool:
+        return os.path.exists(self.path(collection))
+
+    def _raw(self, collection: str) -> Any:
+        """The cached collection itself; callers must not modify it"""
+        txn = self._transaction()
+        if txn is not None:
+            if collection not in txn['data']:
+                txn['data'][collection] = _copy_records(self._disk(collection))
+            return txn['data'][collection]
+        return self._disk(collection)
+
+    def _disk(self, collection: str) -> Any:
+        filepath = self.path(collection)
+        if not os.path.exists(filepath):
+            return _empty(self.collections[collection])
+        return self.cache.get(filepath, self._read_file)
+
+    def external_version(self, collection: str) -> Any:
+        """Token that changes when a collection was changed by someone other
+        than this backend (another process, or an edit by hand). Writes made
+        through this backend leave it alone; they are announced as they
+        happen instead. Compare tokens for equality only."""
+        self._disk(collection)
+        return self.cache.loads(self.path(collection))
+
+    def _indexed(self, collection: str) -> tuple:
+        """Return (cached collection, its primary-key index)"""
+        data = self._raw(collection)
+        if isinstance(data, dict):
+            return data, data
+        with self._lock:
+            entry = self._key_indexes.get(collection)
+            if entry is None or entry[0] is not data:
+                key_field = self.collections[collection]['key']
+                index = {}
+                for record in data:
+                    index.setdefault(record.get(key_field), record)
+                entry = (data, index)
+                self._key_indexes[collection] = entry
+            return entry
+
+    def key_index(self, collection: str) -> Dict[Any, Dict[str, Any]]:
+        """Primary-key index {key: first record with that key}.
+
+        The index is tied to the cached copy of the collection, so it is only
+        rebuilt when the file changed on disk; insert/update/delete keep it in
+        step with their own writes.
+        """
+        return self._indexed(collection)[1]
+
+    def _secondaries(self, collection: str, data: Any) -> Dict[tuple, SecondaryIndex]:
+        """Secondary indexes built so far over this cached copy"""
+        entry = self._secondary_indexes.get(collection)
+        if entry is None or entry[0] is not data:
+            entry = (data, {})
+            self._secondary_indexes[collection] = entry
+        return entry[1]
+
+    def secondary_index(self, collection: str, fields: tuple) -> SecondaryIndex:
+        """The index on a declared field group, built on first use"""
+        data = self._raw(collection)
+        with self._lock:
+            indexes = self._secondaries(collection, data)
+            if fields not in indexes:
+                indexes[fields] = SecondaryIndex(fields, data)
+            return indexes[fields]
+
+    def find(self, collection: str, **criteria: Any) -> List[Dict[str, Any]]:
+        """Records matching criteria exactly; the fields must form a declared index"""
+        group = _index_group(collection, self.collections[collection], criteria)
+        matches = self.secondary_index(collection, group).lookup(tuple(criteria[f] for f in group))
+        return [dict(r) for r in matches]
+
+    def find_range(self, collection: str, field: str, low: Any = None,
+                   high: Any = None) -> List[Dict[str, Any]]:
+        """Records with low <= field <= high, ordered by field; needs an index on (field,)"""
+        group = _index_group(collection, self.collections[collection], (field,))
+        return [dict(r) for r in self.secondary_index(collection, group).range(low, high)]
+
+    def _store(self, collection: str, data: Any, index: Dict[Any, Dict[str, Any]],
+               secondaries: Optional[Dict[tuple, SecondaryIndex]] = None) -> None:
+        """Save data and keep the indexes attached to the newly cached copy"""
+        self.save(collection, data)
+        if not isinstance(data, dict):
+            self._key_indexes[collection] = (data, index)
+            self._secondary_indexes[collection] = (data, secondaries or {})
+
+    def load(self, collection: str) -> Any:
+        """Load a whole collection (list, or dict for map-shaped ones). The
+        records are copies, so callers may change them without touching the
+        cached data; write changes back through update()."""
+        return _copy_records(self._raw(collection))
+
+    def preload(self, collection: str) -> None:
+        """Parse a collection and build its primary-key index ahead of use"""
+        self.key_index(collection)
+
+    def snapshot(self, *collections: str) -> Snapshot:
+        """Read-only view of collections (all when none are given) at one
+        moment. Nothing is copied: the cached data is shared, and writers
+        replace rather than modify it."""
+        with self.write_lock:
+            return Snapshot(self.generation,
+                            {c: _frozen(self._disk(c)) for c in collections or self.collections})
+
+    def iter_records(self, collection: str, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """Stream copies of the records of a collection (values for map collections)"""
+        data = _copy_container(self._raw(collection))
+        for record in data.values() if isinstance(data, dict) else data:
+            yield dict(record)
+
+    def count(self, collection: str) -> int:
+        return len(self._raw(collection))
+
+    def save(self, collection: str, data: Any) -> None:
+        """Replace a whole collection"""
+        txn = self._transaction()
+        if txn is not None:
+            txn['data'][collection] = data
+            if collection not in txn['dirty']:
+                txn['dirty'].append(collection)
+            return
+        with self.write_lock:
+            self.cache.put(self.path(collection), data, self._write_file)
+            self.generation += 1
+
+    def get(self, collection: str, key: Any) -> Optional[Dict[str, Any]]:
+        """Return a copy of the record stored under key, or None"""
+        record = self.key_index(collection).get(key)
+        return None if record is None else dict(record)
+
+    def insert(self, collection: str, record: Dict[str, Any], key: Any = None) -> None:
+        """Append a record (map-shaped collections need an explicit key)"""
+        record = _stamped(record)  # the stored record must not change with the caller's dict
+        with self.write_lock, self._lock:
+            data, index = self._indexed(collection)
+            secondaries = self._secondaries(collection, data)
+            data = _copy_container(data)
+            if isinstance(data, dict):
+                data[key] = record
+            else:
+                data.append(record)
+                index.setdefault(record.get(self.collections[collection]['key']), record)
+                for secondary in secondaries.values():
+                    secondary.add(record)
+            self._store(collection, data, index, secondaries)
+
+    def insert_many(self, collection: str, records: List[Dict[str, Any]]) -> None:
+        """Append several records with a single write (list collections only)"""
+        with self.write_lock, self._lock:
+            data, index = self._indexed(collection)
+            if isinstance(data, dict):
+                raise ValueError(f"insert_many is not supported for map collection {collection}")
+            secondaries = self._secondaries(collection, data)
+            key_field = self.collections[collection]['key']
+            records = [_stamped(record) for record in records]
+            data = _copy_container(data)
+            data.extend(records)
+            for record in records:
+                index.setdefault(record.get(key_field), record)
+                for secondary in secondaries.values():
+                    secondary.add(record)
+            self._store(collection, data, index, secondaries)
+
+    def update(self, collection: str, key: Any, changes: Dict[str, Any],
+               expected_version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Merge changes into the first record with this key and bump its
+        version; None if missing. With expected_version, raise
+        VersionConflict unless the record is still at that version."""
+        with self.write_lock, self._lock:
+            data, index = self._indexed(collection)
+            secondaries = self._secondaries(collection, data)
+            record = index.get(key)
+            if record is None:
+                return None
+            # Copy-on-write: snapshots may still hold the old record and list
+            updated = dict(record)
+            updated.update(_versioned(collection, key, record, changes, expected_version))
+            if isinstance(data, dict):
+                data = index = _copy_container(data)
+                data[key] = updated
+            else:
+                data = [updated if r is record else r for r in data]
+                index[key] = updated
+            for secondary in secondaries.values():
+                secondary.remove(record)
+                secondary.add(updated)
+            self._store(collection, data, index, secondaries)
+            return updated
+
+    def delete(self, collection: str, key: Any) -> bool:
+        """Remove every record with this key; returns whether any was removed"""
+        with self.write_lock, self._lock:
+            data, index = self._indexed(collection)
+            secondaries = self._secondaries(collection, data)
+            if key not in index:
+                return False
+            if isinstance(data, dict):
+                data = _copy_container(data)
+                del data[key]
+            else:
+                key_field = self.collections[collection]['key']
+                kept = []
+                for record in data:
+                    if record.get(key_field) != key:
+                        kept.append(record)
+                        continue
+                    for secondary in secondaries.values():
+                        secondary.remove(record)
+                data = kept
+                index.pop(key)
+            self._store(collection, data, index, secondaries)
+            return True
+
+class JournalBackend(JsonBackend):
+    """JSON snapshots plus a per-collection write-ahead journal.
+
+    Every mutation is appended (and fsynced) as one JSON line to
+    <collection>.journal, so a write costs the size of the change rather
+    than the size of the collection. Reads replay the journal over the last
+    snapshot; only journal bytes not yet seen are read on later calls. Once
+    a journal holds compact_after records, and at least half as many as the
+    collection itself (so bulk loads don't rewrite the snapshot on every
+    batch), it is folded into a new snapshot, written atomically.
+
+    The journal's first line names the snapshot it applies to (size and
+    mtime). If a crash happens after a new snapshot is written but before
+    the journal is removed, the header no longer matches and the already
+    folded journal is ignored instead of being replayed twice. A torn last
+    line from a crash mid-append is ignored as well.
+    """
+
+    name = 'journal'
+
+    def __init__(self, data_dir: str, collections: Dict[str, Dict[str, Any]] = COLLECTIONS,
+                 cache: Optional[CollectionCache] = None, codec: str = 'compact',
+                 compact_after: int = 500):
+        super().__init__(data_dir, collections, cache, codec)
+        self.compact_after = compact_after
+        self._states: Dict[str, Dict[str, Any]] = {}
+        self._foreign: Dict[str, int] = {}  # changes read from disk, per collection
+        self._seen: Dict[str, tuple] = {}  # (snapshot stamp, journal offset) last read or written
+
+    def journal_path(self, collection: str) -> str:
+        return os.path.splitext(self.path(collection))[0] + '.journal'
+
+    def _snapshot_stamp(self, collection: str) -> Optional[str]:
+        try:
+            st = os.stat(self.path(collection))
+        except FileNotFoundError:
+            return None
+        return f"{st.st_size}:{st.st_mtime_ns}"
+
+    def _read_snapshot(self, collection: str) -> Any:
+        filepath = self.path(collection)
+        if not os.path.exists(filepath):
+            return _empty(self.collections[collection])
+        return self._read_file(filepath)
+
+    def _state(self, collection: str) -> Dict[str, Any]:
+        """Collection state as seen by this thread (its transaction's copy, if any)"""
+        txn = self._transaction()
+        if txn is None:
+            return self._disk_state(collection)
+        if collection not in txn['data']:
+            state = self._disk_state(collection)
+            txn['data'][collection] = dict(state, data=_copy_records(state['data']),
+                                           index=None, secondary={})
+        return txn['data'][collection]
+
+    def _disk_state(self, collection: str) -> Dict[str, Any]:
+        """Snapshot with the journal replayed, reading only what changed on disk"""
+        stamp = self._snapshot_stamp(collection)
+        state = self._states.get(collection)
+        if state is None or state['stamp'] != stamp or not self.cache.enabled:
+            state = {'stamp': stamp, 'offset': 0, 'entries': 0,
+                     'data': self._read_snapshot(collection), 'index': None, 'secondary': {}}
+            self._states[collection] = state
+        self._replay(collection, state)
+        self._note(collection, state)
+        return state
+
+    def _note(self, collection: str, state: Dict[str, Any], own: bool = False) -> None:
+        """Count a snapshot or journal position not seen before as an outside
+        change, unless this backend just wrote it (own)"""
+        seen = (state['stamp'], state['offset'])
+        if self._seen.get(collection) != seen:
+            self._seen[collection] = seen
+            if not own:
+                self._foreign[collection] = self._foreign.get(collection, 0) + 1
+
+    def external_version(self, collection: str) -> Any:
+        with self._lock:
+            self._disk_state(collection)
+            return self._foreign.get(collection, 0)
+
+    def _replay(self, collection: str, state: Dict[str, Any]) -> None:
+        path = self.journal_path(collection)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            size = 0
+        if size < state['offset']:
+            # Journal was compacted by someone else; start over from the snapshot
+            self._states.pop(collection, None)
+            state.update(self._disk_state(collection))
+            return
+        if size == state['offset']:
+            return
+
+        with open(path, 'rb') as f:
+            f.seek(state['offset'])
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break  # torn write from a crash; ignore the partial line
+                entry = json.loads(raw)
+                if 'base' in entry:
+                    if entry['base'] != state['stamp']:
+                        return  # journal belongs to an older snapshot
+                else:
+                    self._apply(collection, state, entry)
+                    state['entries'] += 1
+                state['offset'] += len(raw)
+
+    def _key_index(self, collection: str, state: Dict[str, Any]) -> Dict[Any, Dict[str, Any]]:
+        """Map key -> first record with that key, built on first use"""
+        if state['index'] is None:
+            key_field = self.collections[collection]['key']
+            index = {}
+            for record in state['data']:
+                index.setdefault(record.get(key_field), record)
+            state['index'] = index
+        return state['index']
+
+    def _detach(self, state: Dict[str, Any]) -> None:
+        """Copy-on-write: before changing data a live snapshot still shares,
+        give the state its own container. Records are replaced rather than
+        changed in place, so they (and the indexes over them) stay shared."""
+        view = state.get('snapshot')
+        if view is not None and view() is not None:
+            state['data'] = _copy_container(state['data'])
+        state['snapshot'] = None
+
+    def _apply(self, collection: str, state: Dict[str, Any], entry: Dict[str, Any]) -> None:
+        self._detach(state)
+        data = state['data']
+        op, key = entry['op'], entry.get('key')
+        if isinstance(data, dict):
+            if op == 'insert':
+                data[key] = entry['record']
+            elif op == 'update' and key in data:
+                data[key] = {**data[key], **entry['changes']}
+            elif op == 'delete':
+                data.pop(key, None)
+            return
+
+        key_field = self.collections[collection]['key']
+        secondaries = state['secondary'].values()
+        if op == 'insert':
+            data.append(entry['record'])
+            if state['index'] is not None:
+                state['index'].setdefault(entry['record'].get(key_field), entry['record'])
+            for secondary in secondaries:
+                secondary.add(entry['record'])
+        elif op == 'update':
+            index = self._key_index(collection, state)
+            record = index.get(key)
+            if record is not None:
+                # Copy-on-write: whoever still holds the old record keeps it unchanged
+                updated = {**record, **entry['changes']}
+                data[next(i for i, r in enumerate(data) if r is record)] = updated
+                index[key] = updated
+                for secondary in secondaries:
+                    secondary.remove(record)
+                    secondary.add(updated)
+        elif op == 'delete':
+            data[:] = [r for r in data if r.get(key_field) != key]
+            state['index'] = None
+            state['secondary'] = {}
+
+    def _append(self, collection: str, entry: Dict[str, Any]) -> None:
+        txn = self._transaction()
+        if txn is not None:
+            self._apply(collection, self._state(collection), entry)
+            txn['entries'].setdefault(collection, []).append(entry)
+            return
+        self._write_entries(collection, [entry])
+
+    def _write_entries(self, collection: str, entries: List[Dict[str, Any]]) -> None:
+        """Append entries to the journal with a single fsync"""
+        state = self._disk_state(collection)
+        path = self.journal_path(collection)
+        lines = ''.join(json.dumps(entry, separators=(',', ':')) + '\n' for entry in entries)
+        if state['offset'] == 0:
+            # No journal for the current snapshot yet: start one with a header
+            header = json.dumps({'base': state['stamp']}) + '\n'
+            with open(path, 'w') as f:
+                f.write(header + lines)
+                f.flush()
+                os.fsync(f.fileno())
+        else:
+            with open(path, 'a') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+        self._replay(collection, state)
+        self._note(collection, state, own=True)
+        self.generation += 1
+        if self._should_compact(state) and self._transaction() is None:
+            self.compact(collection)
+
+    def _should_compact(self, state: Dict[str, Any]) -> bool:
+        return state['entries'] >= max(self.compact_after, len(state['data']) // 2)
+
+    def compact(self, collection: str) -> None:
+        """Fold the journal into a new snapshot and drop it"""
+        with self.write_lock, self._lock:
+            state = self._disk_state(collection)
+            self._write_file(self.path(collection), state['data'])
+            if os.path.exists(self.journal_path(collection)):
+                os.remove(self.journal_path(collection))
+            state.update(stamp=self._snapshot_stamp(collection), offset=0, entries=0)
+            self._note(collection, state, own=True)
+
+    def exists(self, collection: str) -> bool:
+        return os.path.exists(self.path(collection)) or os.path.exists(self.journal_path(collection))
+
+    def _raw(self, collection: str) -> Any:
+        with self._lock:
+            return self._state(collection)['data']
+
+    def load(self, collection: str) -> Any:
+        with self._lock:
+            return _copy_records(self._state(collection)['data'])
+
+    @contextmanager
+    def transaction(self):
+        """Buffer journal entries until the block ends, then append each
+        collection's entries with one fsync; nothing is written if it raises"""
+        if self._transaction() is not None:
+            yield
+            return
+        with self.write_lock:
+            txn = self._local.transaction = {'data': {}, 'dirty': [], 'entries': {}}
+            try:
+                yield
+            finally:
+                self._local.transaction = None
+            with self._lock:
+                for collection in txn['dirty']:
+                    self.save(collection, txn['saved'][collection])
+                for collection, entries in txn['entries'].items():
+                    self._write_entries(collection, entries)
+
+    def save(self, collection: str, data: Any) -> None:
+        """Replace a whole collection: written as a fresh snapshot"""
+        txn = self._transaction()
+        if txn is not None:
+            # Entries logged before the replacement no longer matter
+            txn.setdefault('saved', {})[collection] = data
+            txn['entries'].pop(collection, None)
+            txn['data'][collection] = {'stamp': None, 'offset': 0, 'entries': 0,
+                                       'data': _copy_records(data), 'index': None, 'secondary': {}}
+            if collection not in txn['dirty']:
+                txn['dirty'].append(collection)
+            return
+        with self.write_lock, self._lock:
+            self._write_file(self.path(collection), data)
+            if os.path.exists(self.journal_path(collection)):
+                os.remove(self.journal_path(collection))
+            self._states[collection] = {'stamp': self._snapshot_stamp(collection), 'offset': 0,
+                                        'entries': 0, 'data': data, 'index': None, 'secondary': {}}
+            self._note(collection, self._states[collection], own=True)
+            self.generation += 1
+
+    def snapshot(self, *collections: str) -> Snapshot:
+        """Read-only view of collections at one moment. The replayed data is
+        shared; the next journal entry applied while the snapshot is alive
+        copies the collection first."""
+        with self.write_lock, self._lock:
+            frozen = {}
+            for collection in collections or self.collections:
+                state = self._disk_state(collection)
+                frozen[collection] = _frozen(state['data'])
+                state['snapshot'] = weakref.ref(frozen[collection])
+            return Snapshot(self.generation, frozen)
+
+    def key_index(self, collection: str) -> Dict[Any, Dict[str, Any]]:
+        with self._lock:
+            state = self._state(collection)
+            if isinstance(state['data'], dict):
+                return state['data']
+            return self._key_index(collection, state)
+
+    def get(self, collection: str, key: Any) -> Optional[Dict[str, Any]]:
+        record = self.key_index(collection).get(key)
+        return None if record is None else dict(record)
+
+    def secondary_index(self, collection: str, fields: tuple) -> SecondaryIndex:
+        with self._lock:
+            state = self._state(collection)
+            if fields not in state['secondary']:
+                state['secondary'][fields] = SecondaryIndex(fields, state['data'])
+            return state['secondary'][fields]
+
+    def insert(self, collection: str, record: Dict[str, Any], key: Any = None) -> None:
+        record = _stamped(record)
+        with self.write_lock, self._lock:
+            if not isinstance(self._state(collection)['data'], dict):
+                key = record.get(self.collections[collection]['key'])
+            self._append(collection, {'op': 'insert', 'key': key, 'record': record})
+
+    def insert_many(self, collection: str, records: List[Dict[str, Any]]) -> None:
+        """Append several records to the journal with a single fsync"""
+        with self.write_lock, self._lock:
+            if isinstance(self._state(collection)['data'], dict):
+                raise ValueError(f"insert_many is not supported for map collection {collection}")
+            key_field = self.collections[collection]['key']
+            records = [_stamped(record) for record in records]
+            entries = [{'op': 'insert', 'key': r.get(key_field), 'record': r} for r in records]
+            txn = self._transaction()
+            if txn is None:
+                self._write_entries(collection, entries)
+                return
+            for entry in entries:
+                self._apply(collection, self._state(collection), entry)
+            txn['entries'].setdefault(collection, []).extend(entries)
+
+    def update(self, collection: str, key: Any, changes: Dict[str, Any],
+               expected_version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        with self.write_lock, self._lock:
+            current = self.get(collection, key)
+            if current is None:
+                return None
+            changes = _versioned(collection, key, current, changes, expected_version)
+            self._append(collection, {'op': 'update', 'key': key, 'changes': changes})
+            return self.get(collection, key)
+
+    def delete(self, collection: str, key: Any) -> bool:
+        with self.write_lock, self._lock:
+            if self.get(collection, key) is None:
+                return False
+            self._append(collection, {'op': 'delete', 'key': key})
+            return True
+
+
+class PartitionedBackend:
+    """Splits collections whose spec has 'partition_by' into one file per month.
+
+    Wraps a file backend (JsonBackend or JournalBackend). A partitioned
+    collection lives in a directory named after it: <collection>/2025-01.json
+    and so on, plus manifest.json listing the partitions. Each partition is
+    an ordinary collection of the wrapped backend, so caching, indexes,
+    journals and transactions all apply per partition. A write only touches
+    the partition of the record's month; queries on the partition field
+    skip partitions outside the requested months. Records whose field is
+    not a YYYY-MM... date go to the 'undated' partition.
+
+    Collections without 'partition_by' are passed straight through. An
+    existing single-file collection is split into partitions on first use
+    and kept as <file>.pre-partition. With auto_migrate=False it is left
+    alone and used as one unpartitioned file until migrate() is called
+    (for directories holding reference data that must not be rewritten).
+    """
+
+    UNDATED = 'undated'
+
+    def __init__(self, inner: JsonBackend, auto_migrate: bool = True):
+        self.inner = inner
+        self.collections = inner.collections
+        self.auto_migrate = auto_migrate
+        # Partitions are registered as extra collections of the wrapped backend
+        inner.collections = dict(inner.collections)
+        self._lock = threading.RLock()
+        self._unsplit: Dict[str, bool] = {}
+        # collection -> {key: month it was last found in}, so get/update
+        # don't probe every partition
+        self._key_months: Dict[str, Dict[Any, str]] = {}
+
+    def __getattr__(self, name: str) -> Any:
+        # transaction(), compact(), ... come from the wrapped backend
+        return getattr(self.inner, name)
+
+    def _field(self, collection: str) -> Optional[str]:
+        """The partition field, or None for collections stored as one file"""
+        field = self.collections[collection].get('partition_by')
+        if field and not self.auto_migrate and self._is_unsplit(collection):
+            return None
+        return field
+
+    def _is_unsplit(self, collection: str) -> bool:
+        """Whether a partitioned collection is still a legacy single file"""
+        if collection not in self._unsplit:
+            self._unsplit[collection] = (not os.path.exists(self._manifest_path(collection))
+                                         and os.path.exists(self.inner.path(collection)))
+        return self._unsplit[collection]
+
+    def _dir(self, collection: str) -> str:
+        return os.path.join(self.inner.data_dir, collection)
+
+    def _manifest_path(self, collection: str) -> str:
+        return os.path.join(self._dir(collection), 'manifest.json')
+
+    def month_of(self, value: Any) -> str:
+        value = str(value or '')
+        if len(value) >= 7 and value[:4].isdigit() and value[4] == '-' and value[5:7].isdigit():
+            return value[:7]
+        return self.UNDATED
+
+    def _part(self, collection: str, month: str) -> str:
+        """Name of the wrapped backend's collection holding one partition"""
+        name = f"{collection}/{month}"
+        if name not in self.inner.collections:
+            spec = dict(self.collections[collection])
+            spec.pop('partition_by')
+            spec['file'] = os.path.join(collection, f"{month}.json")
+            self.inner.collections[name] = spec
+        return name
+
+    def partitions(self, collection: str) -> List[str]:
+        """Months of a partitioned collection in order ('undated' last)"""
+        if self.auto_migrate:
+            self._migrate(collection)
+        return self._listed(collection)
+
+    def _listed(self, collection: str) -> List[str]:
+        path = self._manifest_path(collection)
+        if not os.path.exists(path):
+            return []
+        manifest = self.inner.cache.get(path, self.inner._read_file)
+        return sorted(manifest['partitions'], key=lambda m: (m == self.UNDATED, m))
+
+    def _add_partitions(self, collection: str, months: Any) -> None:
+        with self.inner.write_lock, self._lock:
+            known = self._listed(collection)
+            new = set(months) - set(known)
+            if new:
+                os.makedirs(self._dir(collection), exist_ok=True)
+                manifest = {'version': 1, 'partition_by': self.collections[collection]['partition_by'],
+                            'partitions': sorted(set(known) | new)}
+                self.inner.cache.put(self._manifest_path(collection), manifest,
+                                     lambda p, d: atomic_write_json(p, d))
+
+    def migrate(self, collection: str) -> None:
+        """Split a single-file collection into month partitions now"""
+        self._migrate(collection)
+        self._unsplit[collection] = False
+
+    def _migrate(self, collection: str) -> None:
+        """Split a pre-partitioning single file into month partitions"""
+        legacy = self.inner.path(collection)
+        if os.path.exists(self._manifest_path(collection)) or not os.path.exists(legacy):
+            return
+        with self.inner.write_lock, self._lock:
+            if os.path.exists(self._manifest_path(collection)) or not os.path.exists(legacy):
+                return
+            data = self.inner.load(collection)
+            if isinstance(data, dict):  # files wrapped as {"<collection>": [...]}
+                data = data.get(collection, [])
+            self._save_partitions(collection, data)
+            self._key_months.pop(collection, None)
+            os.replace(legacy, legacy + '.pre-partition')
+            journal = getattr(self.inner, 'journal_path', None)
+            if journal and os.path.exists(journal(collection)):
+                os.remove(journal(collection))
+
+    def _group(self, collection: str, records: Any) -> Dict[str, List[Dict[str, Any]]]:
+        field = self.collections[collection]['partition_by']
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for record in records:
+            groups.setdefault(self.month_of(record.get(field)), []).append(record)
+        return groups
+
+    def _save_partitions(self, collection: str, data: Any) -> None:
+        self._key_months.pop(collection, None)
+        groups = self._group(collection, data)
+        self._add_partitions(collection, groups)
+        for month in self._listed(collection):
+            self.inner.save(self._part(collection, month), groups.get(month, []))
+
+    def _months_between(self, collection: str, low: Any, high: Any) -> List[str]:
+        """Partitions that can hold values in [low, high] ('undated' is always kept)"""
+        low_month = str(low)[:7] if low is not None else None
+        high_month = str(high)[:7] if high is not None else None
+        return [m for m in self.partitions(collection)
+                if m == self.UNDATED or ((low_month is None or m >= low_month)
+                                         and (high_month is None or m <= high_month))]
+
+    def _holds(self, collection: str, month: str, key: Any) -> bool:
+        return key in self.inner.key_index(self._part(collection, month))
+
+    def _locate(self, collection: str, key: Any) -> Optional[str]:
+        """Newest partition holding key. The key -> month map answers most
+        lookups with one check; keys it does not know, or that have moved
+        (e.g. by another process), fall back to probing every partition."""
+        partitions = self.partitions(collection)
+        with self._lock:
+            months = self._key_months.get(collection)
+            if months is None:
+                months = self._key_months[collection] = {}
+                for month in partitions:
+                    for known in self.inner.key_index(self._part(collection, month)):
+                        months[known] = month
+            month = months.get(key)
+            if month is not None and self._holds(collection, month, key):
+                return month
+            for month in reversed(partitions):
+                if self._holds(collection, month, key):
+                    months[key] = month
+                    return month
+            months.pop(key, None)
+            return None
+
+    def _remember(self, collection: str, key: Any, month: str) -> None:
+        """Record where a key was just written (the newest partition wins)"""
+        with self._lock:
+            months = self._key_months.get(collection)
+            if months is not None:
+                known = months.get(key)
+                if known is None or (month == self.UNDATED, month) >= (known == self.UNDATED, known):
+                    months[key] = month
+
+    def compact(self, collection: str) -> None:
+        """Fold the journal of a collection (of each of its partitions) into
+        its snapshot files; the wrapped backend must be a JournalBackend"""
+        if not self._field(collection):
+            return self.inner.compact(collection)
+        for month in self.partitions(collection):
+            self.inner.compact(self._part(collection, month))
+
+    def external_version(self, collection: str) -> Any:
+        if not self._field(collection):
+            return self.inner.external_version(collection)
+        return tuple((month, self.inner.external_version(self._part(collection, month)))
+                     for month in self.partitions(collection))
+
+    def exists(self, collection: str) -> bool:
+        if not self._field(collection):
+            return self.inner.exists(collection)
+        return os.path.exists(self._manifest_path(collection)) or self.inner.exists(collection)
+
+    def load(self, collection: str) -> Any:
+        if not self._field(collection):
+            return self.inner.load(collection)
+        data = []
+        for month in self.partitions(collection):
+            data.extend(self.inner.load(self._part(collection, month)))
+        return data
+
+    def iter_records(self, collection: str, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        if not self._field(collection):
+            yield from self.inner.iter_records(collection, batch_size)
+            return
+        for month in self.partitions(collection):
+            yield from self.inner.iter_records(self._part(collection, month), batch_size)
+
+    def count(self, collection: str) -> int:
+        if not self._field(collection):
+            return self.inner.count(collection)
+        return sum(self.inner.count(self._part(collection, m)) for m in self.partitions(collection))
+
+    def preload(self, collection: str) -> None:
+        if not self._field(collection):
+            return self.inner.preload(collection)
+        for month in self.partitions(collection):
+            self.inner.preload(self._part(collection, month))
+
+    def snapshot(self, *collections: str) -> Snapshot:
+        """Read-only view of collections at one moment; a partitioned
+        collection is one view over all of its monthly partitions"""
+        collections = collections or tuple(self.collections)
+        with self.inner.write_lock:
+            parts = {c: [self._part(c, m) for m in self.partitions(c)] if self._field(c) else [c]
+                     for c in collections}
+            inner = self.inner.snapshot(*[p for names in parts.values() for p in names])
+        frozen = {}
+        for collection, names in parts.items():
+            if self._field(collection):
+                frozen[collection] = FrozenCollection.concat([inner[p] for p in names])
+            else:
+                frozen[collection] = inner[collection]
+        return Snapshot(inner.version, frozen)
+
+    def save(self, collection: str, data: Any) -> None:
+        if not self._field(collection):
+            return self.inner.save(collection, data)
+        self._save_partitions(collection, data)
+
+    def get(self, collection: str, key: Any) -> Optional[Dict[str, Any]]:
+        if not self._field(collection):
+            return self.inner.get(collection, key)
+        month = self._locate(collection, key)
+        return None if month is None else self.inner.get(self._part(collection, month), key)
+
+    def insert(self, collection: str, record: Dict[str, Any], key: Any = None) -> None:
+        if not self._field(collection):
+            return self.inner.insert(collection, record, key)
+        month = self.month_of(record.get(self._field(collection)))
+        self._add_partitions(collection, [month])
+        self.inner.insert(self._part(collection, month), record)
+        self._remember(collection, record.get(self.collections[collection]['key']), month)
+
+    def insert_many(self, collection: str, records: List[Dict[str, Any]]) -> None:
+        if not self._field(collection):
+            return self.inner.insert_many(collection, records)
+        groups = self._group(collection, records)
+        self._add_partitions(collection, groups)
+        key_field = self.collections[collection]['key']
+        for month, group in groups.items():
+            self.inner.insert_many(self._part(collection, month), group)
+            for record in group:
+                self._remember(collection, record.get(key_field), month)
+
+    def update(self, collection: str, key: Any, changes: Dict[str, Any],
+               expected_version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        if not self._field(collection):
+            return self.inner.update(collection, key, changes, expected_version)
+        with self.inner.write_lock:
+            month = self._locate(collection, key)
+            if month is None:
+                return None
+            field = self._field(collection)
+            new_month = self.month_of(changes[field]) if field in changes else month
+            if new_month == month:
+                return self.inner.update(self._part(collection, month), key, changes, expected_version)
+
+            # The record moves to another month's partition
+            current = self.inner.get(self._part(collection, month), key)
+            record = {**current, **_versioned(collection, key, current, changes, expected_version)}
+            self._add_partitions(collection, [new_month])
+            with self.inner.transaction():
+                self.inner.delete(self._part(collection, month), key)
+                self.inner.insert(self._part(collection, new_month), record)
+            with self._lock:
+                self._key_months.get(collection, {})[key] = new_month
+            return record
+
+    def delete(self, collection: str, key: Any) -> bool:
+        if not self._field(collection):
+            return self.inner.delete(collection, key)
+        deleted = False
+        for month in self.partitions(collection):
+            deleted = self.inner.delete(self._part(collection, month), key) or deleted
+        with self._lock:
+            self._key_months.get(collection, {}).pop(key, None)
+        return deleted
+
+    def key_index(self, collection: str) -> Dict[Any, Dict[str, Any]]:
+        if not self._field(collection):
+            return self.inner.key_index(collection)
+        index: Dict[Any, Dict[str, Any]] = {}
+        for month in self.partitions(collection):
+            for key, record in self.inner.key_index(self._part(collection, month)).items():
+                index.setdefault(key, record)
+        return index
+
+    def find(self, collection: str, **criteria: Any) -> List[Dict[str, Any]]:
+        field = self._field(collection)
+        if not field:
+            return self.inner.find(collection, **criteria)
+        _index_group(collection, self.collections[collection], criteria)
+        if field in criteria:
+            month = self.month_of(criteria[field])
+            months = [month] if month in self.partitions(collection) else []
+        else:
+            months = self.partitions(collection)
+        results = []
+        for month in months:
+            results.extend(self.inner.find(self._part(collection, month), **criteria))
+        return results
+
+    def find_range(self, collection: str, field: str, low: Any = None,
+                   high: Any = None) -> List[Dict[str, Any]]:
+        if not self._field(collection):
+            return self.inner.find_range(collection, field, low, high)
+        _index_group(collection, self.collections[collection], (field,))
+        if field == self._field(collection):
+            months = self._months_between(collection, low, high)
+        else:
+            months = self.partitions(collection)
+        results = []
+        for month in months:
+            results.extend(self.inner.find_range(self._part(collection, month), field, low, high))
+        if field != self._field(collection) or self.UNDATED in months:
+            results.sort(key=lambda r: r.get(field))
+        return results
+
+
+class SQLiteBackend:
+    """Stores every collection in one SQLite database.
+
+    Each collection is a table of (pk, indexed fields..., body) rows where
+    body is the record as compact JSON. pk and the fields named in the
+    collection's 'indexes' get real B-tree indexes, so single-record reads
+    and writes cost O(log N) instead of rewriting the whole collection.
+    Insertion order is kept through the rowid.
+
+    Writes go through one connection under a lock. Reads use a connection
+    per thread (WAL lets them run alongside a write), except inside the
+    thread's own transaction, where they must see its uncommitted changes.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, db_path: str, collections: Dict[str, Dict[str, Any]] = COLLECTIONS):
+        self.db_path = db_path
+        self.collections = collections
+        self._lock = threading.RLock()
+        self._in_transaction = False
+        self._writer: Optional[int] = None  # thread whose write is open
+        self._readers = threading.local()
+        self._read_conns: List[sqlite3.Connection] = []
+        self.generation = 0  # writes committed through this backend
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self._create_schema()
+
+    def _reader(self) -> sqlite3.Connection:
+        """Connection for a read on the current thread"""
+        if self._writer == threading.get_ident():
+            return self.conn
+        conn = getattr(self._readers, 'conn', None)
+        if conn is None:
+            conn = self._readers.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._read_conns.append(conn)
+        return conn
+
+    @staticmethod
+    def _column(field: str) -> str:
+        return f'"f_{field}"'
+
+    def _index_fields(self, collection: str) -> List[str]:
+        fields = []
+        for group in self.collections[collection].get('indexes', []):
+            for field in group:
+                if field not in fields:
+                    fields.append(field)
+        return fields
+
+    def _create_schema(self) -> None:
+        with self._lock, self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            for collection in self.collections:
+                extra = ''.join(f', {self._column(f)}' for f in self._index_fields(collection))
+                self.conn.execute(
+                    f'CREATE TABLE IF NOT EXISTS "{collection}" (pk TEXT{extra}, body TEXT NOT NULL)')
+                self.conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS "{collection}_pk" ON "{collection}" (pk)')
+                for group in self.collections[collection].get('indexes', []):
+                    columns = ', '.join(self._column(f) for f in group)
+                    name = f'{collection}_' + '_'.join(group)
+                    self.conn.execute(
+                        f'CREATE INDEX IF NOT EXISTS "{name}" ON "{collection}" ({columns})')
+
+    def close(self) -> None:
+        for conn in self._read_conns:
+            conn.close()
+        self.conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """Run the block as one database transaction (rolled back if it raises).
+        Other threads wait for it to finish before writing."""
+        with self._lock:
+            if self._in_transaction:
+                yield
+                return
+            self._in_transaction = True
+            self._writer = threading.get_ident()
+            try:
+                with self.conn:
+                    self.conn.execute('BEGIN IMMEDIATE')
+                    yield
+                self.generation += 1
+            finally:
+                self._in_transaction = False
+                self._writer = None
+
+    @contextmanager
+    def _writing(self):
+        """Lock for a write; commit it unless a transaction() is open.
+        BEGIN IMMEDIATE takes SQLite's write lock before anything is read,
+        so a read-modify-write cannot interleave with another process."""
+        with self._lock:
+            if self._in_transaction:
+                yield
+                return
+            self._writer = threading.get_ident()
+            try:
+                with self.conn:
+                    self.conn.execute('BEGIN IMMEDIATE')
+                    yield
+                self.generation += 1
+            finally:
+                self._writer = None
+
+    def external_version(self, collection: str) -> Any:
+        """Token that changes when another connection (another process)
+        commits to the database; per database, not per collection"""
+        with self._lock:
+            return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._reader().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self._writing():
+            self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    @staticmethod
+    def _encode(record: Any) -> str:
+        return json.dumps(record, separators=(',', ':'))
+
+    @staticmethod
+    def _field_value(value: Any) -> Any:
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, separators=(',', ':'))
+        return value
+
+    def _row(self, collection: str, record: Dict[str, Any], key: Any = None) -> tuple:
+        spec = self.collections[collection]
+        if not _is_map(spec):
+            key = record.get(spec['key'])
+        fields = [self._field_value(record.get(f)) for f in self._index_fields(collection)]
+        return (None if key is None else str(key), *fields, self._encode(record))
+
+    def _insert_sql(self, collection: str) -> str:
+        fields = self._index_fields(collection)
+        columns = ', '.join(['pk'] + [self._column(f) for f in fields] + ['body'])
+        marks = ', '.join('?' * (len(fields) + 2))
+        return f'INSERT INTO "{collection}" ({columns}) VALUES ({marks})'
+
+    def exists(self, collection: str) -> bool:
+        """Whether the collection was ever written (it may be empty)"""
+        return self.get_meta(f'created:{collection}') is not None
+
+    def _mark_created(self, collection: str) -> None:
+        self.conn.execute('INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)',
+                          (f'created:{collection}', '1'))
+
+    def load(self, collection: str) -> Any:
+        rows = self._reader().execute(f'SELECT pk, body FROM "{collection}" ORDER BY rowid').fetchall()
+        if _is_map(self.collections[collection]):
+            return {pk: json.loads(body) for pk, body in rows}
+        return [json.loads(body) for _, body in rows]
+
+    def preload(self, collection: str) -> None:
+        """Nothing to do: SQLite reads rows on demand"""
+
+    def snapshot(self, *collections: str) -> Snapshot:
+        """Read-only view of collections at one moment. The rows are read
+        in one transaction on a separate connection, so they are consistent
+        with each other; unlike the file backends this parses a copy."""
+        collections = collections or tuple(self.collections)
+        version = self.generation
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute('BEGIN')
+            frozen = {}
+            for collection in collections:
+                rows = conn.execute(f'SELECT pk, body FROM "{collection}" ORDER BY rowid').fetchall()
+                if _is_map(self.collections[collection]):
+                    frozen[collection] = FrozenMap({pk: json.loads(body) for pk, body in rows})
+                else:
+                    frozen[collection] = FrozenCollection([[json.loads(body) for _, body in rows]])
+            conn.rollback()
+        finally:
+            conn.close()
+        return Snapshot(version, frozen)
+
+    def iter_records(self, collection: str, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """Stream records batch by batch from a separate read connection, which
+        sees one consistent snapshot and keeps memory flat for any table size"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.execute(f'SELECT body FROM "{collection}" ORDER BY rowid')
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for body, in rows:
+                    yield json.loads(body)
+        finally:
+            conn.close()
+
+    def count(self, collection: str) -> int:
+        return self._reader().execute(f'SELECT COUNT(*) FROM "{collection}"').fetchone()[0]
+
+    def save(self, collection: str, data: Any) -> None:
+        if isinstance(data, dict):
+            rows = [self._row(collection, record, key) for key, record in data.items()]
+        else:
+            rows = [self._row(collection, record) for record in data]
+        with self._writing():
+            self.conn.execute(f'DELETE FROM "{collection}"')
+            self.conn.executemany(self._insert_sql(collection), rows)
+            self._mark_created(collection)
+
+    def find(self, collection: str, **criteria: Any) -> List[Dict[str, Any]]:
+        group = _index_group(collection, self.collections[collection], criteria)
+        where = ' AND '.join(f'{self._column(f)} IS ?' for f in group)
+        rows = self._reader().execute(
+            f'SELECT body FROM "{collection}" WHERE {where} ORDER BY rowid',
+            [self._field_value(criteria[f]) for f in group]).fetchall()
+        return [json.loads(body) for body, in rows]
+
+    def find_range(self, collection: str, field: str, low: Any = None,
+                   high: Any = None) -> List[Dict[str, Any]]:
+        _index_group(collection, self.collections[collection], (field,))
+        column = self._column(field)
+        clauses, params = [f'{column} IS NOT NULL'], []
+        if low is not None:
+            clauses.append(f'{column} >= ?')
+            params.append(low)
+        if high is not None:
+            clauses.append(f'{column} <= ?')
+            params.append(high)
+        rows = self._reader().execute(
+            f'SELECT body FROM "{collection}" WHERE {" AND ".join(clauses)} ORDER BY {column}, rowid',
+            params).fetchall()
+        return [json.loads(body) for body, in rows]
+
+    def get(self, collection: str, key: Any) -> Optional[Dict[str, Any]]:
+        row = self._reader().execute(
+            f'SELECT body FROM "{collection}" WHERE pk = ? ORDER BY rowid LIMIT 1',
+            (str(key),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def insert(self, collection: str, record: Dict[str, Any], key: Any = None) -> None:
+        record = _stamped(record)
+        with self._writing():
+            if _is_map(self.collections[collection]):
+                self.conn.execute(f'DELETE FROM "{collection}" WHERE pk = ?', (str(key),))
+            self.conn.execute(self._insert_sql(collection), self._row(collection, record, key))
+            self._mark_created(collection)
+
+    def insert_many(self, collection: str, records: List[Dict[str, Any]]) -> None:
+        if _is_map(self.collections[collection]):
+            raise ValueError(f"insert_many is not supported for map collection {collection}")
+        records = [_stamped(record) for record in records]
+        with self._writing():
+            self.conn.executemany(self._insert_sql(collection),
+                                  [self._row(collection, record) for record in records])
+            self._mark_created(collection)
+
+    def update(self, collection: str, key: Any, changes: Dict[str, Any],
+               expected_version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        with self._writing():
+            row = self.conn.execute(
+                f'SELECT rowid, body FROM "{collection}" WHERE pk = ? ORDER BY rowid LIMIT 1',
+                (str(key),)).fetchone()
+            if row is None:
+                return None
+            current = json.loads(row[1])
+            record = {**current, **_versioned(collection, key, current, changes, expected_version)}
+            fields = self._index_fields(collection)
+            assignments = ', '.join(['pk = ?'] + [f'{self._column(f)} = ?' for f in fields] + ['body = ?'])
+            self.conn.execute(f'UPDATE "{collection}" SET {assignments} WHERE rowid = ?',
+                              (*self._row(collection, record, key), row[0]))
+            return record
+
+    def delete(self, collection: str, key: Any) -> bool:
+        with self._writing():
+            cursor = self.conn.execute(f'DELETE FROM "{collection}" WHERE pk = ?', (str(key),))
+            return cursor.rowcount > 0
+
+
+def migrate_json_to_sqlite(data_dir: str, db_path: str,
+                           collections: Dict[str, Dict[str, Any]] = COLLECTIONS) -> Dict[str, int]:
+    """One-shot copy of every JSON collection file into a SQLite database.
+
+    Existing rows for a migrated collection are replaced. Files wrapped as
+    {"<collection>": [...]} are unwrapped. Returns records copied per collection.
+    """
+    source = PartitionedBackend(JsonBackend(data_dir, collections, CollectionCache(enabled=False)),
+                                auto_migrate=False)
+    target = SQLiteBackend(db_path, collections)
+    copied = {}
+    try:
+        for collection, spec in collections.items():
+            if not source.exists(collection):
+                continue
+            data = source.load(collection)
+            if not _is_map(spec) and isinstance(data, dict):
+                data = data.get(collection, [])
+            target.save(collection, data)
+            copied[collection] = len(data)
+        target.set_meta('migrated_from_json', data_dir)
+    finally:
+        target.close()
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate hospital JSON data files into SQLite")
+    parser.add_argument('data_dir', help="Directory holding the JSON collection files")
+    parser.add_argument('db_path', nargs='?', help="SQLite database to create (default: <data_dir>/hospital.db)")
+    args = parser.parse_args()
+
+    db_path = args.db_path or os.path.join(args.data_dir, 'hospital.db')
+    for collection, count in migrate_json_to_sqlite(args.data_dir, db_path).items():
+        print(f"{collection}: {count} records")
+    print(f"Migrated into {db_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+"""Trigram full-text search over a few text fields of a collection.
+
+Each record's searchable fields are lowercased and split into trigrams
+(three-character slices); an inverted index maps every trigram to the
+records containing it. A substring search reads only the postings of the
+query's rarest trigram and checks those candidates, instead of
+lowercasing and scanning every record on each keystroke. Misspelled
+queries still find records sharing most of their trigrams ('andersn'
+finds 'Anderson'). Terms of one or two characters match at word starts.
+
+Results are ranked: whole-field matches first, then field prefixes, word
+prefixes, other substrings, and finally typo matches by similarity.
+
+TextSearch keeps one index per collection in step with an EventBus, so
+after the first search (or warm-up) it is only patched. Changes made by
+other processes raise no events; when the backend's external_version()
+of a collection moves, its index is built again on the next search.
+"""
+import heapq
+import math
+import threading
+from array import array
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+# Searchable fields of the collections offered in the search boxes
+SEARCH_FIELDS = {
+    'patients': ('name', 'id', 'contact', 'disease'),
+    'pharmacy': ('name', 'category'),
+    'billing': ('bill_no', 'patient_name'),
+}
+
+# Rows a search box shows for a non-empty term (the best matches)
+SEARCH_LIMIT = 500
+
+# Joins a record's fields so a match never spans two of them
+SEPARATOR = '\x1f'
+
+# Rank classes, best first
+EXACT, FIELD_PREFIX, WORD_PREFIX, SUBSTRING, SIMILAR = range(5)
+
+
+def trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _padded(text: str) -> Set[str]:
+    """Trigrams with word boundaries marked, so word starts and ends count too"""
+    return trigrams(' ' + text.replace(SEPARATOR, ' ') + ' ')
+
+
+class TrigramIndex:
+    """Inverted trigram index over fields of records identified by key.
+
+    Postings are int arrays of document numbers (4 bytes per entry). A
+    changed or removed record leaves its old document number behind as a
+    tombstone, skipped on lookup; once tombstones outnumber live records
+    the postings are rebuilt.
+    """
+
+    def __init__(self, fields: Iterable[str], min_similarity: float = 0.5, fuzzy_budget: int = 20_000):
+        self.fields = tuple(fields)
+        self.min_similarity = min_similarity
+        self.fuzzy_budget = fuzzy_budget
+        self._docs: Dict[Any, int] = {}
+        self._keys: List[Any] = []
+        self._texts: List[Optional[str]] = []
+        self._postings: Dict[str, array] = {}
+        self._dead = 0
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def text(self, record: Dict[str, Any]) -> str:
+        return SEPARATOR.join(str(record.get(f) or '').lower() for f in self.fields)
+
+    def add(self, key: Any, record: Dict[str, Any]) -> None:
+        """Index record under key, replacing what key had before"""
+        self.remove(key)
+        text = self.text(record)
+        doc = len(self._texts)
+        self._docs[key] = doc
+        self._keys.append(key)
+        self._texts.append(text)
+        for gram in _padded(text):
+            postings = self._postings.get(gram)
+            if postings is None:
+                postings = self._postings[gram] = array('i')
+            postings.append(doc)
+
+    def build(self, items: Iterable[Any]) -> None:
+        """Index many (key, record) pairs; the fast path for a fresh index"""
+        docs, keys, texts, postings = self._docs, self._keys, self._texts, self._postings
+        text_of = self.text
+        for key, record in items:
+            if key in docs:
+                self.add(key, record)
+                continue
+            text = text_of(record)
+            doc = len(texts)
+            docs[key] = doc
+            keys.append(key)
+            texts.append(text)
+            padded = ' ' + text.replace(SEPARATOR, ' ') + ' '
+            for gram in {padded[i:i + 3] for i in range(len(padded) - 2)}:
+                entries = postings.get(gram)
+                if entries is None:
+                    entries = postings[gram] = array('i')
+                entries.append(doc)
+
+    def remove(self, key: Any) -> None:
+        doc = self._docs.pop(key, None)
+        if doc is None:
+            return
+        self._texts[doc] = None
+        self._dead += 1
+        if self._dead > max(1000, len(self._docs)):
+            self._compact()
+
+    def _compact(self) -> None:
+        live = [(self._keys[doc], self._texts[doc]) for doc in sorted(self._docs.values())]
+        self._docs, self._keys, self._texts, self._postings, self._dead = {}, [], [], {}, 0
+        for key, text in live:
+            doc = len(self._texts)
+            self._docs[key] = doc
+            self._keys.append(key)
+            self._texts.append(text)
+            for gram in _padded(text):
+                postings = self._postings.get(gram)
+                if postings is None:
+                    postings = self._postings[gram] = array('i')
+                postings.append(doc)
+
+    def _substring_docs(self, term: str) -> Set[int]:
+        texts = self._texts
+        if len(term) < 3:
+            # Too short for a trigram of its own: match at word starts, which
+            # the padded trigrams ' ab' (or ' a?' for one letter) mark
+            start = ' ' + term
+            candidates = {doc for gram, postings in self._postings.items() if gram.startswith(start)
+                          for doc in postings}
+            return {doc for doc in candidates if texts[doc] is not None}
+        rarest = min((self._postings.get(g, ()) for g in trigrams(term)), key=len)
+        return {doc for doc in rarest if texts[doc] is not None and term in texts[doc]}
+
+    def _similar_docs(self, term: str, exclude: Set[int]) -> Dict[int, float]:
+        """Documents sharing at least min_similarity of the term's trigrams"""
+        grams = _padded(term)
+        need = max(1, math.ceil(self.min_similarity * len(grams)))
+        # A document with `need` shared trigrams must be in one of the
+        # len(grams) - need + 1 rarest postings, so only those are read.
+        # Past the budget the rest are skipped: trigrams that common say
+        # little about a typo, and reading them would scan the collection.
+        postings = sorted((self._postings.get(g, ()) for g in grams), key=len)
+        candidates: Set[int] = set()
+        budget = self.fuzzy_budget
+        for p in postings[:len(grams) - need + 1]:
+            if candidates and len(p) > budget:
+                break
+            candidates.update(p)
+            budget -= len(p)
+        candidates -= exclude
+        similar = {}
+        texts = self._texts
+        for doc in candidates:
+            text = texts[doc]
+            if text is None:
+                continue
+            padded = ' ' + text.replace(SEPARATOR, ' ') + ' '
+            shared = sum(1 for g in grams if g in padded)
+            if shared >= need:
+                similar[doc] = shared / len(grams)
+        return similar
+
+    @staticmethod
+    def _rank_class(term: str, text: str) -> int:
+        bounded = SEPARATOR + text + SEPARATOR
+        if SEPARATOR + term + SEPARATOR in bounded:
+            return EXACT
+        if SEPARATOR + term in bounded:
+            return FIELD_PREFIX
+        if ' ' + term in text:
+            return WORD_PREFIX
+        return SUBSTRING
+
+    def search(self, term: str, limit: Optional[int] = None, fuzzy: bool = True) -> List[Any]:
+        """Keys of matching records, best first. An empty term matches
+        everything, in insertion order."""
+        term = term.lower().strip()
+        if not term:
+            keys = [self._keys[doc] for doc in sorted(self._docs.values())]
+            return keys if limit is None else keys[:limit]
+        texts = self._texts
+        docs = self._substring_docs(term)
+        ranked = [(self._rank_class(term, texts[doc]), 0.0, len(texts[doc]), doc) for doc in docs]
+        # Typo matches rank last, so they are only looked for to fill the limit
+        if fuzzy and len(term) >= 3 and (limit is None or len(ranked) < limit):
+            ranked.extend((SIMILAR, -similarity, len(texts[doc]), doc)
+                          for doc, similarity in self._similar_docs(term, docs).items())
+        ranked = heapq.nsmallest(limit, ranked) if limit is not None else sorted(ranked)
+        return [self._keys[doc] for *_, doc in ranked]
+
+    def matches(self, term: str, record: Dict[str, Any], fuzzy: bool = True) -> bool:
+        """Whether search(term) would return record"""
+        term = term.lower().strip()
+        text = self.text(record)
+        if len(term) < 3:
+            return not term or ' ' + term in ' ' + text.replace(SEPARATOR, ' ')
+        if term in text:
+            return True
+        if not fuzzy:
+            return False
+        grams = _padded(term)
+        return len(grams & _padded(text)) >= max(1, math.ceil(self.min_similarity * len(grams)))
+
+
+class TextSearch:
+    """A TrigramIndex per searchable collection, kept current from an EventBus.
+
+    An index is built from the backend on first use (or by warm-up) and
+    then patched by every change event, so a search only rescans the
+    collection after another process changed it.
+    """
+
+    def __init__(self, backend: Any, bus: Any, fields: Dict[str, Iterable[str]] = SEARCH_FIELDS):
+        self.backend = backend
+        self.fields = {c: tuple(f) for c, f in fields.items()}
+        self._indexes: Dict[str, TrigramIndex] = {}
+        self._versions: Dict[str, Any] = {}  # backend.external_version() each index was built at
+        self._lock = threading.RLock()
+        bus.subscribe(self._on_change, *self.fields)
+
+    def _key(self, collection: str, record: Dict[str, Any]) -> Any:
+        return record.get(self.backend.collections[collection]['key'])
+
+    def index(self, collection: str) -> TrigramIndex:
+        """The collection's index, built now if needed"""
+        if collection not in self.fields:
+            raise ValueError(f"No text search on {collection}")
+        with self._lock:
+            version = self.backend.external_version(collection)
+            index = self._indexes.get(collection)
+            if index is None or version != self._versions.get(collection):
+                self._versions[collection] = version
+                index = TrigramIndex(self.fields[collection])
+                index.build((self._key(collection, r), r) for r in self.backend.iter_records(collection))
+                self._indexes[collection] = index
+            return index
+
+    def rebuild(self, collection: Optional[str] = None) -> None:
+        """Drop indexes (one or all) so the next search reads the collection again"""
+        with self._lock:
+            if collection is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(collection, None)
+
+    def search(self, collection: str, term: str, limit: Optional[int] = None,
+               where: Optional[Callable[[Dict[str, Any]], bool]] = None) -> List[Dict[str, Any]]:
+        """At most limit records matching term, best first; where filters
+        them further. An empty term returns every record (that passes
+        where) in stored order, without a limit, as an unfiltered table."""
+        if not term.strip():
+            records = self.backend.iter_records(collection)
+            return list(records if where is None else filter(where, records))
+        with self._lock:
+            keys = self.index(collection).search(term, None if where else limit)
+        results = []
+        for key in keys:
+            record = self.backend.get(collection, key)
+            if record is None or (where is not None and not where(record)):
+                continue
+            results.append(record)
+            if limit is not None and len(results) >= limit:
+                break
+        return results
+
+    def matches(self, collection: str, term: str, record: Dict[str, Any]) -> bool:
+        """Whether a search for term would return record (for patching open tables)"""
+        index = self._indexes.get(collection) or TrigramIndex(self.fields[collection])
+        return index.matches(term, record)
+
+    def _on_change(self, event: Any) -> None:
+        with self._lock:
+            index = self._indexes.get(event.collection)
+            if index is None:
+                return  # built from the backend when first needed
+            if event.op == 'reload':
+                del self._indexes[event.collection]
+            elif event.op == 'delete':
+                index.remove(event.key)
+            else:
+                index.add(event.key, event.new)